@@ -1,10 +1,12 @@
-import json
 import os
 
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 
+from auto_od.helper.coco_cache import load_coco
+from auto_od.helper.coco_index import CocoIndex
+
 
 class ImageAnnotationViewer:
     """
@@ -13,8 +15,8 @@ class ImageAnnotationViewer:
     Attributes:
         image_folder (str): The folder containing the images.
         json_file (str): The JSON file containing the annotations.
+        index (CocoIndex): The loaded annotations, indexed by file name and image id.
         annotations (dict): The loaded annotations from the JSON file.
-        image_id_map (dict): A mapping from image filenames to their IDs.
         images (list): Sorted list of image filenames.
         current_image_index (int): Index of the currently displayed image.
         fig (matplotlib.figure.Figure): Matplotlib figure object.
@@ -35,8 +37,8 @@ class ImageAnnotationViewer:
         """
         self.json_file = json_file
         self.image_folder = image_folder
-        self.annotations = self.load_annotations()
-        self.image_id_map = {img['file_name']: img['id'] for img in self.annotations['images']}
+        self.index = CocoIndex.from_file(self.json_file)
+        self.annotations = self.index.data
         self.images = sorted(os.listdir(image_folder))
         self.current_image_index = 0
 
@@ -54,10 +56,8 @@ class ImageAnnotationViewer:
         plt.show()
 
     def load_annotations(self):
-        """! Loads annotations from the JSON file."""
-        with open(self.json_file, 'r') as file:
-            data = json.load(file)
-        return data
+        """! Loads annotations from the JSON file or its columnar cache."""
+        return load_coco(self.json_file)
 
     def show_image(self, img_path, img_annotations):
         """
@@ -91,8 +91,8 @@ class ImageAnnotationViewer:
         """Updates the display with the current image and its annotations."""
         img_file = self.images[self.current_image_index]
         img_path = os.path.join(self.image_folder, img_file)
-        img_id = self.image_id_map.get(img_file)
-        img_annotations = [ann for ann in self.annotations['annotations'] if ann['image_id'] == img_id]
+        image = self.index.image_by_filename(img_file)
+        img_annotations = self.index.annotations_for(image['id']) if image is not None else []
         self.show_image(img_path, img_annotations)
 
 
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+# pHash: 32x32 grayscale -> 2D DCT -> the 8x8 lowest frequencies compared with their median.
+IMG_SIZE = 32
+HASH_SIZE = 8
+_DCT = np.sqrt(2 / IMG_SIZE) * np.cos(np.pi * (2 * np.arange(IMG_SIZE)[None, :] + 1)
+                                      * np.arange(HASH_SIZE)[:, None] / (2 * IMG_SIZE))
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def phash(path: str) -> int | None:
+    """
+    Perceptual hash of an image, robust to resizing, recompression and small color changes.
+
+    Args:
+        path (str): Image path.
+
+    Returns:
+        int | None: 64-bit hash, or None if the image cannot be read.
+    """
+    try:
+        with Image.open(path) as img:
+            # JPEG only: decode at a reduced scale in the DCT domain, much faster than a full decode.
+            img.draft('L', (IMG_SIZE * 2, IMG_SIZE * 2))
+            pixels = np.asarray(img.convert('L').resize((IMG_SIZE, IMG_SIZE), Image.BILINEAR), dtype=np.float64)
+    except Exception:
+        return None
+    coefficients = (_DCT @ pixels @ _DCT.T).ravel()
+    bits = coefficients > np.median(coefficients[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Number of set bits of every uint64 value."""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _pairs_within_groups(keys: np.ndarray, hashes: np.ndarray, max_distance: int) -> np.ndarray:
+    """Pairs of rows that share a key and whose hashes are within max_distance bits, without a Python loop per row."""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_hashes = hashes[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    sizes = np.diff(np.append(starts, len(keys)))
+    # Rows left in the group after each sorted row.
+    remaining = np.repeat(starts + sizes, sizes) - np.arange(len(keys)) - 1
+    pairs = []
+    active = None
+    for offset in range(1, int(sizes.max()) if len(sizes) else 0):
+        if active is None and np.count_nonzero(sizes > offset) * 8 < len(sizes):
+            active = np.flatnonzero(remaining >= offset)
+        if active is None:
+            # Most groups are still this long: compare shifted slices, contiguous and cheap.
+            close = (remaining[:-offset] >= offset) & (
+                    popcount64(sorted_hashes[:-offset] ^ sorted_hashes[offset:]) <= max_distance)
+            left = np.flatnonzero(close)
+        else:
+            active = active[remaining[active] >= offset]
+            close = popcount64(sorted_hashes[active] ^ sorted_hashes[active + offset]) <= max_distance
+            left = active[close]
+        pairs.append(np.column_stack([order[left], order[left + offset]]))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+
+def near_duplicate_pairs(hashes: np.ndarray, max_distance: int = 4) -> np.ndarray:
+    """
+    Find all pairs of hashes within max_distance bits.
+
+    Identical hashes are collapsed first. By the pigeonhole principle two hashes within
+    max_distance bits agree exactly on at least one of max_distance + 1 bit bands, so only
+    hashes that share a band value are compared.
+
+    Args:
+        hashes (np.ndarray): uint64 hashes.
+        max_distance (int): Largest Hamming distance of a near-duplicate.
+
+    Returns:
+        np.ndarray: (M, 2) row indices of duplicate pairs, enough to connect every duplicate group.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    unique, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    # Exact duplicates are linked to the first row with their hash.
+    repeated = np.flatnonzero(first[inverse] != np.arange(len(hashes)))
+    pairs = [np.column_stack([first[inverse[repeated]], repeated])]
+
+    if max_distance > 0 and len(unique) > 1:
+        bands = min(max_distance + 1, 64)
+        bounds = np.linspace(0, 64, bands + 1).astype(int)
+        found = []
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            keys = (unique >> np.uint64(low)) & np.uint64((1 << int(high - low)) - 1)
+            found.append(_pairs_within_groups(keys, unique, max_distance))
+        found = np.concatenate(found)
+        if len(found):
+            found = np.unique(np.sort(found, axis=1), axis=0)
+            pairs.append(first[found])
+    return np.concatenate(pairs).astype(np.int64)
+
+
+def connected_groups(n: int, pairs: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components of a graph given as an edge list.
+
+    Args:
+        n (int): Number of nodes.
+        pairs (np.ndarray): (M, 2) edges.
+
+    Returns:
+        np.ndarray: Component label of every node, the smallest node index in the component.
+    """
+    labels = np.arange(n)
+    if not len(pairs):
+        return labels
+    left, right = pairs[:, 0], pairs[:, 1]
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, low)
+        np.minimum.at(updated, right, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def list_images(directory: str) -> list:
+    """All images under a directory, recursively, in sorted order."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+class DuplicateDetector:
+    """
+    Finds exact and near-duplicate images by perceptual hash.
+
+    Attributes:
+        max_distance (int): Largest Hamming distance between the hashes of near-duplicates.
+        workers (int): Number of hashing processes.
+        cache_path (str): .npz file with hashes of earlier runs, reused while path, size and mtime match.
+        failed (list): Images that could not be hashed in the last call.
+    """
+
+    def __init__(self, max_distance: int = 4, workers: int = None, cache_path: str = None):
+        """
+        Args:
+            max_distance (int): Largest Hamming distance of 64-bit pHashes still counted as duplicates.
+            workers (int, optional): Number of hashing processes. Defaults to the number of CPUs.
+            cache_path (str, optional): Hash cache file. Defaults to None (no cache).
+        """
+        self.max_distance = max_distance
+        self.workers = workers or os.cpu_count()
+        self.cache_path = cache_path
+        self.failed = []
+
+    def _load_cache(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        with np.load(self.cache_path) as cache:
+            return {path: (stamp, value) for path, stamp, value in
+                    zip(cache['paths'].tolist(), map(tuple, cache['stamps'].tolist()), cache['hashes'].tolist())}
+
+    def _map(self, function, tasks: list) -> list:
+        if self.workers == 1 or len(tasks) < 64:
+            return list(map(function, tasks))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, tasks, chunksize=max(1, len(tasks) // (self.workers * 16))))
+
+    def hash_images(self, paths: list) -> tuple:
+        """
+        Hash images in parallel.
+
+        Args:
+            paths (list): Image paths.
+
+        Returns:
+            tuple: uint64 hash per path and a mask of the images that could be read;
+                the others are listed in failed.
+        """
+        cache = self._load_cache()
+        stamps = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamps.append((-1, -1))
+        values = [cache[path][1] if path in cache and cache[path][0] == stamp else None
+                  for path, stamp in zip(paths, stamps)]
+        missing = [i for i, value in enumerate(values) if value is None]
+        for i, value in zip(missing, self._map(phash, [paths[i] for i in missing])):
+            values[i] = value
+
+        self.failed = [path for path, value in zip(paths, values) if value is None]
+        readable = np.array([value is not None for value in values], dtype=bool)
+        hashes = np.array([value or 0 for value in values], dtype=np.uint64)
+        if self.cache_path:
+            np.savez(self.cache_path, paths=np.array(paths, dtype=np.str_)[readable],
+                     stamps=np.array(stamps, dtype=np.int64).reshape(-1, 2)[readable], hashes=hashes[readable])
+        return hashes, readable
+
+    def groups(self, paths: list) -> np.ndarray:
+        """
+        Group duplicate images.
+
+        Args:
+            paths (list): Image paths.
+
+        Returns:
+            np.ndarray: Group label per path; duplicates share a label, other images (and unreadable ones)
+                have their own.
+        """
+        hashes, readable = self.hash_images(paths)
+        rows = np.flatnonzero(readable)
+        return connected_groups(len(paths), rows[near_duplicate_pairs(hashes[rows], self.max_distance)])
+
+    def report(self, splits: dict) -> dict:
+        """
+        Find duplicates inside and across image sets.
+
+        Args:
+            splits (dict): Set name -> list of image paths, e.g. {'train': [...], 'test': [...]}.
+
+        Returns:
+            dict: 'summary' with image, group and leaked image counts, 'leaks' - number of images
+                per pair of sets that have a duplicate in the other set, and 'groups' - every duplicate
+                group with its members, the leaking ones first.
+        """
+        names = list(splits)
+        paths = [path for name in names for path in splits[name]]
+        split_of = np.repeat(np.arange(len(names)), [len(splits[name]) for name in names])
+        labels = self.groups(paths)
+
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_labels[1:] != sorted_labels[:-1]))) \
+            if len(labels) else np.zeros(0, dtype=np.int64)
+        ends = np.append(starts[1:], len(labels))
+        groups = []
+        leaks = {}
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            group_splits = sorted({names[i] for i in split_of[members]})
+            groups.append({'leak': len(group_splits) > 1, 'splits': group_splits,
+                           'members': [{'split': names[split_of[i]], 'path': paths[i]} for i in members]})
+            for a in group_splits:
+                for b in group_splits:
+                    if a < b:
+                        key = f'{a}/{b}'
+                        leaks[key] = leaks.get(key, 0) + sum(1 for i in members if names[split_of[i]] in (a, b))
+        groups.sort(key=lambda group: (not group['leak'], -len(group['members'])))
+        return {
+            'max_distance': self.max_distance,
+            'summary': {'images': len(paths),
+                        'unreadable': len(self.failed),
+                        'duplicate_groups': len(groups),
+                        'images_in_groups': sum(len(group['members']) for group in groups),
+                        'leaking_groups': sum(group['leak'] for group in groups)},
+            'leaks': leaks,
+            'unreadable': self.failed,
+            'groups': groups,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate images and leakage between image sets.")
+    parser.add_argument('sets', nargs='+', metavar='NAME=DIR', help="image sets, e.g. train=data/train test=data/test")
+    parser.add_argument('--max-distance', type=int, default=4, help="Hamming distance of 64-bit pHashes")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--cache', help=".npz file to keep hashes between runs")
+    parser.add_argument('--report', default='duplicates_report.json')
+    args = parser.parse_args()
+
+    splits = {}
+    for item in args.sets:
+        name, _, directory = item.partition('=')
+        splits[name if directory else os.path.basename(os.path.normpath(name))] = list_images(directory or name)
+
+    detector = DuplicateDetector(args.max_distance, args.workers, args.cache)
+    report = detector.report(splits)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    for key, value in report['summary'].items():
+        print(f"{key}: {value}")
+    for key, value in report['leaks'].items():
+        print(f"leaked {key}: {value}")
+    print(f"Report: {args.report}")
+    return 1 if report['leaks'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from auto_od.helper.archive import file_stat, list_files, open_file
+from auto_od.helper.coco_cache import dense_index, load_columns
+
+# EXIF orientations that rotate the image by 90 degrees; cv2/mmcv apply them on load.
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+# End-of-image markers looked for near the end of the file; a missing marker means a truncated image.
+END_MARKERS = {'PNG': (b'IEND', 64), 'JPEG': (b'\xff\xd9', 1024)}
+# Boxes may stick out of the image by this many pixels (VOC coordinates are 1-based).
+BOUNDS_TOLERANCE = 1.0
+
+ISSUES = ('missing_file', 'unreadable', 'truncated', 'decode_error', 'missing_size', 'size_mismatch',
+          'unknown_image', 'unknown_category', 'zero_area', 'bbox_out_of_bounds', 'duplicate_box')
+
+
+def probe_image(path: str, verify: bool = False) -> dict:
+    """
+    Read the size of an image from its header, without decoding the pixels.
+
+    Args:
+        path (str): Image path.
+        verify (bool): Also decode the whole image.
+
+    Returns:
+        dict: 'width' and 'height' as a model loads the image (EXIF rotation applied), 'format',
+            'orientation' and 'issue'/'detail' when the file is missing, unreadable, truncated or fails to decode.
+    """
+    result = {'width': 0, 'height': 0, 'format': None, 'orientation': 1}
+    try:
+        with open_file(path) as f, Image.open(f) as img:
+            width, height = img.size
+            result['format'] = img.format
+            orientation = img.getexif().get(EXIF_ORIENTATION, 1) if img.format in ('JPEG', 'TIFF', 'WEBP') else 1
+            if orientation in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            result.update(width=width, height=height, orientation=orientation)
+            if verify:
+                img.load()
+    except FileNotFoundError:
+        return dict(result, issue='missing_file', detail=path)
+    except Exception as e:
+        issue = 'decode_error' if result['format'] else 'unreadable'
+        return dict(result, issue=issue, detail=f"{type(e).__name__}: {e}")
+
+    marker = END_MARKERS.get(result['format'])
+    if marker is not None:
+        tail_bytes, tail_size = marker
+        with open_file(path) as f:
+            f.seek(max(file_stat(path)[0] - tail_size, 0))
+            if tail_bytes not in f.read():
+                return dict(result, issue='truncated', detail=f"no end marker in the last {tail_size} bytes")
+    return result
+
+
+def _probe_task(task: tuple) -> dict:
+    return probe_image(*task)
+
+
+def parse_voc(xml_path: str) -> dict:
+    """
+    Read the boxes and image size of a PASCAL VOC annotation.
+
+    Args:
+        xml_path (str): Annotation file.
+
+    Returns:
+        dict: 'filename', annotated 'width' and 'height' (0 if absent), 'boxes' as (name, x, y, w, h) tuples.
+    """
+    with open_file(xml_path) as f:
+        root = ET.parse(f).getroot()
+
+    def number(element, tag: str) -> float:
+        text = element.findtext(tag) if element is not None else None
+        return float(text) if text and text.strip() else 0.0
+
+    size = root.find('size')
+    boxes = []
+    for obj in root.iter('object'):
+        bndbox = obj.find('bndbox')
+        xmin, ymin = number(bndbox, 'xmin'), number(bndbox, 'ymin')
+        boxes.append((obj.findtext('name', '').strip(), xmin, ymin,
+                      number(bndbox, 'xmax') - xmin, number(bndbox, 'ymax') - ymin))
+    filename = root.findtext('filename') or os.path.splitext(os.path.basename(xml_path))[0] + '.jpg'
+    return {'filename': filename.strip(), 'width': int(number(size, 'width')),
+            'height': int(number(size, 'height')), 'boxes': boxes}
+
+
+def _voc_task(task: tuple) -> dict:
+    xml_path, image_dir, verify = task
+    try:
+        annotation = parse_voc(xml_path)
+    except (ET.ParseError, ValueError) as e:
+        return {'xml': xml_path, 'issue': 'unreadable', 'detail': f"{type(e).__name__}: {e}"}
+    annotation['xml'] = xml_path
+    annotation['probe'] = probe_image(os.path.join(image_dir, annotation['filename']), verify)
+    return annotation
+
+
+class DatasetChecker:
+    """
+    Checks that a COCO or PASCAL VOC dataset can be trained on.
+
+    Images are probed in a process pool, reading only their headers unless verify is set;
+    annotated sizes and boxes are then checked with vectorized NumPy over all annotations.
+
+    Attributes:
+        annotation_path (str): COCO JSON file (or its columnar cache), or a directory of VOC XML files;
+            either may be inside a zip archive, e.g. 'annotations.zip/content/annotations'.
+        image_dir (str): Directory the image file names are relative to.
+        dataset_format (str): 'coco' or 'voc'.
+        verify (bool): Decode every image fully.
+        workers (int): Number of worker processes.
+        issues (list): Issues found by the last run.
+    """
+
+    def __init__(self, annotation_path: str, image_dir: str = None, dataset_format: str = 'coco',
+                 verify: bool = False, workers: int = None, build_cache: bool = False):
+        """
+        Args:
+            annotation_path (str): COCO JSON file (or its columnar cache), or a directory of VOC XML files;
+                either may be inside a zip archive, e.g. 'annotations.zip/content/annotations'.
+            image_dir (str, optional): Image directory. Defaults to the annotation file's directory for COCO
+                and to the annotation directory for VOC.
+            dataset_format (str): 'coco' or 'voc'.
+            verify (bool): Decode every image fully, not just its header.
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+            build_cache (bool): Write the columnar cache next to a COCO file when it is missing or stale;
+                by default a fresh cache is used, but the dataset is not written to.
+        """
+        if dataset_format not in ('coco', 'voc'):
+            raise ValueError(f"Unsupported dataset format '{dataset_format}'")
+        self.annotation_path = annotation_path
+        default_dir = annotation_path if dataset_format == 'voc' else os.path.dirname(annotation_path)
+        self.image_dir = image_dir or default_dir
+        self.dataset_format = dataset_format
+        self.verify = verify
+        self.workers = workers or os.cpu_count()
+        self.build_cache = build_cache
+        self.issues = []
+
+    def _map(self, function, tasks: list) -> list:
+        chunksize = max(1, len(tasks) // (self.workers * 8))
+        if self.workers == 1 or len(tasks) < 64:
+            return list(map(function, tasks))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, tasks, chunksize=chunksize))
+
+    def _add(self, issue: str, file_name: str, **fields):
+        self.issues.append({'issue': issue, 'file_name': file_name, **fields})
+
+    def _check_images(self, file_names: list, annotated: np.ndarray, probes: list) -> np.ndarray:
+        """Record image issues; returns (N, 2) sizes to check boxes against, 0 where unknown."""
+        sizes = np.array([(probe['width'], probe['height']) for probe in probes], dtype=np.float32).reshape(-1, 2)
+        for i, (file_name, probe) in enumerate(zip(file_names, probes)):
+            if 'issue' in probe:
+                self._add(probe['issue'], file_name, detail=probe['detail'])
+            annotated_size = annotated[i].tolist()
+            if not all(annotated_size):
+                self._add('missing_size', file_name, detail="width/height not annotated")
+            elif probe['width'] and annotated_size != [probe['width'], probe['height']]:
+                detail = f"annotated {annotated_size[0]}x{annotated_size[1]}, image {probe['width']}x{probe['height']}"
+                if probe['orientation'] in ROTATED_ORIENTATIONS:
+                    detail += f" after EXIF orientation {probe['orientation']}"
+                self._add('size_mismatch', file_name, detail=detail)
+        # Boxes of unreadable images are checked against the annotated size.
+        unknown = sizes[:, 0] == 0
+        sizes[unknown] = annotated[unknown]
+        return sizes
+
+    def _check_boxes(self, file_names: list, sizes: np.ndarray, image_rows: np.ndarray, category_rows: np.ndarray,
+                     bboxes: np.ndarray, ann_ids: np.ndarray):
+        """Zero-area, out-of-bounds and duplicate boxes; rows of -1 mark unknown images or categories."""
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+
+        def add_all(issue: str, mask: np.ndarray, detail):
+            for i in np.flatnonzero(mask):
+                row = image_rows[i]
+                self._add(issue, file_names[row] if row >= 0 else None, annotation_id=int(ann_ids[i]),
+                          bbox=[round(float(v), 2) for v in bboxes[i]], detail=detail(i))
+
+        add_all('unknown_image', image_rows < 0, lambda i: "annotation refers to an image that is not in the set")
+        add_all('unknown_category', category_rows < 0, lambda i: "category is not in the category list")
+        zero_area = (bboxes[:, 2] <= 0) | (bboxes[:, 3] <= 0)
+        add_all('zero_area', zero_area, lambda i: "width or height is not positive")
+
+        known = image_rows >= 0
+        box_sizes = np.zeros((len(bboxes), 2), dtype=np.float32)
+        box_sizes[known] = sizes[image_rows[known]]
+        has_size = known & (box_sizes[:, 0] > 0)
+        outside = has_size & ~zero_area & (
+                (bboxes[:, 0] < -BOUNDS_TOLERANCE) | (bboxes[:, 1] < -BOUNDS_TOLERANCE)
+                | (bboxes[:, 0] + bboxes[:, 2] > box_sizes[:, 0] + BOUNDS_TOLERANCE)
+                | (bboxes[:, 1] + bboxes[:, 3] > box_sizes[:, 1] + BOUNDS_TOLERANCE))
+        add_all('bbox_out_of_bounds', outside,
+                lambda i: f"image {int(box_sizes[i, 0])}x{int(box_sizes[i, 1])}")
+
+        # Same image, class and box (to 0.1 px): every repeat after the first is reported.
+        keys = np.column_stack([image_rows, category_rows, np.round(bboxes * 10).astype(np.int64)])
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        duplicate = np.arange(len(keys)) != first[inverse.ravel()]
+        add_all('duplicate_box', duplicate,
+                lambda i: f"same as annotation {int(ann_ids[first[inverse.ravel()[i]]])}")
+
+    def check_coco(self):
+        columns = load_columns(self.annotation_path, build=self.build_cache)
+        file_names = columns.img_file_names.tolist()
+        probes = self._map(_probe_task, [(os.path.join(self.image_dir, name), self.verify) for name in file_names])
+        annotated = np.column_stack([columns.img_widths, columns.img_heights]).astype(np.int64)
+        sizes = self._check_images(file_names, annotated, probes)
+
+        image_rows = dense_index(columns.img_ids, columns.image_ids)
+        category_ids = np.array([category['id'] for category in columns.categories], dtype=np.int64)
+        category_rows = dense_index(category_ids, columns.category_ids)
+        self._check_boxes(file_names, sizes, image_rows, category_rows, columns.bboxes, columns.ann_ids)
+        return len(file_names), len(columns.ann_ids)
+
+    def check_voc(self):
+        xml_files = list_files(self.annotation_path, ('.xml',))
+        results = self._map(_voc_task, [(path, self.image_dir, self.verify) for path in xml_files])
+        parsed = []
+        for result in results:
+            if 'probe' in result:
+                parsed.append(result)
+            else:
+                self._add(result['issue'], os.path.basename(result['xml']), detail=result['detail'])
+        file_names = [result['filename'] for result in parsed]
+        annotated = np.array([(result['width'], result['height']) for result in parsed],
+                             dtype=np.int64).reshape(-1, 2)
+        sizes = self._check_images(file_names, annotated, [result['probe'] for result in parsed])
+
+        counts = [len(result['boxes']) for result in parsed]
+        boxes = [box for result in parsed for box in result['boxes']]
+        image_rows = np.repeat(np.arange(len(parsed)), counts)
+        names = sorted({box[0] for box in boxes})
+        category_rows = np.searchsorted(names, [box[0] for box in boxes]).astype(np.int64) if boxes \
+            else np.zeros(0, dtype=np.int64)
+        bboxes = np.array([box[1:] for box in boxes], dtype=np.float32).reshape(-1, 4)
+        # VOC objects have no ids; their number in the file is reported instead.
+        ann_ids = np.concatenate([np.arange(count) for count in counts]) if boxes else np.zeros(0, dtype=np.int64)
+        self._check_boxes(file_names, sizes, image_rows, category_rows, bboxes, ann_ids)
+        return len(parsed), len(boxes)
+
+    def run(self) -> dict:
+        """
+        Check the dataset.
+
+        Returns:
+            dict: Report with the number of images and boxes, issue counts in 'summary' and every issue in 'issues'.
+        """
+        self.issues = []
+        images, boxes = self.check_coco() if self.dataset_format == 'coco' else self.check_voc()
+        summary = Counter(issue['issue'] for issue in self.issues)
+        return {
+            'annotation_path': self.annotation_path,
+            'image_dir': self.image_dir,
+            'format': self.dataset_format,
+            'verify': self.verify,
+            'images': images,
+            'boxes': boxes,
+            'summary': {issue: summary[issue] for issue in ISSUES if summary[issue]},
+            'issues': self.issues,
+        }
+
+    def save_report(self, report_path: str) -> dict:
+        """
+        Check the dataset and write the report as JSON.
+
+        Args:
+            report_path (str): Where to write the report.
+
+        Returns:
+            dict: The report.
+        """
+        report = self.run()
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check images and annotations of a COCO or VOC dataset.")
+    parser.add_argument('annotation_path', help="COCO JSON file or directory with VOC XML files, also inside a .zip")
+    parser.add_argument('--images', help="image directory (default: next to the annotations)")
+    parser.add_argument('--format', choices=('coco', 'voc'), default='coco')
+    parser.add_argument('--verify', action='store_true', help="decode every image, not only its header")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--build-cache', action='store_true',
+                        help="write the columnar cache next to a COCO file when it is missing or stale")
+    parser.add_argument('--report', default='integrity_report.json')
+    args = parser.parse_args()
+
+    checker = DatasetChecker(args.annotation_path, args.images, args.format, args.verify, args.workers, args.build_cache)
+    report = checker.save_report(args.report)
+    print(f"{report['images']} images, {report['boxes']} boxes")
+    for issue, count in report['summary'].items():
+        print(f"{issue}: {count}")
+    print(f"Report: {args.report}")
+    return 1 if report['issues'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
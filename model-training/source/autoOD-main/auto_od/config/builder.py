@@ -1,11 +1,15 @@
+import copy
 import json
 import os
-from typing import Any, Tuple
+import tempfile
+from typing import Any, Tuple, Union
 
 from mmengine import Config
 
 import auto_od.core.settings as s
 from auto_od.core.logger import Logger
+from auto_od.helper.coco_cache import load_categories
+from auto_od.helper.image_cache import read_meta
 
 
 class ModelConfig:
@@ -92,12 +96,10 @@ class ModelConfig:
             Tuple: Tuple of extracted classes.
         """
         if self.config.dataset_type == "CocoDataset":
-            with open(os.path.join(self.config.dataset_dir, self.config.train_json), 'r') as f:
-                data = json.load(f)
-
-            categories = data['categories']
+            categories = load_categories(os.path.join(self.config.dataset_dir, self.config.train_json))
             class_names = [category['name'] for category in categories]
-            unique_class_names = tuple(set(class_names))
+            # Keep the category order: a set reorders classes between runs and shuffles label ids.
+            unique_class_names = tuple(dict.fromkeys(class_names))
             class_name = self.__class__.__name__
             function_name = ModelConfig._extract_classes.__name__
             self.logger.call(class_name,
@@ -105,9 +107,278 @@ class ModelConfig:
                              additional_info="Classes in COCO dataset: {0}".format(str(unique_class_names)))
             return unique_class_names
 
-    def set_custom_params(self):
+    def _set_anchor_generator(self, cfg: Config, anchor_generator: Union[dict, str]):
+        """
+        Replaces the anchor generator of the head that owns it (rpn_head for two-stage models, bbox_head otherwise).
+
+        Args:
+            cfg (Config): Model configuration.
+            anchor_generator (dict | str): anchor_generator config, or a JSON file written by Analyzer.suggest_anchors.
+        """
+        if isinstance(anchor_generator, str):
+            with open(anchor_generator, 'r') as f:
+                anchor_generator = json.load(f)
+        anchor_generator = anchor_generator.get('anchor_generator', anchor_generator)
+
+        head = cfg.model.get('rpn_head') or cfg.model.get('bbox_head')
+        class_name = self.__class__.__name__
+        function_name = ModelConfig._set_anchor_generator.__name__
+        current = head.get('anchor_generator') if head is not None else None
+        if current is None or current.get('type') != anchor_generator['type']:
+            self.logger.call(class_name,
+                             function_name,
+                             additional_info="Model has no {0} to replace: {1}".format(anchor_generator['type'], current))
+            return
+        if list(current.get('strides', [])) != list(anchor_generator['strides']):
+            self.logger.call(class_name,
+                             function_name,
+                             additional_info="Anchor strides {0} do not match the model strides {1}".format(
+                                 anchor_generator['strides'], current.get('strides')))
+            return
+        # Replaced as a whole: AnchorGenerator rejects scales together with octave_base_scale.
+        head.anchor_generator = dict(anchor_generator)
+        self.logger.call(class_name,
+                         function_name,
+                         additional_info="anchor_generator: {0}".format(head.anchor_generator))
+
+    def _set_class_balance(self, cfg: Config, class_balance: Union[float, dict, str]):
+        """
+        Wraps the training dataset in mmdet's ClassBalancedDataset, so images of rare classes are repeated
+        at load time instead of being copied.
+
+        Args:
+            cfg (Config): Model configuration.
+            class_balance (float | dict | str): oversample_thr, or the settings (as a dict or the JSON file)
+                written by BalancedCOCOSplitter.repeat_factors; the wrapper derives the per-image factors itself.
+        """
+        if isinstance(class_balance, str):
+            with open(class_balance, 'r') as f:
+                class_balance = json.load(f)
+        if not isinstance(class_balance, dict):
+            class_balance = {'oversample_thr': float(class_balance)}
+
+        cfg.train_dataloader.dataset = dict(type='ClassBalancedDataset',
+                                            oversample_thr=class_balance['oversample_thr'],
+                                            dataset=cfg.train_dataloader.dataset)
+        class_name = self.__class__.__name__
+        function_name = ModelConfig._set_class_balance.__name__
+        self.logger.call(class_name,
+                         function_name,
+                         additional_info="ClassBalancedDataset oversample_thr: {0}, images per epoch: {1}".format(
+                             class_balance['oversample_thr'], class_balance.get('epoch_images', 'unknown')))
+
+    @staticmethod
+    def _innermost_dataset(dataset: dict) -> dict:
+        while 'dataset' in dataset:
+            dataset = dataset['dataset']
+        return dataset
+
+    @staticmethod
+    def _leaf_datasets(dataset: dict) -> list:
+        if 'datasets' in dataset:
+            return [leaf for child in dataset['datasets'] for leaf in ModelConfig._leaf_datasets(child)]
+        if 'dataset' in dataset:
+            return ModelConfig._leaf_datasets(dataset['dataset'])
+        return [dataset]
+
+    @staticmethod
+    def _add_custom_import(cfg: Config, module: str):
+        imports = list(cfg.get('custom_imports', {}).get('imports', []))
+        if module not in imports:
+            imports.append(module)
+        cfg.custom_imports = dict(imports=imports, allow_failed_imports=False)
+
+    @staticmethod
+    def _pipeline_scale(pipeline: list) -> Union[Tuple[int, int], None]:
+        """
+        Largest (long edge, short edge) that the Resize, RandomResize or RandomChoiceResize steps of a pipeline
+        resize to, None when it has no fixed target scale.
+        """
+        scales = []
+        for step in pipeline:
+            if step['type'] in ('Resize', 'RandomResize'):
+                # RandomResize with ratio_range scales its base scale by up to the upper ratio.
+                ratio = max(step['ratio_range']) if step.get('ratio_range') else 1
+                scales.append((step.get('scale'), ratio))
+            elif step['type'] == 'RandomChoiceResize':
+                scales.extend((scale, 1) for scale in step.get('scales', []))
+        edges = []
+        for scale, ratio in scales:
+            if isinstance(scale, int):
+                edges.append((int(scale * ratio), int(scale * ratio)))
+            elif scale:
+                # A (w, h) pair, or the (min, max) pairs of RandomResize.
+                pairs = scale if isinstance(scale[0], (list, tuple)) else [scale]
+                edges.extend((int(max(pair) * ratio), int(min(pair) * ratio)) for pair in pairs)
+        if not edges:
+            return None
+        return max(long for long, _ in edges), max(short for _, short in edges)
+
+    def _set_sources(self, cfg: Config, sources: Union[list, str]):
+        """
+        Trains on several COCO datasets mixed in given ratios, without building a combined copy.
+
+        The training set becomes a ConcatDataset sampled by MixedSourceSampler; sources with a test_json
+        are validated together, with COCO metrics per source and their ratio-weighted mean as coco/*.
+
+        Args:
+            cfg (Config): Model configuration.
+            sources (list | str): Source dicts, or a JSON file with them. Keys: 'name', 'data_root',
+                'train_json' and 'test_json' (relative to data_root), 'ratio', and optionally 'train_prefix'
+                and 'test_prefix' (image directories, 'train/' and 'test/' by default).
+        """
+        if isinstance(sources, str):
+            with open(sources, 'r') as f:
+                sources = json.load(f)
+
+        def source_dataset(template: dict, source: dict, split: str) -> dict:
+            dataset = copy.deepcopy(template)
+            inner = self._innermost_dataset(dataset)
+            inner['data_root'] = os.path.join(source['data_root'], '')
+            inner['ann_file'] = source[f'{split}_json']
+            inner['data_prefix'] = dict(img=source.get(f'{split}_prefix', f'{split}/'))
+            return dataset
+
+        ratios = [source['ratio'] for source in sources]
+        self._add_custom_import(cfg, 'auto_od.train.mixing')
+        cfg.train_dataloader.dataset = dict(type='ConcatDataset',
+                                            datasets=[source_dataset(cfg.train_dataloader.dataset, source, 'train')
+                                                      for source in sources])
+        cfg.train_dataloader.sampler = dict(type='MixedSourceSampler', ratios=ratios, shuffle=True)
+
+        evaluated = [source for source in sources if source.get('test_json')]
+        if evaluated:
+            for split in ('val', 'test'):
+                dataloader = cfg[f'{split}_dataloader']
+                dataloader.dataset = dict(type='ConcatDataset',
+                                          datasets=[source_dataset(dataloader.dataset, source, 'test')
+                                                    for source in evaluated])
+                evaluator = cfg[f'{split}_evaluator']
+                cfg[f'{split}_evaluator'] = dict(
+                    type='MixedSourceCocoMetric',
+                    sources=[dict(name=source['name'], ann_file=os.path.join(source['data_root'], source['test_json']))
+                             for source in evaluated],
+                    weights=[source['ratio'] for source in evaluated],
+                    metric=evaluator.get('metric', 'bbox'),
+                    format_only=evaluator.get('format_only', False))
+
+        total = sum(ratios)
+        class_name = self.__class__.__name__
+        function_name = ModelConfig._set_sources.__name__
+        self.logger.call(class_name,
+                         function_name,
+                         additional_info="Mixed sources: {0}, evaluated per source: {1}".format(
+                             ", ".join("{0} {1:.0%}".format(source['name'], source['ratio'] / total)
+                                       for source in sources),
+                             [source['name'] for source in evaluated]))
+
+    def _set_image_cache(self, cfg: Config, image_cache: Union[str, list]):
+        """
+        Loads training images from pre-decoded caches instead of decoding them every epoch.
+
+        LoadImageFromFile of every training dataset whose image directory a cache was built from becomes
+        LoadImageFromCache; validation and test keep reading the files, so metrics stay in annotated coordinates.
+        A cache built for a smaller scale than the largest one of the dataset's resize steps is not used.
+
+        Args:
+            cfg (Config): Model configuration.
+            image_cache (str | list): Cache directories written by auto_od.helper.image_cache, one per image directory.
+        """
+        caches = [image_cache] if isinstance(image_cache, str) else list(image_cache)
+        cache_dirs = {read_meta(cache_dir)['image_dir']: os.path.abspath(cache_dir) for cache_dir in caches}
+
+        class_name = self.__class__.__name__
+        function_name = ModelConfig._set_image_cache.__name__
+        used = []
+        for dataset in self._leaf_datasets(cfg.train_dataloader.dataset):
+            image_dir = os.path.abspath(os.path.join(dataset.get('data_root', ''),
+                                                     dataset.get('data_prefix', {}).get('img', '')))
+            cache_dir = cache_dirs.get(image_dir)
+            if cache_dir is None:
+                self.logger.call(class_name,
+                                 function_name,
+                                 additional_info="No image cache for {0}".format(image_dir))
+                continue
+            # A cache below the training scale would make Resize upsample blurred images.
+            cache_scale = read_meta(cache_dir)['scale']
+            train_scale = self._pipeline_scale(dataset['pipeline'])
+            if train_scale is not None and (max(cache_scale) < train_scale[0] or min(cache_scale) < train_scale[1]):
+                self.logger.call(class_name,
+                                 function_name,
+                                 additional_info="Image cache {0} has scale {1}, below the training scale {2}; "
+                                                 "reading the files of {3}".format(cache_dir, cache_scale,
+                                                                                   train_scale, image_dir))
+                continue
+            dataset['pipeline'] = [dict(step, type='LoadImageFromCache', cache_dir=cache_dir)
+                                   if step['type'] == 'LoadImageFromFile' else step
+                                   for step in dataset['pipeline']]
+            used.append(cache_dir)
+
+        if used:
+            self._add_custom_import(cfg, 'auto_od.train.transforms')
+        self.logger.call(class_name,
+                         function_name,
+                         additional_info="Image caches: {0}".format(used))
+
+    def _set_autotune(self, cfg: Config, options: dict, report_path: str):
+        """
+        Replaces the train dataloader setting with the fastest stable one measured on this machine,
+        and lets mmengine scale the learning rate to the chosen batch size.
+
+        Args:
+            cfg (Config): Complete model configuration, probed as it would be trained.
+            options (dict): Arguments of auto_od.train.autotune.tune_dataloader, e.g. batch_sizes, worker_counts,
+                iterations or device='cpu'.
+            report_path (str): Where to write every measured setting as JSON.
+        """
+        # Probing needs torch, which configs are otherwise built without.
+        from auto_od.train.autotune import tune_dataloader
+
+        class_name = self.__class__.__name__
+        function_name = ModelConfig._set_autotune.__name__
+        # The config's lr belongs to its base_batch_size (e.g. 8 GPUs x 2 images), not to the batch size set here.
+        base_batch_size = cfg.get('auto_scale_lr', {}).get('base_batch_size', cfg.train_dataloader.batch_size)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            probe_path = os.path.join(tmp_dir, 'probe.py')
+            cfg.dump(probe_path)
+            result = tune_dataloader(probe_path, **options)
+        with open(report_path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+        if result['best'] is None:
+            self.logger.call(class_name,
+                             function_name,
+                             additional_info="No dataloader setting ran, keeping batch size {0}: {1}".format(
+                                 cfg.train_dataloader.batch_size, [trial.get('error') for trial in result['trials']]))
+            return
+        cfg.train_dataloader.update(result['best'])
+        cfg.auto_scale_lr = dict(enable=True, base_batch_size=base_batch_size)
+        self.logger.call(class_name,
+                         function_name,
+                         additional_info="Dataloader {0}: {1:.1f} samples/s, lr scaled from batch size {2}, "
+                                         "report {3}".format(result['best'], result['samples_per_s'],
+                                                             base_batch_size, report_path))
+
+    def set_custom_params(self, anchor_generator: Union[dict, str] = None,
+                          class_balance: Union[float, dict, str] = None, sources: Union[list, str] = None,
+                          image_cache: Union[str, list] = None, autotune: Union[bool, dict] = None):
         """
         Sets custom parameters for the model configuration.
+
+        Args:
+            anchor_generator (dict | str, optional): Anchor generator override from Analyzer.suggest_anchors,
+                as a dict or the JSON file it wrote. Defaults to None (keep the model's anchors).
+            class_balance (float | dict | str, optional): Class-balanced sampling of the training set:
+                an oversample_thr, or the settings written by BalancedCOCOSplitter. Defaults to None
+                (every image once per epoch).
+            sources (list | str, optional): Several COCO datasets to mix in given ratios instead of
+                dataset_dir, see _set_sources. Class names are still taken from settings train_json.
+            image_cache (str | list, optional): Pre-decoded training image caches, see _set_image_cache.
+                Defaults to None (decode the image files).
+            autotune (bool | dict, optional): Probe batch sizes and dataloader workers on the dataset and keep
+                the fastest stable setting, see _set_autotune; a dict holds tune_dataloader options.
+                Defaults to None (batch size 16, dataloader settings of the config).
         """
         cfg = self._get_config()
         PREFIX = self.config.dataset_dir if self.config.dataset_dir.endswith("/") else self.config.dataset_dir + "/"
@@ -167,6 +438,20 @@ class ModelConfig:
         else:
             cfg.model.bbox_head.num_classes = len(classes)
 
+        if anchor_generator is not None:
+            self._set_anchor_generator(cfg, anchor_generator)
+
+        if class_balance is not None:
+            self._set_class_balance(cfg, class_balance)
+
+        # After class balancing: every source gets its own ClassBalancedDataset, the sampler needs the sources.
+        if sources is not None:
+            self._set_sources(cfg, sources)
+
+        # After the sources: they decide which image directory every training dataset reads.
+        if image_cache is not None:
+            self._set_image_cache(cfg, image_cache)
+
         cfg.train_dataloader.batch_size = 16
 
         max_epochs = self.config.epoch_number
@@ -194,6 +479,11 @@ class ModelConfig:
         cfg.work_dir = self.config.models_dir
         custom_conf_path = os.path.splitext(os.path.basename(self.full_config_path))[0] + "_custom.py"
 
+        # Last: the probes train the finished config, with its model, pipeline and sampling.
+        if autotune:
+            self._set_autotune(cfg, {} if autotune is True else dict(autotune),
+                               os.path.join(self.config.conf_dir, custom_conf_path[:-len(".py")] + "_autotune.json"))
+
         print(f"Default Config:\n{cfg.pretty_text}")
 
         class_name = self.__class__.__name__
@@ -1,35 +1,56 @@
+import base64
+import html
+import io
 import json
 import os
 from collections import Counter
+from functools import cached_property
 
-import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.figure import Figure
 
 from auto_od.core.logger import Logger
 from auto_od.core.settings import load_settings_from_yaml
+from auto_od.data_preprocess.analyze.dataset.anchors import optimize_anchors
+from auto_od.helper.archive import local_dir
+from auto_od.helper.coco_cache import dense_index, load_coco, load_columns
+from auto_od.helper.coco_index import CocoIndex
+
+# COCO size buckets by object area, in pixels.
+SMALL_AREA = 32 ** 2
+MEDIUM_AREA = 96 ** 2
+SIZE_BUCKETS = ('small', 'medium', 'large')
 
 
 class Analyzer:
     """
     A class for analyzing object detection datasets.
 
+    Every statistic is computed from the columnar annotation arrays (see auto_od.helper.coco_cache)
+    in one vectorized pass by the statistics property; the other methods read from its result.
+
     Attributes:
-        annotations (dict): Loaded annotations from the dataset.
+        annotation_path (str): Path to the annotations or to their columnar cache.
+        columns (CocoColumns): Annotation and image arrays of the dataset.
         dataset_dir (str): Directory where the dataset is located.
         config (Settings): Configuration settings loaded from a YAML file.
         logger (Logger): Logger for logging information.
     """
 
-    def __init__(self, settings_path: str, annotation_path: str, dataset_dir: str):
+    def __init__(self, settings_path: str, annotation_path: str, dataset_dir: str, build_cache: bool = False):
         """
         Initialize the Analyzer with dataset and configuration settings.
 
         Args:
             settings_path (str): Path to the YAML file containing settings.
-            annotation_path (str): Path to the JSON file containing annotations.
-            dataset_dir (str): Directory where the dataset is located.
+            annotation_path (str): Path to the JSON file containing annotations, or to its columnar cache;
+                the JSON file may be inside a zip archive ('annotations.zip/train.json'), its cache is written next to it.
+            dataset_dir (str): Directory where the dataset is located; plots go next to the archive if it is one.
+            build_cache (bool): Write the columnar cache next to the annotations when it is missing or stale;
+                by default a fresh cache is used, but the dataset is not written to.
         """
-        self.annotations = self.load_annotations(annotation_path)
+        self.annotation_path = annotation_path
+        self.columns = load_columns(annotation_path, build=build_cache)
         self.dataset_dir = dataset_dir
         self.config = load_settings_from_yaml(settings_path)
         self.logger = Logger(self.config.base_dir)
@@ -37,7 +58,7 @@ class Analyzer:
     @staticmethod
     def load_annotations(annotation_path: str) -> dict:
         """
-        Load annotations from a JSON file.
+        Load annotations from a JSON file or its columnar cache.
 
         Args:
             annotation_path (str): Path to the JSON file containing annotations.
@@ -45,47 +66,155 @@ class Analyzer:
         Returns:
             dict: Loaded annotations.
         """
-        with open(annotation_path) as f:
-            data = json.load(f)
-        return data
+        return load_coco(annotation_path)
+
+    @cached_property
+    def index(self) -> CocoIndex:
+        """Record-level index, built only when a caller needs the annotation dicts."""
+        return CocoIndex(self.load_annotations(self.annotation_path))
+
+    @property
+    def annotations(self) -> dict:
+        return self.index.data
+
+    @cached_property
+    def statistics(self) -> dict:
+        """
+        Compute all dataset statistics in one vectorized pass.
+
+        Returns:
+            dict: Arrays and tables:
+                'widths', 'heights', 'areas', 'ratios' - per box, degenerate boxes dropped;
+                'size_buckets' - COCO small/medium/large counts;
+                'classes' - per class: name, count, images, median area and ratio, small/medium/large counts;
+                'objects_per_image' - per image object count (images without objects included);
+                'image_sizes' - per image resolution: width, height, images, objects;
+                'relative_sizes' - sqrt(box area / image area) per box.
+        """
+        columns = self.columns
+        bboxes = np.asarray(columns.bboxes, dtype=np.float32)
+        widths, heights = bboxes[:, 2], bboxes[:, 3]
+        valid = (widths > 0) & (heights > 0)
+        widths, heights = widths[valid], heights[valid]
+        areas = widths * heights
+        ratios = widths / heights
+        category_ids = np.asarray(columns.category_ids)[valid]
+        image_ids = np.asarray(columns.image_ids)[valid]
+
+        buckets = (areas >= SMALL_AREA).astype(np.int8) + (areas >= MEDIUM_AREA)
+
+        # Category ids -> dense indices, including categories without boxes.
+        category_table = np.array([category['id'] for category in columns.categories], dtype=np.int64)
+        known_ids = np.union1d(category_table, np.unique(category_ids))
+        class_index = dense_index(known_ids, category_ids)
+        n_classes = len(known_ids)
+        class_counts = np.bincount(class_index, minlength=n_classes)
+        class_buckets = np.bincount(class_index * 3 + buckets, minlength=n_classes * 3).reshape(n_classes, 3)
+
+        # Image ids -> rows of the image table; boxes of images missing from it are left out of per-image stats.
+        img_ids = np.asarray(columns.img_ids)
+        image_rows = dense_index(img_ids, image_ids)
+        known_image = image_rows >= 0
+        objects_per_image = np.bincount(image_rows[known_image], minlength=len(img_ids))
+
+        # Boxes grouped by class with a stable (radix) sort; medians and image counts per group.
+        order = np.argsort(class_index.astype(np.int16 if n_classes < 2 ** 15 else np.int32), kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(class_counts)))
+        median_areas = np.zeros(n_classes, dtype=np.float32)
+        median_ratios = np.zeros(n_classes, dtype=np.float32)
+        class_images = np.zeros(n_classes, dtype=np.int64)
+        seen = np.zeros(len(img_ids), dtype=bool)
+        for i in np.flatnonzero(class_counts):
+            group = order[bounds[i]:bounds[i + 1]]
+            median_areas[i] = np.median(areas[group])
+            median_ratios[i] = np.median(ratios[group])
+            rows = image_rows[group]
+            seen[:] = False
+            seen[rows[rows >= 0]] = True
+            class_images[i] = np.count_nonzero(seen)
+
+        img_widths = np.asarray(columns.img_widths, dtype=np.int64)
+        img_heights = np.asarray(columns.img_heights, dtype=np.int64)
+        image_areas = (img_widths * img_heights)[image_rows[known_image]]
+        relative_sizes = np.sqrt(areas[known_image] / np.maximum(image_areas, 1))
 
-    def analyze_object_sizes(self) -> list:
+        resolution_keys, resolution_index = np.unique(img_widths << 32 | img_heights, return_inverse=True)
+        resolution_images = np.bincount(resolution_index, minlength=len(resolution_keys))
+        resolution_objects = np.bincount(resolution_index, weights=objects_per_image, minlength=len(resolution_keys))
+
+        names = {category['id']: category.get('name', str(category['id'])) for category in columns.categories}
+        classes = [{'id': int(category_id),
+                    'name': names.get(int(category_id), str(category_id)),
+                    'objects': int(class_counts[i]),
+                    'images': int(class_images[i]),
+                    'median_area': float(median_areas[i]),
+                    'median_ratio': float(median_ratios[i]),
+                    **{bucket: int(class_buckets[i, j]) for j, bucket in enumerate(SIZE_BUCKETS)}}
+                   for i, category_id in enumerate(known_ids)]
+        image_sizes = [{'width': int(key >> 32), 'height': int(key & 0xFFFFFFFF),
+                        'images': int(resolution_images[i]), 'objects': int(resolution_objects[i])}
+                       for i, key in enumerate(resolution_keys)]
+        image_sizes.sort(key=lambda row: -row['images'])
+
+        return {
+            'boxes': int(len(bboxes)),
+            'degenerate_boxes': int(len(bboxes) - valid.sum()),
+            'images': int(len(img_ids)),
+            'images_without_objects': int((objects_per_image == 0).sum()),
+            'widths': widths,
+            'heights': heights,
+            'areas': areas,
+            'ratios': ratios,
+            'size_buckets': dict(zip(SIZE_BUCKETS, np.bincount(buckets, minlength=3).tolist())),
+            'classes': classes,
+            'objects_per_image': objects_per_image,
+            'image_sizes': image_sizes,
+            'relative_sizes': relative_sizes,
+        }
+
+    def analyze_object_sizes(self) -> np.ndarray:
         """
         Analyze object sizes in the dataset.
 
         Returns:
-            list: List of object sizes in the dataset.
+            np.ndarray: Box areas (width * height) of all non-degenerate boxes.
         """
-        sizes = []
-        for ann in self.annotations['annotations']:
-            bbox = ann['bbox']
-            area = bbox[2] * bbox[3]
-            sizes.append(area)
-        return sizes
+        return self.statistics['areas']
 
-    def analyze_aspect_ratios(self) -> list:
+    def analyze_aspect_ratios(self) -> np.ndarray:
         """
         Analyze aspect ratios of objects in the dataset.
 
         Returns:
-            list: List of aspect ratios of objects.
+            np.ndarray: Width / height of all non-degenerate boxes.
         """
-        ratios = []
-        for ann in self.annotations['annotations']:
-            bbox = ann['bbox']
-            ratio = bbox[2] / bbox[3]
-            ratios.append(ratio)
-        return ratios
+        return self.statistics['ratios']
 
     def analyze_class_distribution(self) -> Counter:
         """
         Analyze class distribution in the dataset.
 
         Returns:
-            Counter: Counts of objects per class.
+            Counter: Counts of annotations per category id, degenerate boxes and unknown categories included;
+                the statistics report those separately.
+        """
+        category_ids, counts = np.unique(self.columns.category_ids, return_counts=True)
+        return Counter(dict(zip(category_ids.tolist(), counts.tolist())))
+
+    def analyze_object_density(self) -> dict:
+        """
+        Analyze how many objects images contain.
+
+        Returns:
+            dict: Mean, median, 95th percentile and maximum objects per image.
         """
-        classes = [ann['category_id'] for ann in self.annotations['annotations']]
-        return Counter(classes)
+        counts = self.statistics['objects_per_image']
+        if not len(counts):
+            return {'mean': 0.0, 'median': 0.0, 'p95': 0.0, 'max': 0}
+        return {'mean': round(float(counts.mean()), 2),
+                'median': float(np.median(counts)),
+                'p95': float(np.quantile(counts, 0.95)),
+                'max': int(counts.max())}
 
     def plot_distribution(self, data: list, title: str, xlabel: str, ylabel: str, id: int):
         """
@@ -98,17 +227,129 @@ class Analyzer:
             ylabel (str): Label for the Y-axis.
             id (int): Identifier for the plot.
         """
-        plt.figure(figsize=(10, 6))
-        plt.hist(data, bins=50)
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
+        figure = Figure(figsize=(10, 6))
+        ax = figure.subplots()
+        ax.hist(np.asarray(data), bins=50)
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
         class_name = self.__class__.__name__
         function_name = Analyzer.plot_distribution.__name__
         self.logger.call(class_name=class_name,
                          function_name=function_name,
                          additional_info=f"Plots are located in {self.dataset_dir}")
-        plt.savefig(os.path.join(self.dataset_dir, f'plot_distribution{id}.jpg'))
+        figure.savefig(os.path.join(local_dir(self.dataset_dir), f'plot_distribution{id}.jpg'))
+
+    def _report_figure(self) -> Figure:
+        stats = self.statistics
+        classes = [row for row in stats['classes'] if row['objects']]
+        figure = Figure(figsize=(16, 14), constrained_layout=True)
+        axes = figure.subplots(3, 2)
+
+        ax = axes[0, 0]
+        areas = stats['areas']
+        if len(areas):
+            ax.hist(np.sqrt(areas), bins=np.geomspace(max(float(np.sqrt(areas.min())), 1.0),
+                                                       float(np.sqrt(areas.max())) + 1, 60))
+            ax.set_xscale('log')
+            for bound in (32, 96):
+                ax.axvline(bound, color='r', linestyle='--', linewidth=1)
+        ax.set_title('Object size, sqrt(area) (COCO small/medium/large bounds dashed)')
+        ax.set_xlabel('pixels')
+
+        ax = axes[0, 1]
+        if len(stats['ratios']):
+            ax.hist(np.log2(stats['ratios']), bins=60)
+        ax.set_title('Aspect ratio, log2(width / height)')
+
+        ax = axes[1, 0]
+        names = [row['name'] for row in classes]
+        bottom = np.zeros(len(classes))
+        for bucket in SIZE_BUCKETS:
+            values = np.array([row[bucket] for row in classes])
+            ax.barh(names, values, left=bottom, label=bucket)
+            bottom += values
+        ax.invert_yaxis()
+        ax.legend()
+        ax.set_title('Objects per class by COCO size bucket')
+
+        ax = axes[1, 1]
+        counts = stats['objects_per_image']
+        if len(counts):
+            ax.hist(counts, bins=np.arange(0, int(counts.max()) + 2) - 0.5 if counts.max() < 100 else 60)
+        ax.set_title('Object density, objects per image')
+
+        ax = axes[2, 0]
+        if len(stats['relative_sizes']):
+            ax.hist(stats['relative_sizes'], bins=60, range=(0, 1))
+        ax.set_title('Relative object size, sqrt(box area / image area)')
+
+        ax = axes[2, 1]
+        top = stats['image_sizes'][:15]
+        ax.barh([f"{row['width']}x{row['height']}" for row in top], [row['images'] for row in top])
+        ax.invert_yaxis()
+        ax.set_title('Images per resolution (top 15)')
+        return figure
+
+    def report(self, output_dir: str = None, name: str = 'dataset_report') -> str:
+        """
+        Render all statistics into one PNG and one self-contained HTML page.
+
+        Args:
+            output_dir (str, optional): Where to write the report. Defaults to dataset_dir.
+            name (str): Base file name of the report.
+
+        Returns:
+            str: Path to the HTML report; the PNG is written next to it.
+        """
+        output_dir = output_dir or local_dir(self.dataset_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        stats = self.statistics
+        buffer = io.BytesIO()
+        self._report_figure().savefig(buffer, format='png', dpi=80)
+        png_path = os.path.join(output_dir, name + '.png')
+        with open(png_path, 'wb') as f:
+            f.write(buffer.getvalue())
+
+        def table(rows: list, columns: list) -> str:
+            head = ''.join(f'<th>{html.escape(column)}</th>' for column in columns)
+            body = ''.join('<tr>' + ''.join(f'<td>{html.escape(str(row[column]))}</td>' for column in columns)
+                           + '</tr>' for row in rows)
+            return f'<table><tr>{head}</tr>{body}</table>'
+
+        summary = [{'metric': key, 'value': value} for key, value in (
+            ('images', stats['images']),
+            ('boxes', stats['boxes']),
+            ('degenerate boxes', stats['degenerate_boxes']),
+            ('images without objects', stats['images_without_objects']),
+            *stats['size_buckets'].items(),
+            *(('objects per image, ' + key, value) for key, value in self.analyze_object_density().items()),
+        )]
+        classes = [dict(row, median_area=round(row['median_area'], 1), median_ratio=round(row['median_ratio'], 2))
+                   for row in stats['classes']]
+        page = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Dataset report</title>
+<style>body{{font-family:sans-serif}} table{{border-collapse:collapse;margin:1em 0}}
+td,th{{border:1px solid #ccc;padding:2px 8px;text-align:right}}</style></head>
+<body><h1>{html.escape(os.path.basename(self.annotation_path))}</h1>
+{table(summary, ['metric', 'value'])}
+<h2>Classes</h2>
+{table(classes, ['id', 'name', 'objects', 'images', 'median_area', 'median_ratio', *SIZE_BUCKETS])}
+<h2>Image sizes</h2>
+{table(stats['image_sizes'], ['width', 'height', 'images', 'objects'])}
+<img src="data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}">
+</body></html>
+"""
+        html_path = os.path.join(output_dir, name + '.html')
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(page)
+
+        class_name = self.__class__.__name__
+        function_name = Analyzer.report.__name__
+        self.logger.call(class_name=class_name,
+                         function_name=function_name,
+                         additional_info=f"Report is located in {html_path}")
+        return html_path
 
     def suggest_config(self, img_dim: int, feature_map_scales: list) -> tuple:
         """
@@ -121,18 +362,20 @@ class Analyzer:
         Returns:
             tuple: Suggested anchor configurations and class weighting.
         """
-        sizes = self.analyze_object_sizes()
+        sizes = np.sqrt(self.analyze_object_sizes())
         ratios = self.analyze_aspect_ratios()
         class_dist = self.analyze_class_distribution()
 
+        size_quantiles = np.quantile(sizes, [0.25, 0.5, 0.75]) if len(sizes) else np.zeros(3)
+        aspect_ratios = [round(float(q), 2) for q in (np.quantile(ratios, [0.25, 0.5, 0.75])
+                                                       if len(ratios) else np.ones(3))]
         anchor_config = {}
         for scale in feature_map_scales:
-            normalized_sizes = np.sqrt(sizes) / (img_dim / scale)
-            anchor_sizes = [round(float(np.quantile(normalized_sizes, q)), 2) for q in [0.25, 0.5, 0.75]]
-            aspect_ratios = [round(float(np.quantile(ratios, q)), 2) for q in [0.25, 1.0, 0.75]]
+            anchor_sizes = [round(float(q / (img_dim / scale)), 2) for q in size_quantiles]
             anchor_config[scale] = {'anchor_sizes': anchor_sizes, 'aspect_ratios': aspect_ratios}
 
-        class_weighting = 'recommended' if max(class_dist.values()) / min(class_dist.values()) > 2 else 'not required'
+        class_weighting = 'recommended' if class_dist and max(class_dist.values()) / min(class_dist.values()) > 2 \
+            else 'not required'
         class_name = self.__class__.__name__
         function_name = Analyzer.suggest_config.__name__
         self.logger.call(class_name=class_name,
@@ -140,7 +383,55 @@ class Analyzer:
                          additional_info=f"Class Weighting is {class_weighting}")
         return anchor_config, class_weighting
 
+    def input_box_sizes(self, img_dim: int) -> np.ndarray:
+        """
+        Box sizes as the network sees them, after a keep-ratio resize of the longer image side to img_dim.
 
+        Args:
+            img_dim (int): Dimension of the input image.
+
+        Returns:
+            np.ndarray: (N, 2) float32 widths and heights of the non-degenerate boxes; boxes of images
+                without a known size are left unscaled.
+        """
+        columns = self.columns
+        bboxes = np.asarray(columns.bboxes, dtype=np.float32)
+        valid = (bboxes[:, 2] > 0) & (bboxes[:, 3] > 0)
+        wh = bboxes[valid, 2:4]
+        image_rows = dense_index(columns.img_ids, np.asarray(columns.image_ids)[valid])
+        longest = np.maximum(np.asarray(columns.img_widths), np.asarray(columns.img_heights)).astype(np.float32)
+        sides = np.where(image_rows >= 0, longest[image_rows.clip(0)], 0)
+        scale = np.where(sides > 0, img_dim / np.maximum(sides, 1), 1).astype(np.float32)
+        return wh * scale[:, None]
+
+    def suggest_anchors(self, img_dim: int, feature_map_scales: list, anchors_per_level: int = 3,
+                        generator_type: str = 'AnchorGenerator', batch_size: int = None,
+                        output_path: str = None) -> dict:
+        """
+        Fit anchors to all boxes with IoU k-means and assign them to feature maps by area.
+
+        Args:
+            img_dim (int): Dimension of the input image.
+            feature_map_scales (list): Strides of the feature maps, smallest first.
+            anchors_per_level (int): Anchors per feature map.
+            generator_type (str): 'AnchorGenerator' or 'YOLOAnchorGenerator', as in the model config.
+            batch_size (int, optional): Mini-batch size; chosen from the number of boxes by default.
+            output_path (str, optional): JSON file to write the result to, for ModelConfig.set_custom_params.
 
-# # cfg.model.bbox_head.anchor_generator.scales = [[round(s, 2) for s in config_suggestions['anchor_sizes']]]
-# # cfg.model.bbox_head.anchor_generator.ratios = config_suggestions['aspect_ratios']
+        Returns:
+            dict: 'anchor_generator' override for cfg.model.bbox_head, 'anchors' per feature map,
+                'mean_iou' and 'mean_iou_generator' - mean best IoU of the boxes with the clustered anchors
+                and with the anchors the override produces.
+        """
+        result = optimize_anchors(self.input_box_sizes(img_dim), sorted(feature_map_scales), anchors_per_level,
+                                  generator_type, batch_size=batch_size)
+        if output_path is not None:
+            with open(output_path, 'w') as f:
+                json.dump(result, f, indent=2)
+        class_name = self.__class__.__name__
+        function_name = Analyzer.suggest_anchors.__name__
+        self.logger.call(class_name=class_name,
+                         function_name=function_name,
+                         additional_info=f"Anchor coverage, mean best IoU: {result['mean_iou']} "
+                                         f"(emitted {generator_type}: {result['mean_iou_generator']})")
+        return result
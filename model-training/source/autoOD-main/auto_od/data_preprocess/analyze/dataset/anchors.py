@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Rows of boxes scored against the anchors at once; bounds the (rows, k) IoU matrix.
+CHUNK_SIZE = 1 << 18
+# Above this many boxes iou_kmeans switches to mini-batch updates by default.
+MINI_BATCH_THRESHOLD = 1_000_000
+DEFAULT_BATCH_SIZE = 1 << 16
+
+
+def wh_iou(wh: np.ndarray, anchors: np.ndarray) -> np.ndarray:
+    """
+    IoU of boxes and anchors that share a center, the distance used for anchor clustering.
+
+    Args:
+        wh (np.ndarray): (N, 2) box widths and heights.
+        anchors (np.ndarray): (K, 2) anchor widths and heights.
+
+    Returns:
+        np.ndarray: (N, K) IoU matrix.
+    """
+    inter = np.minimum(wh[:, None, 0], anchors[None, :, 0]) * np.minimum(wh[:, None, 1], anchors[None, :, 1])
+    union = (wh[:, 0] * wh[:, 1])[:, None] + (anchors[:, 0] * anchors[:, 1])[None, :] - inter
+    return inter / union
+
+
+def best_match(wh: np.ndarray, anchors: np.ndarray) -> tuple:
+    """
+    Best anchor of every box, computed in chunks.
+
+    Returns:
+        tuple: (N,) index of the best anchor and (N,) its IoU.
+    """
+    anchors = np.asarray(anchors, dtype=np.float32)
+    labels = np.empty(len(wh), dtype=np.int64)
+    ious = np.empty(len(wh), dtype=np.float32)
+    for start in range(0, len(wh), CHUNK_SIZE):
+        iou = wh_iou(wh[start:start + CHUNK_SIZE], anchors)
+        best = iou.argmax(axis=1)
+        labels[start:start + CHUNK_SIZE] = best
+        ious[start:start + CHUNK_SIZE] = np.take_along_axis(iou, best[:, None], axis=1)[:, 0]
+    return labels, ious
+
+
+def _init_centers(wh: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ seeding with 1 - IoU as the distance."""
+    centers = [wh[rng.integers(len(wh))]]
+    distance = 1 - wh_iou(wh, np.array(centers))[:, 0]
+    for _ in range(1, k):
+        weights = distance ** 2
+        total = weights.sum()
+        index = rng.choice(len(wh), p=weights / total) if total > 0 else rng.integers(len(wh))
+        centers.append(wh[index])
+        distance = np.minimum(distance, 1 - wh_iou(wh, wh[index:index + 1])[:, 0])
+    return np.array(centers, dtype=np.float64)
+
+
+def iou_kmeans(wh: np.ndarray, k: int, iterations: int = 100, batch_size: int | None = None, seed: int = 0,
+               tol: float = 1e-4) -> np.ndarray:
+    """
+    Cluster box shapes with k-means under the 1 - IoU distance.
+
+    Args:
+        wh (np.ndarray): (N, 2) box widths and heights, all positive.
+        k (int): Number of anchors.
+        iterations (int): Maximum number of Lloyd iterations, or of mini-batches.
+        batch_size (int, optional): Mini-batch size. By default full batches are used up to
+            MINI_BATCH_THRESHOLD boxes and DEFAULT_BATCH_SIZE above it; 0 forces full batches.
+        seed (int): Seed for sampling.
+        tol (float): Stop when no center moves by more than this fraction.
+
+    Returns:
+        np.ndarray: (k, 2) anchors sorted by area.
+    """
+    wh = np.asarray(wh, dtype=np.float32)
+    if len(wh) < k:
+        raise ValueError(f"Need at least {k} boxes to fit {k} anchors, got {len(wh)}")
+    rng = np.random.default_rng(seed)
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE if len(wh) > MINI_BATCH_THRESHOLD else 0
+    sample = wh[rng.choice(len(wh), size=min(len(wh), 100_000), replace=False)]
+    centers = _init_centers(sample, k, rng)
+
+    if not batch_size or batch_size >= len(wh):
+        for _ in range(iterations):
+            labels, ious = best_match(wh, centers)
+            counts = np.bincount(labels, minlength=k)
+            updated = np.stack([np.bincount(labels, weights=wh[:, i], minlength=k) for i in range(2)], axis=1)
+            empty = counts == 0
+            updated[~empty] /= counts[~empty, None]
+            # An empty cluster takes over the worst covered boxes.
+            updated[empty] = wh[np.argsort(ious)[:empty.sum()]]
+            shift = np.abs(updated - centers).max() / centers.max()
+            centers = updated
+            if shift < tol:
+                break
+    else:
+        # Mini-batch k-means (Sculley, 2010): per-center learning rate 1 / number of boxes seen.
+        seen = np.zeros(k)
+        for _ in range(iterations):
+            batch = wh[rng.integers(len(wh), size=batch_size)]
+            labels, _ = best_match(batch, centers)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.stack([np.bincount(labels, weights=batch[:, i], minlength=k) for i in range(2)], axis=1)
+            hit = counts > 0
+            seen[hit] += counts[hit]
+            rate = counts[hit] / seen[hit]
+            updated = centers.copy()
+            updated[hit] = (1 - rate)[:, None] * centers[hit] + rate[:, None] * sums[hit] / counts[hit, None]
+            shift = np.abs(updated - centers).max() / centers.max()
+            centers = updated
+            if shift < tol:
+                break
+    return centers[np.argsort(centers[:, 0] * centers[:, 1])].astype(np.float32)
+
+
+def generator_anchors(anchor_generator: dict) -> list:
+    """
+    Anchor shapes that an mmdet anchor generator config produces, per feature map level.
+
+    Args:
+        anchor_generator (dict): 'AnchorGenerator' (base_sizes, scales, ratios) or 'YOLOAnchorGenerator' config.
+
+    Returns:
+        list: (A, 2) width/height array per level.
+    """
+    if anchor_generator['type'] == 'YOLOAnchorGenerator':
+        return [np.array(level, dtype=np.float32) for level in anchor_generator['base_sizes']]
+    base_sizes = anchor_generator.get('base_sizes', anchor_generator['strides'])
+    ratios = np.asarray(anchor_generator['ratios'], dtype=np.float32)
+    scales = np.asarray(anchor_generator['scales'], dtype=np.float32)
+    h_ratios = np.sqrt(ratios)
+    w_ratios = 1 / h_ratios
+    return [np.stack([(base * w_ratios[:, None] * scales[None, :]).ravel(),
+                      (base * h_ratios[:, None] * scales[None, :]).ravel()], axis=1)
+            for base in base_sizes]
+
+
+def to_anchor_generator(anchors: np.ndarray, strides: list, generator_type: str = 'AnchorGenerator') -> dict:
+    """
+    Turn clustered anchors into an mmdet anchor_generator config.
+
+    Anchors are assigned to levels in order of area, the same number per level.
+    YOLOAnchorGenerator takes the shapes as they are. AnchorGenerator builds every level
+    from shared ratios, so each level gets the geometric mean size of its anchors as base size
+    and the ratios (height / width, as mmdet defines them) are averaged over levels in log space.
+
+    Args:
+        anchors (np.ndarray): (K, 2) anchors sorted by area, K divisible by len(strides).
+        strides (list): Feature map strides, smallest first.
+        generator_type (str): 'AnchorGenerator' or 'YOLOAnchorGenerator'.
+
+    Returns:
+        dict: The anchor_generator config.
+    """
+    if len(anchors) % len(strides):
+        raise ValueError(f"{len(anchors)} anchors cannot be split evenly over {len(strides)} levels")
+    levels = np.split(np.asarray(anchors, dtype=np.float64), len(strides))
+    strides = [int(stride) for stride in strides]
+    if generator_type == 'YOLOAnchorGenerator':
+        return dict(type='YOLOAnchorGenerator',
+                    base_sizes=[[(int(round(w)), int(round(h))) for w, h in level] for level in levels],
+                    strides=strides)
+    if generator_type != 'AnchorGenerator':
+        raise ValueError(f"Unsupported anchor generator type '{generator_type}'")
+    log_ratios = np.stack([np.sort(np.log(level[:, 1] / level[:, 0])) for level in levels])
+    base_sizes = [float(np.exp(np.log(level[:, 0] * level[:, 1]).mean() / 2)) for level in levels]
+    return dict(type='AnchorGenerator',
+                strides=strides,
+                ratios=[round(float(ratio), 3) for ratio in np.exp(log_ratios.mean(axis=0))],
+                scales=[1.0],
+                base_sizes=[round(base, 1) for base in base_sizes])
+
+
+def optimize_anchors(wh: np.ndarray, strides: list, anchors_per_level: int = 3,
+                     generator_type: str = 'AnchorGenerator', iterations: int = 100,
+                     batch_size: int | None = None, seed: int = 0) -> dict:
+    """
+    Fit anchors to box shapes and measure how well they cover the boxes.
+
+    Args:
+        wh (np.ndarray): (N, 2) box widths and heights at network input resolution.
+        strides (list): Feature map strides, smallest first.
+        anchors_per_level (int): Anchors per feature map level.
+        generator_type (str): 'AnchorGenerator' or 'YOLOAnchorGenerator'.
+        iterations (int): See iou_kmeans.
+        batch_size (int, optional): See iou_kmeans.
+        seed (int): Seed for sampling.
+
+    Returns:
+        dict: 'anchor_generator' config, 'anchors' per level as (w, h) lists,
+            'mean_iou' - mean best IoU of the boxes with the clustered anchors,
+            'mean_iou_generator' - the same for the anchors the emitted config produces.
+    """
+    wh = np.asarray(wh, dtype=np.float32)
+    wh = wh[(wh[:, 0] > 0) & (wh[:, 1] > 0)]
+    anchors = iou_kmeans(wh, anchors_per_level * len(strides), iterations, batch_size, seed)
+    anchor_generator = to_anchor_generator(anchors, strides, generator_type)
+    produced = np.concatenate(generator_anchors(anchor_generator))
+    return {
+        'anchor_generator': anchor_generator,
+        'anchors': [[(round(float(w), 1), round(float(h), 1)) for w, h in level]
+                    for level in np.split(anchors, len(strides))],
+        'mean_iou': round(float(best_match(wh, anchors)[1].mean()), 4),
+        'mean_iou_generator': round(float(best_match(wh, produced)[1].mean()), 4),
+    }
@@ -0,0 +1,123 @@
+import os
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from auto_od.check.integrity import parse_voc
+from auto_od.data_preprocess.converter.base import DatasetConverter
+from auto_od.helper.archive import list_files, open_file
+from auto_od.helper.coco_stream import CocoWriter
+from auto_od.helper.materialize import materialize_file
+
+# XML files handed to the process pool at a time; bounds the number of pending results.
+TASK_SLICE = 8192
+
+
+def _convert_task(task: tuple) -> dict:
+    """Parse one annotation, fill a missing size from the image header and materialize the image."""
+    xml_path, image_dir, new_image_dir, link_mode = task
+    try:
+        annotation = parse_voc(xml_path)
+    except (ET.ParseError, ValueError) as e:
+        return {'xml': xml_path, 'error': f"{type(e).__name__}: {e}"}
+    image_path = os.path.join(image_dir, annotation['filename'])
+    try:
+        if not (annotation['width'] and annotation['height']):
+            with open_file(image_path) as f, Image.open(f) as img:
+                annotation['width'], annotation['height'] = img.size
+        if new_image_dir:
+            materialize_file(image_path, os.path.join(new_image_dir, annotation['filename']), link_mode)
+    except OSError as e:
+        return {'xml': xml_path, 'error': f"{type(e).__name__}: {e}"}
+    return annotation
+
+
+class VOCToCocoConverter(DatasetConverter):
+    """
+    Converts a PASCAL VOC dataset (XML files next to their images) to COCO without globox.
+
+    XML files are parsed in a process pool that also reads missing image sizes from the image
+    headers and materializes the images; results stream into a CocoWriter in sorted XML order,
+    so image and annotation ids are deterministic.
+
+    Attributes:
+        dataset_dir (str): Directory or zip archive with the XML files.
+        image_dir (str): Directory or zip archive with the images.
+        new_dataset_dir (str): Directory the images are materialized into, '' to leave them in place.
+        class_names (list): Category names in id order; labels not in it get the next ids in order of appearance.
+        link_mode (str): How images are placed into new_dataset_dir, see auto_od.helper.materialize.
+        workers (int): Number of worker processes.
+        skipped (list): (XML file, reason) of annotations that could not be converted in the last run.
+    """
+
+    def __init__(self, dataset_dir: str = "", new_dataset_dir: str = "", class_names: list = None,
+                 link_mode: str = 'auto', workers: int = None, image_dir: str = None):
+        """
+        Args:
+            dataset_dir (str): Directory with the XML files and images, or a zip archive (or a directory
+                inside one, e.g. 'annotations.zip/content/annotations') whose XML files are read without extracting.
+            new_dataset_dir (str): Directory the images are materialized into, '' to leave them in place.
+            class_names (list, optional): Category names in id order. Defaults to order of appearance.
+            link_mode (str): 'auto' (hard link, falling back to reflink or copy), 'copy', 'hardlink',
+                'symlink' or 'reflink'.
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+            image_dir (str, optional): Directory (or archive) with the images. Defaults to dataset_dir.
+        """
+        super().__init__(dataset_dir)
+        self.image_dir = image_dir or dataset_dir
+        self.new_dataset_dir = new_dataset_dir
+        self.class_names = list(class_names or [])
+        self.link_mode = link_mode
+        self.workers = workers or os.cpu_count()
+        self.skipped = []
+
+    def _results(self, tasks: list):
+        if self.workers == 1:
+            yield from map(_convert_task, tasks)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for start in range(0, len(tasks), TASK_SLICE):
+                chunk = tasks[start:start + TASK_SLICE]
+                yield from executor.map(_convert_task, chunk, chunksize=max(1, len(chunk) // (self.workers * 4)))
+
+    def convert(self, save_path: str) -> dict:
+        """
+        Convert the dataset and write the COCO annotation file.
+
+        Args:
+            save_path (str): Path of the COCO annotation file.
+
+        Returns:
+            dict: Number of images, annotations and skipped files, and objects per class.
+        """
+        if self.new_dataset_dir:
+            os.makedirs(self.new_dataset_dir, exist_ok=True)
+        xml_files = list_files(self.dataset_dir, ('.xml',))
+        tasks = [(path, self.image_dir, self.new_dataset_dir, self.link_mode) for path in xml_files]
+
+        category_ids = {name: i + 1 for i, name in enumerate(self.class_names)}
+        class_counts = Counter()
+        self.skipped = []
+        with CocoWriter(save_path) as writer:
+            for result in self._results(tasks):
+                if 'error' in result:
+                    self.skipped.append((result['xml'], result['error']))
+                    continue
+                image_id = writer.counts['images'] + 1
+                writer.add_image({'id': image_id, 'file_name': result['filename'],
+                                  'width': result['width'], 'height': result['height']})
+                for name, x, y, w, h in result['boxes']:
+                    category_id = category_ids.setdefault(name, len(category_ids) + 1)
+                    class_counts[name] += 1
+                    writer.add_annotation({'id': writer.counts['annotations'] + 1, 'image_id': image_id,
+                                           'category_id': category_id, 'bbox': [x, y, w, h], 'area': w * h,
+                                           'iscrowd': 0, 'segmentation': []})
+            writer.categories = [{'supercategory': 'none', 'id': category_id, 'name': name}
+                                 for name, category_id in category_ids.items()]
+
+        for xml_path, reason in self.skipped:
+            print(f"Skipped {xml_path}: {reason}")
+        return {'images': writer.counts['images'], 'annotations': writer.counts['annotations'],
+                'skipped': len(self.skipped), 'classes': dict(class_counts)}
@@ -1,9 +1,9 @@
 import os
-import shutil
 
 from globox import AnnotationSet
 
 from auto_od.data_preprocess.converter.base import DatasetConverter
+from auto_od.helper.materialize import Materializer
 
 
 class XMLToCocoConverter(DatasetConverter):
@@ -14,18 +14,22 @@ class XMLToCocoConverter(DatasetConverter):
         dataset_dir (str): Directory where the original dataset in XML format is located.
         new_dataset_dir (str): Directory where the new dataset in COCO format will be saved.
         annotation_set (AnnotationSet): Object representing the set of annotations in the dataset.
+        materializer (Materializer): Places the images into new_dataset_dir.
     """
 
-    def __init__(self, dataset_dir: str = "", new_dataset_dir: str = ""):
+    def __init__(self, dataset_dir: str = "", new_dataset_dir: str = "", link_mode: str = 'auto'):
         """
         Initialize the XMLToCocoConverter with dataset directories.
 
         Args:
             dataset_dir (str): Directory where the original dataset in XML format is located.
             new_dataset_dir (str): Directory where the new dataset in COCO format will be saved.
+            link_mode (str): 'auto' (hard link, falling back to reflink or copy), 'copy', 'hardlink',
+                'symlink' or 'reflink'.
         """
         super().__init__(dataset_dir)
         self.new_dataset_dir = new_dataset_dir
+        self.materializer = Materializer(link_mode)
         self.annotation_set = AnnotationSet.from_pascal_voc(self.dataset_dir)
 
     def convert(self, save_path: str):
@@ -39,10 +43,8 @@ class XMLToCocoConverter(DatasetConverter):
         print(self.annotation_set.show_stats())
         self.annotation_set.save_coco(save_path, auto_ids=True)
 
-        for image_id in self.annotation_set.image_ids:
-            image_path = os.path.join(self.dataset_dir, image_id)
-            new_image_path = os.path.join(self.new_dataset_dir, image_id)
-            shutil.copy(image_path, new_image_path)
+        self.materializer([(os.path.join(self.dataset_dir, image_id), os.path.join(self.new_dataset_dir, image_id))
+                           for image_id in self.annotation_set.image_ids])
 
     @staticmethod
     def stats_info(json_file_train: str, json_file_test: str = ''):
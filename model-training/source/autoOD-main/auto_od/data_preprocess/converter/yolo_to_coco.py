@@ -1,61 +1,213 @@
-# in development
-
-
-# import os
-# import shutil
-#
-# from globox import AnnotationSet
-#
-# from auto_od.data_preprocess.converter.base import DatasetConverter
-#
-#
-# class YOLOToCocoConverter:
-#     def __init__(self, annotation_dir: str = "", images_dir: str = ""):
-#         self.annotation_dir = annotation_dir
-#         self.images_dir = images_dir
-#         self.annotation_set = AnnotationSet.from_yolo(folder=self.annotation_dir,
-#                                                       image_folder=self.images_dir).map_labels({"0": "weapon",})
-#
-#     def convert(self, save_path: str):
-#         """
-#         Convert the dataset from XML to COCO format and save it.
-#
-#         Args:
-#             save_path (str): Path where the converted COCO format dataset should be saved.
-#         """
-#         # os.makedirs(self.new_dataset_dir, exist_ok=True)
-#         print(self.annotation_set.show_stats())
-#         self.annotation_set.save_pascal_voc(save_path)
-#         # self.annotation_set.save_coco(save_path, auto_ids=True)
-#
-#         # for image_id in self.annotation_set.image_ids:
-#         #     image_path = os.path.join(self.dataset_dir, image_id)
-#         #     new_image_path = os.path.join(self.new_dataset_dir, image_id)
-#         #     shutil.copy(image_path, new_image_path)
-#
-#     @staticmethod
-#     def stats_info(json_file_train: str, json_file_test: str = ''):
-#         """
-#         Display statistics information about the dataset.
-#
-#         Args:
-#             json_file_train (str): Path to the COCO format JSON file for the training set.
-#             json_file_test (str, optional): Path to the COCO format JSON file for the test set. Defaults to ''.
-#         """
-#         annotation_set = AnnotationSet.from_coco(json_file_train)
-#         print(annotation_set.show_stats())
-#         if json_file_test:
-#             annotation_set = AnnotationSet.from_coco(json_file_test)
-#             print(annotation_set.show_stats())
-#
-# #
-# # c = YOLOToCocoConverter(annotation_dir="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/labels",
-# #                         images_dir="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/images")
-#
-# # c.convert(save_path="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/xml_labels")
-#
-# c = YOLOToCocoConverter(annotation_dir="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/labels",
-#                         images_dir="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/images")
-#
-# c.convert(save_path="/Users/elinachertova/Downloads/CCTV_Guns_Dataset/xml_labels")
-#
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from auto_od.data_preprocess.converter.base import DatasetConverter
+from auto_od.helper.archive import is_file, list_files, open_file
+from auto_od.helper.coco_stream import CocoWriter
+from auto_od.helper.materialize import materialize_file
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# Images handed to a thread at a time; per-image futures would cost more than reading a small label file.
+CHUNK_SIZE = 256
+
+
+def load_class_names(names) -> list:
+    """
+    Read YOLO class names.
+
+    Args:
+        names: List of names, a data.yaml with a 'names' list or {index: name} mapping,
+            or a text file with one name per line.
+
+    Returns:
+        list: Class names indexed by YOLO class id.
+    """
+    if not isinstance(names, str):
+        return list(names)
+    if names.endswith(('.yaml', '.yml')):
+        with open_file(names, 'r') as f:
+            names = yaml.safe_load(f)['names']
+        if isinstance(names, dict):
+            return [str(names[i]) for i in sorted(names)]
+        return [str(name) for name in names]
+    with open_file(names, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def parse_labels(text: str) -> np.ndarray:
+    """
+    Parse a YOLO label file.
+
+    Files with five values per line are parsed in one NumPy call. Otherwise the lines are parsed
+    one by one: extra values after a box (a confidence) are ignored and segmentation polygons are
+    reduced to their bounding box.
+
+    Args:
+        text (str): Content of the label file.
+
+    Returns:
+        np.ndarray: (n, 5) array of class id, x center, y center, width, height, normalized.
+    """
+    text = text.strip()
+    if not text:
+        return np.empty((0, 5))
+    lines = text.splitlines()
+    try:
+        with warnings.catch_warnings():
+            # Older NumPy stops at malformed data with a DeprecationWarning, newer raises; the size check catches both.
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(text, sep=' ')
+    except ValueError:
+        values = None
+    # The total alone is not enough: a line with six values next to one with four adds up as well.
+    if values is not None and values.size == 5 * len(lines) and all(len(line.split()) == 5 for line in lines):
+        return values.reshape(len(lines), 5)
+
+    rows = []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) in (5, 6):
+            rows.append([float(token) for token in tokens[:5]])
+        elif len(tokens) >= 7 and len(tokens) % 2:
+            polygon = np.array(tokens[1:], dtype=float).reshape(-1, 2)
+            (x1, y1), (x2, y2) = polygon.min(axis=0), polygon.max(axis=0)
+            rows.append([float(tokens[0]), (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+        elif tokens:
+            raise ValueError(f"Unexpected line '{line}'")
+    return np.array(rows, dtype=float).reshape(-1, 5)
+
+
+class YOLOToCocoConverter(DatasetConverter):
+    """
+    Converts a YOLO dataset (an images directory and a labels directory with one .txt per image) to COCO.
+
+    Label files and image headers are read in a thread pool, all boxes are denormalized in one
+    vectorized operation and the annotation file is streamed out. Images without a label file
+    are kept as background images.
+
+    Attributes:
+        annotation_dir (str): Directory with the YOLO label files.
+        images_dir (str): Directory with the images.
+        new_dataset_dir (str): Directory the images are materialized into, '' to leave them in place.
+        class_names (list): Class names indexed by YOLO class id.
+        link_mode (str): How images are placed into new_dataset_dir, see auto_od.helper.materialize.
+        workers (int): Number of threads.
+        skipped (list): (file, reason) of images and labels that could not be converted in the last run.
+    """
+
+    def __init__(self, annotation_dir: str = "", images_dir: str = "", class_names=None, new_dataset_dir: str = "",
+                 link_mode: str = 'auto', workers: int = 16):
+        """
+        Args:
+            annotation_dir (str): Directory with the YOLO label files, or a zip archive (or a directory inside one).
+            images_dir (str): Directory with the images, or a zip archive (or a directory inside one).
+            class_names (optional): Class names as a list, a data.yaml or a names file (see load_class_names).
+                Defaults to classes.txt in annotation_dir if present, else to the class ids as names.
+            new_dataset_dir (str): Directory the images are materialized into, '' to leave them in place.
+            link_mode (str): 'auto' (hard link, falling back to reflink or copy), 'copy', 'hardlink',
+                'symlink' or 'reflink'.
+            workers (int): Number of threads; reading labels and image headers is I/O-bound.
+        """
+        super().__init__(images_dir)
+        self.annotation_dir = annotation_dir
+        self.images_dir = images_dir
+        self.new_dataset_dir = new_dataset_dir
+        classes_file = os.path.join(annotation_dir, 'classes.txt')
+        if class_names is None and is_file(classes_file):
+            class_names = classes_file
+        self.class_names = load_class_names(class_names) if class_names is not None else []
+        self.link_mode = link_mode
+        self.workers = workers
+        self.skipped = []
+
+    def _read(self, file_name: str) -> tuple:
+        """Read the label file and image size of one image and materialize the image."""
+        stem = os.path.splitext(file_name)[0]
+        image_path = os.path.join(self.images_dir, file_name)
+        label_path = os.path.join(self.annotation_dir, stem + '.txt')
+        try:
+            with open_file(label_path, 'r') as f:
+                labels = parse_labels(f.read())
+        except FileNotFoundError:
+            labels = np.empty((0, 5))
+        except (OSError, ValueError) as e:
+            return None, f"{label_path}: {type(e).__name__}: {e}"
+        try:
+            with open_file(image_path) as f, Image.open(f) as img:
+                size = img.size
+            if self.new_dataset_dir:
+                new_image_path = os.path.join(self.new_dataset_dir, file_name)
+                os.makedirs(os.path.dirname(new_image_path), exist_ok=True)
+                materialize_file(image_path, new_image_path, self.link_mode)
+        except OSError as e:
+            return None, f"{type(e).__name__}: {e}"
+        return (size, labels), None
+
+    def _read_chunk(self, file_names: list) -> list:
+        return [self._read(file_name) for file_name in file_names]
+
+    def convert(self, save_path: str) -> dict:
+        """
+        Convert the dataset and write the COCO annotation file.
+
+        Args:
+            save_path (str): Path of the COCO annotation file.
+
+        Returns:
+            dict: Number of images, annotations and skipped files.
+        """
+        if self.new_dataset_dir:
+            os.makedirs(self.new_dataset_dir, exist_ok=True)
+        # Names relative to the directory, so archive members and files on disk match alike.
+        file_names = [os.path.relpath(path, self.images_dir) for path in list_files(self.images_dir, IMAGE_EXTENSIONS)]
+        image_stems = {os.path.splitext(name)[0] for name in file_names}
+        self.skipped = [(path, "no image") for path in list_files(self.annotation_dir, ('.txt',))
+                        if os.path.splitext(os.path.relpath(path, self.annotation_dir))[0] not in image_stems
+                        and os.path.basename(path) != 'classes.txt']
+
+        images, sizes, labels = [], [], []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            chunks = [file_names[i:i + CHUNK_SIZE] for i in range(0, len(file_names), CHUNK_SIZE)]
+            results = (result for chunk in executor.map(self._read_chunk, chunks) for result in chunk)
+            for file_name, (result, error) in zip(file_names, results):
+                if error:
+                    self.skipped.append((file_name, error))
+                    continue
+                images.append(file_name)
+                sizes.append(result[0])
+                labels.append(result[1])
+
+        counts = np.array([len(boxes) for boxes in labels], dtype=np.int64)
+        boxes = np.concatenate(labels) if labels else np.empty((0, 5))
+        image_index = np.repeat(np.arange(len(images)), counts)
+        box_sizes = np.array(sizes, dtype=np.float64).reshape(-1, 2)[image_index]
+        classes = boxes[:, 0].astype(np.int64)
+        wh = boxes[:, 3:5] * box_sizes
+        xy = boxes[:, 1:3] * box_sizes - wh / 2
+        bboxes = np.round(np.concatenate([xy, wh], axis=1), 3)
+        areas = np.round(wh[:, 0] * wh[:, 1], 3)
+
+        class_names = list(self.class_names)
+        if classes.size and classes.max() >= len(class_names):
+            class_names += [str(i) for i in range(len(class_names), int(classes.max()) + 1)]
+        if classes.size and classes.min() < 0:
+            raise ValueError(f"Negative class id {classes.min()} in {self.annotation_dir}")
+
+        categories = [{'supercategory': 'none', 'id': i + 1, 'name': name} for i, name in enumerate(class_names)]
+        with CocoWriter(save_path, categories) as writer:
+            for image_id, (file_name, (width, height)) in enumerate(zip(images, sizes), 1):
+                writer.add_image({'id': image_id, 'file_name': file_name, 'width': width, 'height': height})
+            for annotation_id, (image_id, category_id, bbox, area) in enumerate(
+                    zip((image_index + 1).tolist(), (classes + 1).tolist(), bboxes.tolist(), areas.tolist()), 1):
+                writer.add_annotation({'id': annotation_id, 'image_id': image_id, 'category_id': category_id,
+                                       'bbox': bbox, 'area': area, 'iscrowd': 0, 'segmentation': []})
+
+        for path, reason in self.skipped:
+            print(f"Skipped {path}: {reason}")
+        return {'images': writer.counts['images'], 'annotations': writer.counts['annotations'],
+                'skipped': len(self.skipped)}
@@ -1,8 +1,13 @@
 import json
+import math
 import os
 import random
-import shutil
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+from auto_od.check.duplicates import DuplicateDetector
+from auto_od.helper.coco_index import CocoIndex
+from auto_od.helper.coco_stream import merge_coco_files
+from auto_od.helper.materialize import Materializer
 
 
 class BalancedCOCOSplitter:
@@ -10,17 +15,20 @@ class BalancedCOCOSplitter:
     Class to split and balance COCO-style datasets.
 
     Parameters:
-        coco_file (str): Path to the COCO annotation file.
+        coco_file (str): Path to the COCO annotation file or to its columnar cache directory.
         image_dir (str): Directory containing the images.
         seed (int): Seed for random operations.
+        link_mode (str): How images are placed into the split directories, see auto_od.helper.materialize.
 
     Methods:
         create_balanced_subset(oversample=False)
-        split_dataset(balanced_data, train_ratio=0.8)
+        repeat_factors(images, oversample_thr=None)
+        split_dataset(balanced_data, train_ratio=0.8, groups=None, seed=None)
+        duplicate_groups(images, max_distance=4)
         save_split_data(dataset, subset, output_dir, output_file)
     """
 
-    def __init__(self, coco_file: str, image_dir: str, seed: int = 42):
+    def __init__(self, coco_file: str, image_dir: str, seed: int = 42, link_mode: str = 'auto'):
         """
         Initialize the splitter with necessary parameters.
 
@@ -28,91 +36,142 @@ class BalancedCOCOSplitter:
             coco_file (str): Path to the COCO annotation file.
             image_dir (str): Directory containing the images.
             seed (int): Seed for random operations.
+            link_mode (str): 'auto' (hard link, falling back to reflink or copy), 'copy', 'hardlink',
+                'symlink' or 'reflink'.
         """
         self.coco_file = coco_file
         self.image_dir = image_dir
         self.seed = seed
-        self.data = self._load_data()
+        self.materializer = Materializer(link_mode)
+        self.index = CocoIndex.from_file(coco_file)
+        self.data = self.index.data
         self.class_images = defaultdict(list)
+        self.class_balance = None
         self._organize_data()
 
-    def _load_data(self):
-        with open(self.coco_file, 'r') as f:
-            return json.load(f)
-
     def _organize_data(self):
-        image_ids_with_annotations = set()
-        for ann in self.data['annotations']:
-            image_id = ann['image_id']
-            category_id = ann['category_id']
-            self.class_images[category_id].append(image_id)
-            image_ids_with_annotations.add(image_id)
+        for category_id, image_ids in self.index.category_images.items():
+            self.class_images[category_id] = list(image_ids)
 
-        for image in self.data['images']:
-            if image['id'] not in image_ids_with_annotations:
-                self.class_images[-1].append(image['id'])
+        unannotated = self.index.unannotated_images()
+        if unannotated:
+            self.class_images[-1] = unannotated
 
     def create_balanced_subset(self, oversample: bool = False):
         """
-        Create a balanced subset of the dataset.
+        Create the subset of the dataset that is split: every image once, annotated or not.
+
+        Images of rare classes are not duplicated here; duplicated ids were lost in the image set anyway and
+        duplicated files would cost disk and I/O. They are repeated at load time instead, see repeat_factors.
 
         Args:
-            oversample (bool): Whether to oversample classes with fewer samples.
+            oversample (bool): Also compute the repeat factors of the subset into self.class_balance.
 
         Returns:
             dict: Balanced subset of the COCO dataset.
         """
-        max_samples_per_class = max([len(images) for images in self.class_images.values()])
-
         balanced_images = set()
-        random.seed(self.seed)
-
-        for class_id, images in self.class_images.items():
-            if len(images) < max_samples_per_class and oversample:
-                oversampled_images = images * (max_samples_per_class // len(images)) + images[
-                                                                                       :max_samples_per_class % len(
-                                                                                           images)]
-                balanced_images.update(oversampled_images)
-            else:
-                balanced_images.update(images)
-
-        balanced_annotations = [ann for ann in self.data['annotations'] if ann['image_id'] in balanced_images]
-        balanced_images_info = [img for img in self.data['images'] if img['id'] in balanced_images]
-
-        return {
-            'images': balanced_images_info,
-            'annotations': balanced_annotations,
-            'categories': self.data['categories']
-        }
+        for images in self.class_images.values():
+            balanced_images.update(images)
+
+        subset = self.index.subset([img for img in self.data['images'] if img['id'] in balanced_images])
+        if oversample:
+            self.class_balance = self.repeat_factors(subset['images'])
+        return subset
+
+    def repeat_factors(self, images: list, oversample_thr: float = None) -> dict:
+        """
+        Settings for class-balanced sampling at load time.
+
+        Same rule as mmdet's ClassBalancedDataset (repeat factor sampling, Gupta et al., LVIS, 2019):
+        a class seen in a fraction f of the images gets r = max(1, sqrt(oversample_thr / f)), an image
+        the largest r of its classes; images without annotations count as one more class.
+        The wrapper recomputes the per-image factors from the annotations, so only oversample_thr is used
+        for training; the image counts are informational.
+
+        Args:
+            images (list): Image records, usually the training set.
+            oversample_thr (float, optional): Image frequency below which a class is repeated.
+                Defaults to the frequency of the most common class, which lifts every class towards it.
+
+        Returns:
+            dict: 'type' and 'oversample_thr' for the ClassBalancedDataset wrapper; 'images', 'repeated_images'
+                (images with a factor above 1) and 'epoch_images' (images per epoch after repeating).
+        """
+        image_classes = {img['id']: set() for img in images}
+        for category_id, image_ids in self.class_images.items():
+            for image_id in image_ids:
+                if image_id in image_classes and category_id != -1:
+                    image_classes[image_id].add(category_id)
+        frequencies = Counter(category for classes in image_classes.values() for category in (classes or {-1}))
+        n_images = max(len(images), 1)
+        if oversample_thr is None:
+            oversample_thr = max(frequencies.values(), default=0) / n_images
+        class_factors = {category: max(1.0, math.sqrt(oversample_thr / (count / n_images)))
+                         for category, count in frequencies.items()}
+
+        factors = {img['file_name']: max(class_factors[category] for category in (image_classes[img['id']] or {-1}))
+                   for img in images}
+        return {'type': 'ClassBalancedDataset',
+                'oversample_thr': oversample_thr,
+                'images': len(images),
+                'repeated_images': sum(factor > 1 for factor in factors.values()),
+                'epoch_images': sum(math.ceil(factor) for factor in factors.values())}
 
     @staticmethod
-    def split_dataset(balanced_data: dict, train_ratio=0.8):
+    def split_dataset(balanced_data: dict, train_ratio=0.8, groups: dict = None, seed: int = None):
         """
         Split the dataset into training and testing sets.
 
         Args:
             balanced_data (dict): Balanced subset of the COCO dataset.
             train_ratio (float): Ratio of images to include in the training set.
+            groups (dict, optional): Image id -> group label; images of one group end up in the same set.
+            seed (int, optional): Seed of the shuffle.
 
         Returns:
             tuple: Training and testing sets.
         """
         images = balanced_data['images']
-        random.shuffle(images)
+        random.Random(seed).shuffle(images)
         n_total = len(images)
         n_train = int(n_total * train_ratio)
 
-        train_set = images[:n_train]
-        test_set = images[n_train:]
-
+        if not groups:
+            train_set = images[:n_train]
+            test_set = images[n_train:]
+            return train_set, test_set
+
+        grouped = defaultdict(list)
+        for img in images:
+            grouped[groups.get(img['id'], ('image', img['id']))].append(img)
+        train_set, test_set = [], []
+        for members in grouped.values():
+            (train_set if len(train_set) < n_train else test_set).extend(members)
         return train_set, test_set
 
+    def duplicate_groups(self, images: list, max_distance: int = 4, cache_path: str = None) -> dict:
+        """
+        Group exact and near-duplicate images by perceptual hash.
+
+        Args:
+            images (list): Image records.
+            max_distance (int): Largest Hamming distance of the 64-bit pHashes of duplicates.
+            cache_path (str, optional): Hash cache file, see DuplicateDetector.
+
+        Returns:
+            dict: Image id -> group label, for split_dataset.
+        """
+        detector = DuplicateDetector(max_distance=max_distance, cache_path=cache_path)
+        labels = detector.groups([os.path.join(self.image_dir, img['file_name']) for img in images])
+        return {img['id']: int(label) for img, label in zip(images, labels)}
+
     def save_split_data(self, dataset, subset, output_dir, output_file):
         """
         Save the split data to specified directories and files.
 
         Args:
-            dataset (dict): Original COCO dataset.
+            dataset (dict | CocoIndex): Original COCO dataset, or an index over it.
             subset (list): Subset of images to save.
             output_dir (str): Directory to save the images.
             output_file (str): File to save the annotations.
@@ -120,32 +179,47 @@ class BalancedCOCOSplitter:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        subset_annotations = [ann for ann in dataset['annotations'] if ann['image_id'] in [img['id'] for img in subset]]
-        subset_data = {
-            'images': subset,
-            'annotations': subset_annotations,
-            'categories': dataset['categories']
-        }
+        index = dataset if isinstance(dataset, CocoIndex) else CocoIndex(dataset)
+        subset_data = index.subset(subset)
 
+        # Compact output: the indented encoder runs in pure Python and dominates on large datasets.
         with open(output_file, 'w') as f:
-            json.dump(subset_data, f, indent=4)
+            json.dump(subset_data, f)
+
+        self.materializer([(os.path.join(self.image_dir, img['file_name']), os.path.join(output_dir, img['file_name']))
+                           for img in subset])
 
-        for img in subset:
-            file_name = img['file_name']
-            shutil.copy(os.path.join(self.image_dir, file_name), os.path.join(output_dir, file_name))
+    def __call__(self, output_train_dir, output_train_json, output_test_dir, output_test_json,
+                 group_duplicates: bool = False, max_distance: int = 4, class_balance_json: str = None,
+                 oversample_thr: float = None):
+        """
+        Balance, split and save the dataset.
 
-    def __call__(self, output_train_dir, output_train_json, output_test_dir, output_test_json):
+        Args:
+            group_duplicates (bool): Keep duplicate images on the same side of the split, so none leak into the test set.
+            max_distance (int): Hamming distance of perceptual hashes that still counts as a duplicate.
+            class_balance_json (str, optional): Where to save the class balance settings of the training set,
+                for ModelConfig.set_custom_params(class_balance=...).
+            oversample_thr (float, optional): See repeat_factors.
+        """
         balanced_data = self.create_balanced_subset()
-        train_set, test_set = self.split_dataset(balanced_data, train_ratio=0.8)
+        groups = self.duplicate_groups(balanced_data['images'], max_distance) if group_duplicates else None
+        train_set, test_set = self.split_dataset(balanced_data, train_ratio=0.8, groups=groups, seed=self.seed)
 
-        self.save_split_data(balanced_data, train_set,
+        balanced_index = CocoIndex(balanced_data)
+        self.save_split_data(balanced_index, train_set,
                              output_train_dir,
                              output_train_json)
-        self.save_split_data(balanced_data,
+        self.save_split_data(balanced_index,
                              test_set,
                              output_test_dir,
                              output_test_json)
 
+        if class_balance_json:
+            self.class_balance = self.repeat_factors(train_set, oversample_thr)
+            with open(class_balance_json, 'w') as f:
+                json.dump(self.class_balance, f)
+
 
 def load_json(file_path: str):
     """
@@ -179,6 +253,7 @@ def join_coco_annotations(file_path1: str, file_path2: str, output_file_path: st
 
     This function merges two COCO datasets by updating image, annotation,
     and category IDs to ensure they are unique across the combined dataset.
+    It streams both files, see merge_coco_files for any number of inputs.
 
     Args:
         file_path1 (str): Path to the first COCO annotation file.
@@ -188,43 +263,4 @@ def join_coco_annotations(file_path1: str, file_path2: str, output_file_path: st
     Returns:
         None: The combined annotation file is saved to the specified path.
     """
-    data1 = load_json(file_path1)
-    data2 = load_json(file_path2)
-
-    max_image_id = max([img['id'] for img in data1['images']], default=0)
-    max_annotation_id = max([ann['id'] for ann in data1['annotations']], default=0)
-    max_category_id = max([cat['id'] for cat in data1['categories']], default=0)
-
-    category_name_to_id = {cat['name']: cat['id'] for cat in data1['categories']}
-
-    category_id_mapping = {}
-    for cat in data2['categories']:
-        if cat['name'] not in category_name_to_id:
-            max_category_id += 1
-            category_id_mapping[cat['id']] = max_category_id
-            cat['id'] = max_category_id
-            category_name_to_id[cat['name']] = max_category_id
-            data1['categories'].append(cat)
-        else:
-            category_id_mapping[cat['id']] = category_name_to_id[cat['name']]
-
-    image_id_mapping = {}
-    for image in data2['images']:
-        old_id = image['id']
-        max_image_id += 1
-        image_id_mapping[old_id] = max_image_id
-        image['id'] = max_image_id
-
-    for annotation in data2['annotations']:
-        annotation['image_id'] = image_id_mapping[annotation['image_id']]
-        annotation['category_id'] = category_id_mapping[annotation['category_id']]
-        max_annotation_id += 1
-        annotation['id'] = max_annotation_id
-
-    combined_data = {
-        'images': data1['images'] + data2['images'],
-        'annotations': data1['annotations'] + data2['annotations'],
-        'categories': data1['categories']
-    }
-
-    save_json(combined_data, output_file_path)
+    merge_coco_files([file_path1, file_path2], output_file_path)
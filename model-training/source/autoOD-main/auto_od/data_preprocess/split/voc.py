@@ -1,55 +1,197 @@
-# in development
-
-# import os
-# import xml.etree.ElementTree as ET
-#
-# from auto_od.data_preprocess.split.base import BaseSplit
-#
-#
-# class PascalVocSplit(BaseSplit):
-#     def split_dataset(self):
-#         xml_files = [f for f in os.listdir(os.path.join(self.dataset_dir, 'Annotations')) if f.endswith('.xml')]
-#         class_counts = {}
-#         test_counts = {}
-#
-#         train_output_dir, test_output_dir = self.create_output_dirs()
-#
-#         for xml_file in xml_files:
-#             tree = ET.parse(os.path.join(self.dataset_dir, 'Annotations', xml_file))
-#             root = tree.getroot()
-#             has_test_class = False
-#
-#             for obj in root.findall('object'):
-#                 class_name = obj.find('name').text
-#
-#                 if class_name not in class_counts:
-#                     class_counts[class_name] = 0
-#                     test_counts[class_name] = 0
-#                 class_counts[class_name] += 1
-#
-#                 if test_counts[class_name] < class_counts[class_name] * self.test_proportion:
-#                     test_output_file = os.path.join(test_output_dir, xml_file)
-#                     has_test_class = True
-#                     test_counts[class_name] += 1
-#                     break
-#
-#             if not has_test_class:
-#                 train_output_file = os.path.join(train_output_dir, xml_file)
-#             else:
-#                 test_output_file = os.path.join(test_output_dir, xml_file)
-#
-#             if has_test_class:
-#                 ET.ElementTree(root).write(test_output_file)
-#             else:
-#                 ET.ElementTree(root).write(train_output_file)
-#
-#
-# if __name__ == '__main__':
-#     dataset_dir = 'path_to_dataset_directory'  # Replace with your dataset directory
-#     output_dir = 'path_to_output_directory'      # Replace with your desired output directory
-#
-#     pascal_voc_splitter = PascalVocSplit(dataset_dir, os.path.join(output_dir, 'pascal_voc'))
-#     # coco_splitter = CocoSplit(dataset_dir, os.path.join(output_dir, 'coco'))
-#
-#     pascal_voc_splitter.split_dataset()
-#     # coco_splitter.split_dataset()
\ No newline at end of file
+import os
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from auto_od.data_preprocess.split.base import BaseSplit
+from auto_od.helper.archive import list_files, local_dir, open_file
+
+
+def class_counts(xml_path: str) -> Optional[dict]:
+    """
+    Count the objects per class of a PASCAL VOC annotation in one streaming pass.
+
+    Args:
+        xml_path (str): Annotation file.
+
+    Returns:
+        dict | None: Class name -> number of objects, None for malformed or truncated files, which must not
+            pass for images without objects.
+    """
+    counts = Counter()
+    try:
+        with open_file(xml_path) as f:
+            for _, element in ET.iterparse(f):
+                if element.tag == 'object':
+                    counts[element.findtext('name', '').strip()] += 1
+                    element.clear()
+    except ET.ParseError:
+        return None
+    return dict(counts)
+
+
+class PascalVocSplit(BaseSplit):
+    """
+    Splits a PASCAL VOC dataset into ImageSets/Main lists by iterative stratification.
+
+    Annotations are read once in a process pool, keeping only per-file class counts; the
+    assignment works on these count vectors (Sechidis et al., "On the stratification of
+    multi-label data", 2011). The rarest class is distributed first, every file goes to the
+    subset that still wants most objects of that class. Only the split lists are written,
+    XML files and images stay where they are.
+
+    Attributes:
+        dataset_dir (str): VOC root with the Annotations directory, also inside a zip archive.
+        test_proportion (float): Share of files in the test set.
+        val_proportion (float): Share of files in the validation set, 0 for no validation set.
+        seed (int): Seed for breaking ties.
+        workers (int): Number of worker processes.
+        skipped (list): Annotation files of the last collect that could not be parsed; they are in no list.
+    """
+
+    def __init__(self, dataset_dir: str, test_proportion: float = 0.2, val_proportion: float = 0.0,
+                 seed: int = 42, workers: int = None):
+        """
+        Args:
+            dataset_dir (str): VOC root with the Annotations directory, or a zip archive holding it
+                (e.g. 'VOC2012.zip' or 'data.zip/VOC2012'); the annotations are read without extracting.
+            test_proportion (float): Share of files in the test set.
+            val_proportion (float): Share of files in the validation set.
+            seed (int): Seed for breaking ties.
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        """
+        super().__init__(test_proportion)
+        self.dataset_dir = dataset_dir
+        self.val_proportion = val_proportion
+        self.seed = seed
+        self.workers = workers or os.cpu_count()
+        self.skipped = []
+
+    def collect(self) -> tuple:
+        """
+        Read the class counts of all annotations; unparsable ones are left out and recorded in skipped.
+
+        Returns:
+            tuple: Sorted file stems, class names, and the counts in CSR form:
+                (indptr, class indices, counts) as NumPy arrays.
+        """
+        paths = list_files(os.path.join(self.dataset_dir, 'Annotations'), ('.xml',))
+        stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(class_counts, paths, chunksize=max(1, len(paths) // (self.workers * 16))))
+
+        self.skipped = [path for path, result in zip(paths, results) if result is None]
+        stems = [stem for stem, result in zip(stems, results) if result is not None]
+        results = [result for result in results if result is not None]
+
+        class_ids = {}
+        indptr, indices, counts = [0], [], []
+        for result in results:
+            for name, count in result.items():
+                indices.append(class_ids.setdefault(name, len(class_ids)))
+                counts.append(count)
+            indptr.append(len(indices))
+        return stems, list(class_ids), (np.array(indptr), np.array(indices, dtype=np.int64),
+                                         np.array(counts, dtype=np.float64))
+
+    def split_dataset(self, counts: tuple, n_classes: int) -> np.ndarray:
+        """
+        Assign files to subsets by iterative stratification of their class-count vectors.
+
+        Args:
+            counts (tuple): (indptr, class indices, counts) as returned by collect.
+            n_classes (int): Number of classes.
+
+        Returns:
+            np.ndarray: Subset of every file: 0 train, 1 test, 2 validation.
+        """
+        indptr, indices, values = counts
+        n_files = len(indptr) - 1
+        ratios = np.array([1 - self.test_proportion - self.val_proportion, self.test_proportion, self.val_proportion])
+        ratios = ratios[:3 if self.val_proportion else 2]
+        rng = np.random.default_rng(self.seed)
+
+        file_of = np.repeat(np.arange(n_files), np.diff(indptr))
+        desired = ratios[:, None] * np.bincount(indices, weights=values, minlength=n_classes)[None, :]
+        desired_files = ratios * n_files
+        # Files not yet assigned per class; the class with the fewest is distributed next.
+        remaining = np.bincount(indices, minlength=n_classes).astype(np.int64)
+        order = np.argsort(indices, kind='stable')
+        class_starts = np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=n_classes))])
+        assignment = np.full(n_files, -1, dtype=np.int64)
+
+        def assign(file: int, subset: int):
+            assignment[file] = subset
+            start, end = indptr[file], indptr[file + 1]
+            desired[subset, indices[start:end]] -= values[start:end]
+            remaining[indices[start:end]] -= 1
+            desired_files[subset] -= 1
+
+        while True:
+            active = np.flatnonzero(remaining > 0)
+            if not active.size:
+                break
+            label = active[np.argmin(remaining[active])]
+            files = file_of[order[class_starts[label]:class_starts[label + 1]]]
+            for file in rng.permutation(files[assignment[files] < 0]):
+                # Most wanted objects of the class, then most wanted files, then random.
+                key = np.lexsort((rng.random(len(ratios)), desired_files, desired[:, label]))
+                assign(file, key[-1])
+
+        for file in rng.permutation(np.flatnonzero(assignment < 0)):
+            assign(file, int(np.argmax(desired_files)))
+        return assignment
+
+    def save(self, stems: list, assignment: np.ndarray, output_dir: str = None) -> dict:
+        """
+        Write one list of file stems per subset.
+
+        Args:
+            stems (list): File stems.
+            assignment (np.ndarray): Subset of every file, see split_dataset.
+            output_dir (str, optional): Directory of the lists. Defaults to ImageSets/Main of the dataset,
+                next to the archive for datasets inside one.
+
+        Returns:
+            dict: Subset name -> path of its list.
+        """
+        output_dir = output_dir or os.path.join(local_dir(self.dataset_dir), 'ImageSets', 'Main')
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {}
+        for subset, name in enumerate(('train', 'test', 'val')[:3 if self.val_proportion else 2]):
+            paths[name] = os.path.join(output_dir, f'{name}.txt')
+            with open(paths[name], 'w') as f:
+                f.writelines(stems[i] + '\n' for i in np.flatnonzero(assignment == subset))
+        return paths
+
+    def __call__(self, output_dir: str = None) -> dict:
+        """
+        Collect, split and save.
+
+        Args:
+            output_dir (str, optional): Directory of the lists. Defaults to ImageSets/Main of the dataset.
+
+        Returns:
+            dict: Subset name -> number of files and objects per class, and 'skipped': the number of
+                annotation files that could not be parsed.
+        """
+        stems, class_names, counts = self.collect()
+        assignment = self.split_dataset(counts, len(class_names))
+        paths = self.save(stems, assignment, output_dir)
+
+        indptr, indices, values = counts
+        file_subset = np.repeat(assignment, np.diff(indptr))
+        summary = {}
+        for subset, name in enumerate(paths):
+            objects = np.bincount(indices[file_subset == subset], weights=values[file_subset == subset],
+                                  minlength=len(class_names))
+            summary[name] = {'files': int((assignment == subset).sum()),
+                             'classes': dict(zip(class_names, objects.astype(int).tolist()))}
+
+        for xml_path in self.skipped:
+            print(f"Skipped {xml_path}: malformed XML")
+        summary['skipped'] = len(self.skipped)
+        return summary
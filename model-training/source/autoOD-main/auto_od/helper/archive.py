@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+from datetime import datetime
+
+ARCHIVE_SUFFIX = '.zip'
+# Open archives per process: a ZipFile inherited through fork shares its file offset with the parent.
+_archives = {}
+
+
+def split_path(path: str) -> tuple | None:
+    """
+    Split a path that leads into a zip archive, e.g. 'images/annotations.zip/content/annotations/1.xml'.
+
+    Args:
+        path (str): File system path or archive path.
+
+    Returns:
+        tuple | None: (archive file, member name or prefix without leading '/'), or None for plain paths.
+    """
+    normalized = os.fspath(path).replace(os.sep, '/')
+    position = 0
+    while True:
+        position = normalized.lower().find(ARCHIVE_SUFFIX, position)
+        if position < 0:
+            return None
+        end = position + len(ARCHIVE_SUFFIX)
+        if end == len(normalized) or normalized[end] == '/':
+            archive_path = normalized[:end]
+            if os.path.isfile(archive_path):
+                return archive_path, normalized[end + 1:].strip('/')
+        position = end
+
+
+def is_archive_path(path: str) -> bool:
+    return split_path(path) is not None
+
+
+def _archive(archive_path: str) -> zipfile.ZipFile:
+    key = (os.getpid(), archive_path)
+    if key not in _archives:
+        _archives[key] = zipfile.ZipFile(archive_path)
+    return _archives[key]
+
+
+def _member(path: str) -> tuple:
+    archive_path, name = split_path(path)
+    try:
+        return _archive(archive_path), _archive(archive_path).getinfo(name)
+    except KeyError:
+        raise FileNotFoundError(f"No member '{name}' in {archive_path}") from None
+
+
+def open_file(path: str, mode: str = 'rb', encoding: str = 'utf-8'):
+    """
+    Open a file for reading, from the file system or from inside a zip archive.
+
+    Args:
+        path (str): File system path or archive path.
+        mode (str): 'rb' or 'r'.
+        encoding (str): Encoding of text mode.
+
+    Returns:
+        A binary or text file object.
+    """
+    if not is_archive_path(path):
+        return open(path, mode) if 'b' in mode else open(path, mode, encoding=encoding)
+    archive, info = _member(path)
+    member = archive.open(info)
+    return member if 'b' in mode else io.TextIOWrapper(member, encoding=encoding)
+
+
+def file_stat(path: str) -> tuple:
+    """
+    Size and modification time of a file or an archive member.
+
+    Returns:
+        tuple: (size in bytes, mtime in ns); members carry the zip timestamp, which has a 2 s resolution.
+    """
+    if not is_archive_path(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    _, info = _member(path)
+    return info.file_size, int(datetime(*info.date_time).timestamp()) * 10 ** 9
+
+
+def is_file(path: str) -> bool:
+    try:
+        file_stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+    return not os.path.isdir(path)
+
+
+def list_files(directory: str, suffixes: tuple) -> list:
+    """
+    List the files of a directory or of an archive, sorted.
+
+    Only direct entries are listed, of a directory on disk and of an archive (or a directory inside one) alike,
+    so a dataset gives the same files zipped and unzipped.
+
+    Args:
+        directory (str): Directory, archive, or directory inside an archive.
+        suffixes (tuple): Accepted file name endings, lower case.
+
+    Returns:
+        list: Paths of the files; archive members as archive paths that open_file accepts.
+    """
+    if not is_archive_path(directory):
+        return sorted(entry.path for entry in os.scandir(directory)
+                      if entry.is_file() and entry.name.lower().endswith(suffixes))
+    archive_path, prefix = split_path(directory)
+    prefix = prefix + '/' if prefix else ''
+    return sorted(f'{archive_path}/{info.filename}' for info in _archive(archive_path).infolist()
+                  if not info.is_dir() and info.filename.startswith(prefix)
+                  and '/' not in info.filename[len(prefix):] and info.filename.lower().endswith(suffixes))
+
+
+def local_dir(path: str) -> str:
+    """
+    Directory on disk where files derived from path (caches, split lists) can be written.
+
+    Args:
+        path (str): File system path or archive path.
+
+    Returns:
+        str: path itself for plain paths, the directory holding the archive otherwise.
+    """
+    parts = split_path(path)
+    return path if parts is None else os.path.dirname(parts[0])
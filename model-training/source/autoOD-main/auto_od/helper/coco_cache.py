@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+
+from auto_od.helper.archive import file_stat, open_file, split_path
+
+CACHE_SUFFIX = '.coco_cache'
+# 2: 'lossless' also requires the float32 boxes and areas to equal the source values.
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+
+# Keys that the columns hold; annotations or images with anything else, or with boxes and areas that float32
+# does not represent exactly (e.g. 10.3), are cached but marked lossy, and load_coco keeps reading the JSON for them.
+ANNOTATION_KEYS = {'id', 'image_id', 'category_id', 'bbox', 'area', 'iscrowd', 'segmentation'}
+IMAGE_KEYS = {'id', 'file_name', 'width', 'height'}
+
+COLUMNS = ('ann_ids', 'image_ids', 'category_ids', 'bboxes', 'areas', 'iscrowd',
+           'img_ids', 'img_widths', 'img_heights', 'img_file_names')
+
+
+@dataclass
+class CocoColumns:
+    """
+    COCO detection annotations as column arrays.
+
+    Attributes:
+        ann_ids (np.ndarray): int64 annotation ids.
+        image_ids (np.ndarray): int32 image id per annotation.
+        category_ids (np.ndarray): int32 category id per annotation.
+        bboxes (np.ndarray): float32 (N, 4) boxes in COCO xywh.
+        areas (np.ndarray): float32 annotation areas.
+        iscrowd (np.ndarray): uint8 crowd flags.
+        img_ids (np.ndarray): int32 image ids.
+        img_widths (np.ndarray): int32 image widths.
+        img_heights (np.ndarray): int32 image heights.
+        img_file_names (np.ndarray): Unicode image file names.
+        categories (list): Category records as in the source file.
+        lossless (bool): Whether to_coco() reproduces every field of the source file.
+    """
+    ann_ids: np.ndarray
+    image_ids: np.ndarray
+    category_ids: np.ndarray
+    bboxes: np.ndarray
+    areas: np.ndarray
+    iscrowd: np.ndarray
+    img_ids: np.ndarray
+    img_widths: np.ndarray
+    img_heights: np.ndarray
+    img_file_names: np.ndarray
+    categories: list
+    lossless: bool = True
+
+    @classmethod
+    def from_coco(cls, data: dict) -> CocoColumns:
+        """
+        Convert a COCO dataset into columns.
+
+        Args:
+            data (dict): The COCO dataset.
+
+        Returns:
+            CocoColumns: Column arrays of the dataset.
+        """
+        annotations = data['annotations']
+        images = data['images']
+        source_bboxes = np.array([ann['bbox'] for ann in annotations], dtype=np.float64).reshape(-1, 4)
+        source_areas = np.array([ann.get('area', np.nan) for ann in annotations], dtype=np.float64)
+        bboxes = source_bboxes.astype(np.float32)
+        areas = source_areas.astype(np.float32)
+        missing = np.isnan(source_areas)
+        areas[missing] = bboxes[missing, 2] * bboxes[missing, 3]
+        lossless = (np.array_equal(bboxes.astype(np.float64), source_bboxes)
+                    and np.array_equal(areas[~missing].astype(np.float64), source_areas[~missing])
+                    and all(ann.keys() <= ANNOTATION_KEYS and not ann.get('segmentation') for ann in annotations)
+                    and all(img.keys() <= IMAGE_KEYS for img in images))
+        return cls(
+            ann_ids=np.array([ann['id'] for ann in annotations], dtype=np.int64),
+            image_ids=np.array([ann['image_id'] for ann in annotations], dtype=np.int32),
+            category_ids=np.array([ann['category_id'] for ann in annotations], dtype=np.int32),
+            bboxes=bboxes,
+            areas=areas,
+            iscrowd=np.array([ann.get('iscrowd', 0) for ann in annotations], dtype=np.uint8),
+            img_ids=np.array([img['id'] for img in images], dtype=np.int32),
+            img_widths=np.array([img.get('width', 0) for img in images], dtype=np.int32),
+            img_heights=np.array([img.get('height', 0) for img in images], dtype=np.int32),
+            img_file_names=np.array([img['file_name'] for img in images], dtype=np.str_),
+            categories=data.get('categories', []),
+            lossless=lossless,
+        )
+
+    def to_coco(self) -> dict:
+        """
+        Rebuild a COCO dataset from the columns; segmentation and extra keys are not kept.
+
+        Returns:
+            dict: The COCO dataset.
+        """
+        images = [{'id': img_id, 'file_name': file_name, 'width': width, 'height': height}
+                  for img_id, file_name, width, height in zip(self.img_ids.tolist(), self.img_file_names.tolist(),
+                                                              self.img_widths.tolist(), self.img_heights.tolist())]
+        annotations = [{'id': ann_id, 'image_id': image_id, 'category_id': category_id, 'bbox': bbox,
+                        'area': area, 'iscrowd': iscrowd}
+                       for ann_id, image_id, category_id, bbox, area, iscrowd in
+                       zip(self.ann_ids.tolist(), self.image_ids.tolist(), self.category_ids.tolist(),
+                           self.bboxes.tolist(), self.areas.tolist(), self.iscrowd.tolist())]
+        return {'images': images, 'annotations': annotations, 'categories': list(self.categories)}
+
+
+def dense_index(table: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Map ids to their positions in table, -1 for ids that are not in it.
+
+    A lookup array is used when the ids are dense enough (the usual 1..N image ids),
+    otherwise a binary search over the sorted table.
+    """
+    table = np.asarray(table, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    if not len(table):
+        return np.full(len(values), -1, dtype=np.int64)
+    low, high = int(table.min()), int(table.max())
+    if high - low < 4 * len(table) + 1024:
+        lookup = np.full(high - low + 1, -1, dtype=np.int64)
+        lookup[table - low] = np.arange(len(table))
+        inside = (values >= low) & (values <= high)
+        result = np.full(len(values), -1, dtype=np.int64)
+        result[inside] = lookup[values[inside] - low]
+        return result
+    order = np.argsort(table, kind='stable')
+    positions = np.searchsorted(table, values, sorter=order).clip(0, len(table) - 1)
+    result = order[positions]
+    result[table[result] != values] = -1
+    return result
+
+
+def cache_dir_for(coco_file: str) -> str:
+    """
+    Args:
+        coco_file (str): Path to the COCO annotation file.
+
+    Returns:
+        str: Sidecar cache directory of the file, e.g. 'train.coco_cache' for 'train.json';
+            next to the archive for files inside one, e.g. 'data.labels.train.coco_cache' for 'data.zip/labels/train.json'.
+    """
+    parts = split_path(coco_file)
+    if parts is not None:
+        archive_path, member = parts
+        return os.path.splitext(archive_path)[0] + '.' + os.path.splitext(member)[0].replace('/', '.') + CACHE_SUFFIX
+    return os.path.splitext(coco_file)[0] + CACHE_SUFFIX
+
+
+def is_cache_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open_file(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _read_meta(cache_dir: str) -> dict | None:
+    try:
+        with open(os.path.join(cache_dir, META_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _source_stamp(coco_file: str) -> dict:
+    size, mtime_ns = file_stat(coco_file)
+    return {'size': size, 'mtime_ns': mtime_ns}
+
+
+def is_fresh(coco_file: str, cache_dir: str = None) -> bool:
+    """
+    Check whether the sidecar cache still matches its source file.
+
+    Size and mtime are compared first; when they differ the SHA-1 of the source decides,
+    so a touched but unchanged file keeps its cache. Nothing is written: build_cache refreshes the stamp.
+
+    Args:
+        coco_file (str): Path to the COCO annotation file.
+        cache_dir (str, optional): Cache directory, next to the file by default.
+
+    Returns:
+        bool: True if the cache can be used.
+    """
+    cache_dir = cache_dir or cache_dir_for(coco_file)
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    stamp = _source_stamp(coco_file)
+    if meta['source'] == stamp:
+        return True
+    return meta['source']['size'] == stamp['size'] and meta['sha1'] == file_sha1(coco_file)
+
+
+def _write_meta(cache_dir: str, meta: dict):
+    tmp_path = os.path.join(cache_dir, META_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(cache_dir, META_FILE))
+
+
+def build_cache(coco_file: str, cache_dir: str = None, data: dict = None, force: bool = False) -> str:
+    """
+    Write the columnar sidecar of a COCO file, replacing an existing one.
+
+    An existing cache of the same contents is kept; only its size and mtime stamp is refreshed when the
+    file was touched.
+
+    Args:
+        coco_file (str): Path to the COCO annotation file.
+        cache_dir (str, optional): Cache directory, next to the file by default.
+        data (dict, optional): Already parsed contents of coco_file, to avoid parsing it again.
+        force (bool): Rebuild even if the cache is fresh.
+
+    Returns:
+        str: The cache directory.
+    """
+    cache_dir = cache_dir or cache_dir_for(coco_file)
+    stamp = _source_stamp(coco_file)
+    meta = _read_meta(cache_dir)
+    if not force and meta is not None and meta.get('version') == CACHE_VERSION and meta['source'] == stamp:
+        return cache_dir
+    sha1 = file_sha1(coco_file)
+    if not force and meta is not None and meta.get('version') == CACHE_VERSION and meta['sha1'] == sha1:
+        meta['source'] = stamp
+        _write_meta(cache_dir, meta)
+        return cache_dir
+    if data is None:
+        with open_file(coco_file, 'r') as f:
+            data = json.load(f)
+    columns = CocoColumns.from_coco(data)
+
+    tmp_dir = cache_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in COLUMNS:
+        np.save(os.path.join(tmp_dir, name + '.npy'), getattr(columns, name))
+    _write_meta(tmp_dir, {'version': CACHE_VERSION, 'source': stamp, 'sha1': sha1, 'path': os.path.abspath(coco_file),
+                          'categories': columns.categories, 'lossless': columns.lossless,
+                          'annotations': int(len(columns.ann_ids)), 'images': int(len(columns.img_ids))})
+
+    if os.path.exists(cache_dir):
+        old_dir = cache_dir + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(cache_dir, old_dir)
+        os.replace(tmp_dir, cache_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def open_cache(cache_dir: str) -> CocoColumns:
+    """
+    Memory-map a cache directory; nothing is read until an array is used.
+
+    Args:
+        cache_dir (str): Cache directory written by build_cache.
+
+    Returns:
+        CocoColumns: Column arrays backed by the cache files.
+    """
+    meta = _read_meta(cache_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No COCO cache in {cache_dir}")
+    arrays = {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+    return CocoColumns(categories=meta['categories'], lossless=meta['lossless'], **arrays)
+
+
+def load_columns(path: str, build: bool = True) -> CocoColumns:
+    """
+    Load a COCO file as columns, through its sidecar cache.
+
+    Args:
+        path (str): COCO annotation file or a cache directory.
+        build (bool): Build or rebuild the sidecar when it is missing or stale.
+
+    Returns:
+        CocoColumns: Column arrays of the dataset.
+    """
+    if is_cache_dir(path):
+        return open_cache(path)
+    cache_dir = cache_dir_for(path)
+    if build:
+        return open_cache(build_cache(path, cache_dir))
+    if is_fresh(path, cache_dir):
+        return open_cache(cache_dir)
+    with open_file(path, 'r') as f:
+        return CocoColumns.from_coco(json.load(f))
+
+
+def load_coco(path: str) -> dict:
+    """
+    Load a COCO dataset from a JSON file or a cache directory.
+
+    A fresh, lossless sidecar is used instead of parsing the JSON. A lossy cache directory is read through
+    the COCO file it was built from, so segmentation, extra keys and exact values are never dropped.
+
+    Args:
+        path (str): COCO annotation file or a cache directory.
+
+    Returns:
+        dict: The COCO dataset.
+    """
+    if is_cache_dir(path):
+        meta = _read_meta(path)
+        if meta['lossless']:
+            return open_cache(path).to_coco()
+        source = meta.get('path')
+        try:
+            usable = source is not None and is_fresh(source, path)
+        except OSError:
+            usable = False
+        if not usable:
+            raise ValueError(f"COCO cache {path} does not hold every field of its source file, "
+                             f"and the source {source or '(not recorded)'} is missing or changed; "
+                             f"pass the COCO file instead")
+        with open_file(source, 'r') as f:
+            return json.load(f)
+    cache_dir = cache_dir_for(path)
+    if is_fresh(path, cache_dir) and _read_meta(cache_dir)['lossless']:
+        return open_cache(cache_dir).to_coco()
+    with open_file(path, 'r') as f:
+        return json.load(f)
+
+
+def load_categories(path: str) -> list:
+    """
+    Read only the categories of a COCO file, from the sidecar metadata when it is fresh.
+
+    Args:
+        path (str): COCO annotation file or a cache directory.
+
+    Returns:
+        list: Category records.
+    """
+    if is_cache_dir(path):
+        return _read_meta(path)['categories']
+    cache_dir = cache_dir_for(path)
+    if is_fresh(path, cache_dir):
+        return _read_meta(cache_dir)['categories']
+    with open_file(path, 'r') as f:
+        return json.load(f)['categories']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build columnar sidecar caches for COCO annotation files.")
+    parser.add_argument('coco_files', nargs='+')
+    parser.add_argument('--force', action='store_true', help="rebuild even if the cache is fresh")
+    args = parser.parse_args()
+    for coco_file in args.coco_files:
+        if not args.force and is_fresh(coco_file):
+            build_cache(coco_file)
+            print(f"{coco_file}: cache is fresh")
+            continue
+        print(f"{coco_file}: cache written to {build_cache(coco_file, force=True)}")
+
+
+if __name__ == '__main__':
+    main()
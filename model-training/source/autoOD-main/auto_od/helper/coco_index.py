@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from collections import defaultdict
+
+from auto_od.helper.coco_cache import load_coco
+
+
+class CocoIndex:
+    """
+    COCO dataset loaded once with lookup tables over it.
+
+    Attributes:
+        data (dict): The COCO dataset ('images', 'annotations', 'categories').
+        images (dict): Image id -> image record.
+        categories (dict): Category id -> category record.
+        image_annotations (defaultdict): Image id -> list of annotation records, in file order.
+        category_images (defaultdict): Category id -> list of unique image ids, in order of first annotation.
+        filename_images (dict): Image file name -> image record.
+    """
+
+    def __init__(self, data: dict):
+        """
+        Build the lookup tables in a single pass over images and annotations.
+
+        Args:
+            data (dict): The COCO dataset.
+        """
+        self.data = data
+        self.images = {img['id']: img for img in data['images']}
+        self.categories = {cat['id']: cat for cat in data['categories']}
+        self.filename_images = {img['file_name']: img for img in data['images']}
+        self.image_annotations = defaultdict(list)
+        self.category_images = defaultdict(list)
+        seen = set()
+        for ann in data['annotations']:
+            image_id = ann['image_id']
+            self.image_annotations[image_id].append(ann)
+            key = (ann['category_id'], image_id)
+            if key not in seen:
+                seen.add(key)
+                self.category_images[ann['category_id']].append(image_id)
+
+    @classmethod
+    def from_file(cls, coco_file: str) -> CocoIndex:
+        """
+        Load a COCO annotation file and index it.
+
+        Args:
+            coco_file (str): Path to the COCO annotation file or to its columnar cache directory.
+
+        Returns:
+            CocoIndex: The indexed dataset.
+        """
+        return cls(load_coco(coco_file))
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def annotations_for(self, image_id: int) -> list:
+        """
+        Args:
+            image_id (int): Image id.
+
+        Returns:
+            list: Annotations of the image, empty if it has none.
+        """
+        return self.image_annotations.get(image_id, [])
+
+    def image_by_filename(self, file_name: str) -> dict | None:
+        """
+        Args:
+            file_name (str): Image file name as stored in the dataset.
+
+        Returns:
+            dict | None: The image record, or None if the file is not in the dataset.
+        """
+        return self.filename_images.get(file_name)
+
+    def unannotated_images(self) -> list:
+        """
+        Returns:
+            list: Ids of images without annotations, in dataset order.
+        """
+        return [img['id'] for img in self.data['images'] if img['id'] not in self.image_annotations]
+
+    def max_ids(self) -> tuple:
+        """
+        Returns:
+            tuple: The largest image, annotation and category ids, 0 for an empty list.
+        """
+        return (max(self.images, default=0),
+                max((ann['id'] for ann in self.data['annotations']), default=0),
+                max(self.categories, default=0))
+
+    def subset(self, images: list) -> dict:
+        """
+        Build a COCO dataset restricted to the given images.
+
+        Args:
+            images (list): Image records or image ids; their order is kept.
+
+        Returns:
+            dict: COCO dataset with these images, their annotations and all categories.
+        """
+        records = [self.images[img] if not isinstance(img, dict) else img for img in images]
+        return {
+            'images': records,
+            'annotations': [ann for img in records for ann in self.annotations_for(img['id'])],
+            'categories': self.data['categories']
+        }
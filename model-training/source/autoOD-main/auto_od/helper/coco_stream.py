@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter
+from typing import Iterator
+
+from auto_od.helper.archive import file_stat, open_file
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 4096
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class _Reader:
+    """Buffered reader that decodes one JSON value at a time from a text file."""
+
+    def __init__(self, file, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self.fill()
+
+    def next_char(self, expected: str = None) -> str:
+        char = self.peek()
+        if expected is not None and char not in expected:
+            raise ValueError(f"Expected one of '{expected}' at offset {self.pos} of {self.file.name}, got '{char}'")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A number that ends with the buffer may continue in the next chunk.
+            if end == len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def decode_items(self) -> list:
+        """
+        Decode as many array items as the buffer holds completely, at least one.
+
+        The buffer is cut after the last '}' that is followed by ',' and '{' and the part is parsed in one call.
+        A cut inside a string, a nested object or past the end of the array cannot parse, so a successful
+        parse ends on an item boundary; after a failed parse the search is repeated in the first half.
+        """
+        self.peek()
+        buffer = self.buffer
+        if buffer[self.pos] == '{':
+            limit = len(buffer)
+            for _ in range(32):
+                cut = buffer.rfind('},', self.pos, limit)
+                if cut < 0:
+                    break
+                after = _WHITESPACE.match(buffer, cut + 2).end()
+                if after >= len(buffer) or buffer[after] != '{':
+                    limit = cut
+                    continue
+                try:
+                    items = json.loads('[' + buffer[self.pos:cut + 1] + ']')
+                except ValueError:
+                    limit = self.pos + (cut - self.pos) // 2
+                    continue
+                self.pos = cut + 1
+                return items
+        return [self.decode()]
+
+
+def iter_coco(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Stream a COCO file without loading it.
+
+    Args:
+        path (str): COCO annotation file.
+        chunk_size (int): Characters read at a time.
+
+    Yields:
+        tuple: (key, item) for every item of top-level arrays ('images', 'annotations', 'categories', ...)
+            and (key, value) for other top-level values ('info').
+    """
+    with open_file(path, 'r') as f:
+        reader = _Reader(f, chunk_size)
+        reader.next_char('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.next_char(':')
+            if reader.peek() == '[':
+                reader.next_char('[')
+                if reader.peek() == ']':
+                    reader.next_char(']')
+                else:
+                    while True:
+                        for item in reader.decode_items():
+                            yield key, item
+                        if reader.next_char(',]') == ']':
+                            break
+            else:
+                yield key, reader.decode()
+            if reader.next_char(',}') == '}':
+                return
+
+
+def tail_categories(path: str, max_bytes: int = 1 << 24) -> list | None:
+    """
+    Read the categories of a COCO file whose last key is 'categories', from the end of the file.
+
+    Most writers (including CocoWriter) put the categories last; reading them first lets annotations
+    be remapped while they stream by.
+
+    Args:
+        path (str): COCO annotation file.
+        max_bytes (int): Largest tail that is read.
+
+    Returns:
+        list | None: Category records, or None if 'categories' is not the last key.
+    """
+    size = file_stat(path)[0]
+    tail_size = 1 << 16
+    while True:
+        with open_file(path, 'rb') as f:
+            f.seek(max(size - tail_size, 0))
+            tail = f.read().decode('utf-8', errors='replace')
+        start = tail.rfind('"categories"')
+        while start >= 0:
+            match = re.compile(r'"categories"\s*:\s*').match(tail, start)
+            if match and tail[match.end():match.end() + 1] == '[':
+                try:
+                    categories, end = _DECODER.raw_decode(tail, match.end())
+                except json.JSONDecodeError:
+                    categories = None
+                # The array must be followed by the closing brace of the file and nothing else.
+                if categories is not None and tail[end:].strip() == '}':
+                    return categories
+            start = tail.rfind('"categories"', 0, start)
+        if tail_size >= min(size, max_bytes):
+            return None
+        tail_size *= 4
+
+
+class CocoWriter:
+    """
+    Writes a COCO file incrementally.
+
+    Images go straight into the output, annotations into a temporary file next to it that is
+    appended when the writer is closed; the output appears atomically on close.
+
+    Attributes:
+        path (str): Output file.
+        categories (list): Category records written on close.
+        extra (dict): Other top-level values written on close, e.g. 'info'.
+        counts (Counter): Number of written images and annotations.
+    """
+
+    def __init__(self, path: str, categories: list = None):
+        """
+        Args:
+            path (str): Output file.
+            categories (list, optional): Category records; can be set or extended until close.
+        """
+        self.path = path
+        self.categories = categories if categories is not None else []
+        self.extra = {}
+        self.counts = Counter()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'w', encoding='utf-8', buffering=CHUNK_SIZE)
+        self._file.write('{"images":[')
+        self._annotations = tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory, buffering=CHUNK_SIZE)
+        # Records are encoded in batches: one encoder call per batch instead of one per record.
+        self._batches = {'images': [], 'annotations': []}
+
+    def _flush(self, key: str):
+        batch = self._batches[key]
+        if batch:
+            target = self._file if key == 'images' else self._annotations
+            target.write((',' if self.counts[key] > len(batch) else '') + _ENCODER.encode(batch)[1:-1])
+            batch.clear()
+
+    def add_image(self, image: dict):
+        self._batches['images'].append(image)
+        self.counts['images'] += 1
+        if len(self._batches['images']) >= BATCH_SIZE:
+            self._flush('images')
+
+    def add_annotation(self, annotation: dict):
+        self._batches['annotations'].append(annotation)
+        self.counts['annotations'] += 1
+        if len(self._batches['annotations']) >= BATCH_SIZE:
+            self._flush('annotations')
+
+    def close(self):
+        """Append annotations, categories and extra values and move the file into place."""
+        self._flush('images')
+        self._flush('annotations')
+        self._file.write('],"annotations":[')
+        self._annotations.seek(0)
+        shutil.copyfileobj(self._annotations, self._file, CHUNK_SIZE)
+        self._annotations.close()
+        self._file.write('],"categories":' + _ENCODER.encode(self.categories))
+        for key, value in self.extra.items():
+            self._file.write(',' + _ENCODER.encode(key) + ':' + _ENCODER.encode(value))
+        self._file.write('}')
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._annotations.close()
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self) -> CocoWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def merge_coco_files(input_paths: list, output_path: str, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Merge any number of COCO files in one streaming pass with bounded memory.
+
+    Image ids of every input are shifted past the ids of the previous inputs (the first input keeps its ids),
+    annotation ids are renumbered, and categories are merged by name: the first input keeps its category ids,
+    new names get the next free id. Annotations are held back in a temporary file only while the categories
+    or images of their input have not been read yet. 'info' and 'licenses' are taken from the first input.
+
+    Args:
+        input_paths (list): COCO annotation files.
+        output_path (str): Merged annotation file.
+        chunk_size (int): Characters read at a time.
+
+    Returns:
+        dict: Number of images, annotations, categories and of dropped annotations, whose image or category
+            is missing from their input.
+    """
+    categories = []
+    category_by_name = {}
+    next_image_id = 0
+    next_annotation_id = 1
+    dropped = 0
+
+    with CocoWriter(output_path, categories) as writer:
+        for number, path in enumerate(input_paths):
+            image_shift = next_image_id
+            max_image_id = -1
+            category_map = {}
+            # Top-level arrays the parser has moved past; annotations can be remapped once images and categories are.
+            finished = set()
+            current_key = None
+            pending = None
+
+            def add_category(category: dict):
+                name = category['name']
+                if name not in category_by_name:
+                    new_id = category['id'] if number == 0 else max((c['id'] for c in categories), default=0) + 1
+                    category_by_name[name] = dict(category, id=new_id)
+                    categories.append(category_by_name[name])
+                category_map[category['id']] = category_by_name[name]['id']
+
+            known_categories = tail_categories(path)
+            if known_categories is not None:
+                for category in known_categories:
+                    add_category(category)
+                finished.add('categories')
+
+            def emit(annotation: dict):
+                nonlocal next_annotation_id, dropped
+                if not 0 <= annotation['image_id'] <= max_image_id or annotation['category_id'] not in category_map:
+                    dropped += 1
+                    return
+                annotation['id'] = next_annotation_id
+                annotation['image_id'] += image_shift
+                annotation['category_id'] = category_map[annotation['category_id']]
+                next_annotation_id += 1
+                writer.add_annotation(annotation)
+
+            for key, value in iter_coco(path, chunk_size):
+                if key != current_key:
+                    finished.add(current_key)
+                    current_key = key
+                if key == 'images':
+                    if value['id'] < 0:
+                        raise ValueError(f"Negative image id {value['id']} in {path}")
+                    max_image_id = max(max_image_id, value['id'])
+                    value['id'] += image_shift
+                    writer.add_image(value)
+                elif key == 'annotations':
+                    if {'images', 'categories'} <= finished:
+                        emit(value)
+                    else:
+                        if pending is None:
+                            pending = tempfile.TemporaryFile('w+', encoding='utf-8',
+                                                             dir=os.path.dirname(os.path.abspath(output_path)))
+                            pending_batch = []
+                        pending_batch.append(value)
+                        if len(pending_batch) >= BATCH_SIZE:
+                            pending.write(_ENCODER.encode(pending_batch) + '\n')
+                            pending_batch.clear()
+                elif key == 'categories':
+                    if known_categories is None:
+                        add_category(value)
+                elif number == 0 and key == 'licenses':
+                    writer.extra.setdefault('licenses', []).append(value)
+                elif number == 0 and key not in writer.extra:
+                    writer.extra[key] = value
+
+            if pending is not None:
+                pending.write(_ENCODER.encode(pending_batch) + '\n')
+                pending.seek(0)
+                for line in pending:
+                    for annotation in json.loads(line):
+                        emit(annotation)
+                pending.close()
+            next_image_id = image_shift + max_image_id + 1
+
+    return {**writer.counts, 'categories': len(categories), 'dropped_annotations': dropped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge COCO annotation files with bounded memory.")
+    parser.add_argument('output')
+    parser.add_argument('inputs', nargs='+')
+    args = parser.parse_args()
+    summary = merge_coco_files(args.inputs, args.output)
+    print(', '.join(f"{key}: {value}" for key, value in summary.items()))
+
+
+if __name__ == '__main__':
+    main()
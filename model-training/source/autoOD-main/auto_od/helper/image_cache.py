@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from auto_od.check.integrity import probe_image
+from auto_od.helper.archive import list_files, open_file
+from auto_od.helper.coco_cache import load_columns
+
+CACHE_VERSION = 1
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npz'
+DATA_FILE = 'images.bin'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# mmdet's usual training scale as (long edge, short edge), e.g. Resize(scale=(1333, 800), keep_ratio=True).
+DEFAULT_SCALE = (1333, 800)
+
+
+def cached_size(width: int, height: int, scale: tuple) -> tuple:
+    """
+    Size of an image in the cache: rescaled as mmcv.imrescale does for keep_ratio=True, but never enlarged,
+    so the training Resize still sees the full resolution of small images.
+
+    Args:
+        width (int): Image width.
+        height (int): Image height.
+        scale (tuple): Training scale, (long edge, short edge) in any order.
+
+    Returns:
+        tuple: (width, height) in the cache.
+    """
+    factor = min(max(scale) / max(width, height), min(scale) / min(width, height), 1.0)
+    return int(width * factor + 0.5), int(height * factor + 0.5)
+
+
+def _probe_task(path: str) -> tuple:
+    info = probe_image(path)
+    return None if info.get('issue') else (info['width'], info['height'])
+
+
+def _decode_task(task: tuple) -> str | None:
+    path, data_path, offset, width, height = task
+    try:
+        with open_file(path) as f, Image.open(f) as img:
+            # cv2 applies the EXIF rotation when mmcv decodes, so the cache does too.
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.BILINEAR)
+            bgr = np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    if bgr.shape != (height, width, 3):
+        return f"decoded to {bgr.shape}, expected {(height, width, 3)}"
+    with open(data_path, 'r+b') as f:
+        f.seek(offset)
+        f.write(bgr.data)
+    return None
+
+
+def _map(function, tasks: list, workers: int) -> list:
+    if workers == 1 or len(tasks) < 64:
+        return list(map(function, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+
+
+def read_meta(cache_dir: str) -> dict:
+    with open(os.path.join(cache_dir, META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def build_image_cache(image_dir: str, cache_dir: str, file_names=None, scale: tuple = DEFAULT_SCALE,
+                      workers: int = None) -> dict:
+    """
+    Decode and downscale the training images once into a packed store, replacing an existing one.
+
+    Every image is kept as uint8 BGR pixels (what mmcv decodes to) at its cached_size, one after another
+    in images.bin; index.npz holds file names, byte offsets, cached and original shapes. Image headers
+    are read first, so the store is allocated up front and the workers write straight into it.
+
+    Args:
+        image_dir (str): Image directory, or directory inside a zip archive.
+        cache_dir (str): Cache directory to write.
+        file_names (list | str, optional): File names relative to image_dir, or a COCO file whose images are cached.
+            Defaults to every image in image_dir.
+        scale (tuple): Training scale, see cached_size.
+        workers (int, optional): Number of decoding processes. Defaults to the number of CPUs.
+
+    Returns:
+        dict: Cache metadata: 'images', 'failed' (file name -> reason), 'bytes', 'scale' and 'image_dir'.
+    """
+    workers = workers or os.cpu_count()
+    if file_names is None:
+        paths = list_files(image_dir, IMAGE_EXTENSIONS)
+        file_names = [os.path.relpath(path, image_dir).replace(os.sep, '/') for path in paths]
+    elif isinstance(file_names, str):
+        file_names = load_columns(file_names).img_file_names.tolist()
+    file_names = list(dict.fromkeys(file_names))
+    paths = [os.path.join(image_dir, name) for name in file_names]
+
+    failed = {}
+    sizes = _map(_probe_task, paths, workers)
+    shapes = np.zeros((len(file_names), 3), dtype=np.int32)
+    ori_shapes = np.zeros((len(file_names), 2), dtype=np.int32)
+    for row, (name, size) in enumerate(zip(file_names, sizes)):
+        if size is None:
+            failed[name] = 'unreadable image'
+            continue
+        width, height = cached_size(*size, scale)
+        shapes[row] = height, width, 3
+        ori_shapes[row] = size[1], size[0]
+    nbytes = shapes.prod(axis=1, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(nbytes)[:-1]]).astype(np.int64)
+
+    tmp_dir = cache_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    data_path = os.path.join(tmp_dir, DATA_FILE)
+    with open(data_path, 'wb') as f:
+        f.truncate(int(nbytes.sum()))
+
+    tasks = [(path, data_path, int(offset), int(shape[1]), int(shape[0]))
+             for path, offset, shape in zip(paths, offsets, shapes) if shape[0]]
+    rows = np.flatnonzero(shapes[:, 0])
+    for row, error in zip(rows, _map(_decode_task, tasks, workers)):
+        if error:
+            failed[file_names[row]] = error
+            shapes[row] = 0
+
+    np.savez(os.path.join(tmp_dir, INDEX_FILE), names=np.array(file_names, dtype=str),
+             offsets=offsets, shapes=shapes, ori_shapes=ori_shapes)
+    meta = {'version': CACHE_VERSION,
+            'image_dir': os.path.abspath(image_dir),
+            'scale': list(scale),
+            'images': int(np.count_nonzero(shapes[:, 0])),
+            'bytes': int(nbytes.sum()),
+            'failed': failed}
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(cache_dir):
+        old_dir = cache_dir.rstrip('/') + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(cache_dir, old_dir)
+        os.replace(tmp_dir, cache_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, cache_dir)
+    return meta
+
+
+class ImageCache:
+    """
+    Read side of a cache written by build_image_cache.
+
+    The store is memory-mapped copy-on-write: images are views into the page cache, nothing is copied or
+    decoded, and transforms that modify the image in place only touch private pages of their process.
+
+    Attributes:
+        image_dir (str): Absolute image directory the cache was built from.
+        scale (tuple): Training scale the images were reduced to.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir (str): Cache directory written by build_image_cache.
+        """
+        meta = read_meta(cache_dir)
+        if meta.get('version') != CACHE_VERSION:
+            raise ValueError(f"Image cache {cache_dir} has version {meta.get('version')}, expected {CACHE_VERSION}")
+        self.image_dir = meta['image_dir']
+        self.scale = tuple(meta['scale'])
+        with np.load(os.path.join(cache_dir, INDEX_FILE)) as index:
+            self.rows = {name: row for row, name in enumerate(index['names'].tolist())}
+            self.offsets = index['offsets']
+            self.shapes = index['shapes']
+            self.ori_shapes = index['ori_shapes']
+        self.data = (np.memmap(os.path.join(cache_dir, DATA_FILE), dtype=np.uint8, mode='c') if meta['bytes']
+                     else np.empty(0, dtype=np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, path: str) -> tuple | None:
+        """
+        Look up an image by its path.
+
+        Args:
+            path (str): Image path, inside image_dir.
+
+        Returns:
+            tuple | None: (HxWx3 uint8 BGR view, (original height, original width)), or None when the image
+                is not cached.
+        """
+        name = os.path.relpath(os.path.abspath(path), self.image_dir).replace(os.sep, '/')
+        row = self.rows.get(name)
+        if row is None or not self.shapes[row, 0]:
+            return None
+        height, width, channels = self.shapes[row]
+        offset = self.offsets[row]
+        image = self.data[offset:offset + height * width * channels].reshape(height, width, channels)
+        return image, tuple(self.ori_shapes[row].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode and downscale training images once into a packed cache.")
+    parser.add_argument('image_dir', help="image directory, also inside a .zip")
+    parser.add_argument('cache_dir')
+    parser.add_argument('--coco', help="cache only the images of this COCO file")
+    parser.add_argument('--scale', type=int, nargs=2, default=DEFAULT_SCALE, metavar=('LONG', 'SHORT'),
+                        help="training scale of the Resize step")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    meta = build_image_cache(args.image_dir, args.cache_dir, args.coco, tuple(args.scale), args.workers)
+    print(f"images: {meta['images']}, size: {meta['bytes'] / 2 ** 30:.2f} GiB, failed: {len(meta['failed'])}")
+    for name, reason in meta['failed'].items():
+        print(f"failed {name}: {reason}")
+    return 1 if meta['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
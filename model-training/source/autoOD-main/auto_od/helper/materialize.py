@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from auto_od.helper.archive import file_stat, is_archive_path, open_file
+
+MODES = ('auto', 'copy', 'hardlink', 'symlink', 'reflink')
+# Linux FICLONE ioctl: share the source extents (btrfs, XFS, bcachefs); other systems fall back to a copy.
+FICLONE = 0x40049409
+
+
+def is_identical(src: str, dst: str, mode: str) -> bool:
+    """
+    Check whether dst already holds src the way mode would create it.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination path.
+        mode (str): Materialization mode.
+
+    Returns:
+        bool: True if dst can be kept as is.
+    """
+    try:
+        if mode == 'symlink':
+            return os.path.islink(dst) and os.path.realpath(dst) == os.path.realpath(src)
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    src_stat = os.stat(src)
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    # Copies keep the source mtime (copy2), so size and mtime identify an unchanged copy.
+    return (mode != 'hardlink' and not os.path.islink(dst) and src_stat.st_size == dst_stat.st_size
+            and src_stat.st_mtime_ns == dst_stat.st_mtime_ns)
+
+
+def reflink(src: str, dst: str):
+    """Clone src into dst without copying data; raises OSError where the file system cannot."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "reflink is not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _create(src: str, dst: str, mode: str) -> str:
+    if mode == 'hardlink':
+        os.link(src, dst)
+        return 'hardlinked'
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return 'symlinked'
+    if mode == 'reflink':
+        reflink(src, dst)
+        return 'reflinked'
+    shutil.copy2(src, dst)
+    return 'copied'
+
+
+def extract_file(src: str, dst: str) -> str:
+    """
+    Extract a zip archive member to dst atomically, keeping the member's timestamp; an extracted
+    file of the same size and timestamp is kept.
+
+    Args:
+        src (str): Archive path of the member, see auto_od.helper.archive.
+        dst (str): Destination path.
+
+    Returns:
+        str: 'skipped' or 'extracted'.
+    """
+    size, mtime_ns = file_stat(src)
+    try:
+        dst_stat = os.stat(dst)
+        if (dst_stat.st_size, dst_stat.st_mtime_ns) == (size, mtime_ns):
+            return 'skipped'
+    except OSError:
+        pass
+    tmp_path = f'{dst}.materialize-tmp'
+    with open_file(src) as source, open(tmp_path, 'wb') as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+    os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp_path, dst)
+    return 'extracted'
+
+
+def materialize_file(src: str, dst: str, mode: str = 'auto') -> str:
+    """
+    Make src available at dst.
+
+    An existing identical dst is kept; a different one is replaced atomically.
+    'auto' tries a hard link, then a reflink, then copies; 'reflink' copies where cloning is not supported.
+    Sources inside a zip archive are extracted whatever the mode.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination path.
+        mode (str): One of MODES.
+
+    Returns:
+        str: What was done: 'skipped', 'hardlinked', 'symlinked', 'reflinked', 'copied' or 'extracted'.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown materialization mode '{mode}', expected one of {MODES}")
+    if is_archive_path(src):
+        return extract_file(src, dst)
+    if is_identical(src, dst, mode):
+        return 'skipped'
+
+    tmp_path = f'{dst}.materialize-tmp'
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+    attempts = {'auto': ('hardlink', 'reflink', 'copy'), 'reflink': ('reflink', 'copy')}.get(mode, (mode,))
+    for attempt in attempts:
+        try:
+            action = _create(src, tmp_path, attempt)
+            break
+        except OSError as e:
+            # Links fail across devices or on file systems without them; anything else is a real error.
+            if attempt == attempts[-1] or e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP,
+                                                          errno.EINVAL, errno.ENOTTY, errno.EMLINK):
+                raise
+    os.replace(tmp_path, dst)
+    return action
+
+
+class Materializer:
+    """
+    Places many files into a dataset layout through a thread pool.
+
+    Attributes:
+        mode (str): 'auto' (hard link, else reflink, else copy), 'copy', 'hardlink', 'symlink' or 'reflink'.
+        workers (int): Number of threads; file creation is I/O-bound.
+    """
+
+    def __init__(self, mode: str = 'auto', workers: int = 16):
+        """
+        Args:
+            mode (str): Materialization mode, see MODES. Links share storage with the source,
+                so editing a linked image in place changes it in both datasets.
+            workers (int): Number of threads.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown materialization mode '{mode}', expected one of {MODES}")
+        self.mode = mode
+        self.workers = workers
+
+    def __call__(self, pairs: list) -> Counter:
+        """
+        Materialize (source, destination) pairs, creating destination directories as needed.
+
+        Args:
+            pairs (list): (source path, destination path) tuples.
+
+        Returns:
+            Counter: Number of files per action.
+        """
+        pairs = list(pairs)
+        for directory in {os.path.dirname(dst) for _, dst in pairs}:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return Counter(executor.map(lambda pair: materialize_file(pair[0], pair[1], self.mode), pairs))
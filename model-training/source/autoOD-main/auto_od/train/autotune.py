@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, Sequence
+
+import torch
+from mmengine import Config
+from mmengine.hooks import Hook
+from mmengine.registry import RUNNERS
+from mmengine.runner import Runner
+
+DEFAULT_BATCH_SIZES = (2, 4, 8, 16, 32)
+# Peak CUDA memory above this share of the device counts as unstable: augmentations vary the input size,
+# so a probe that barely fits may still run out of memory in a long run.
+MEMORY_HEADROOM = 0.9
+
+
+def default_worker_counts() -> list:
+    cpus = os.cpu_count() or 1
+    return sorted({count for count in (0, 2, 4, 8, cpus) if count <= cpus})
+
+
+def dataloader_settings(batch_size: int, num_workers: int, device: Optional[str] = None) -> dict:
+    """
+    Train dataloader fields of a setting; pinned memory only helps copies to a GPU, so not with device='cpu'.
+    """
+    return dict(batch_size=batch_size,
+                num_workers=num_workers,
+                persistent_workers=num_workers > 0,
+                pin_memory=device != 'cpu' and torch.cuda.is_available())
+
+
+class ThroughputProbe(Hook):
+    """
+    Times the training iterations after a warmup, for probe_config.
+    """
+    priority = 'LOWEST'
+
+    def __init__(self, warmup: int):
+        self.warmup = max(warmup, 1)
+        self.start = None
+        self.iterations = 0
+        self.samples = 0
+        self.data_time = 0.0
+        self._last = None
+
+    def before_train_iter(self, runner, batch_idx: int, data_batch=None):
+        if self._last is not None and self.start is not None:
+            self.data_time += time.perf_counter() - self._last
+
+    def after_train_iter(self, runner, batch_idx: int, data_batch=None, outputs=None):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        if runner.iter + 1 == self.warmup:
+            self.start = now
+            if torch.cuda.is_available():
+                torch.cuda.reset_peak_memory_stats()
+        elif self.start is not None:
+            self.iterations += 1
+            self.samples += len(data_batch['inputs'])
+        self._last = now
+
+    def result(self) -> dict:
+        elapsed = self._last - self.start if self.iterations else 0.0
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return {'iterations': self.iterations,
+                'samples_per_s': self.samples / elapsed if elapsed else 0.0,
+                'iter_time': elapsed / self.iterations if self.iterations else None,
+                'data_time': self.data_time / self.iterations if self.iterations else None,
+                'peak_rss_mb': peak_rss / 1024,
+                'peak_cuda_mb': torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else None}
+
+
+def probe_config(config_path: str, batch_size: int, num_workers: int, iterations: int = 20, warmup: int = 5) -> dict:
+    """
+    Train a few iterations of a config with one dataloader setting and measure them.
+
+    Validation, checkpoints, schedulers and pretrained weights are switched off; only data loading and
+    the training step are timed.
+
+    Args:
+        config_path (str): Training config.
+        batch_size (int): Samples per iteration.
+        num_workers (int): Dataloader processes.
+        iterations (int): Timed iterations.
+        warmup (int): Untimed iterations before them (worker start, cudnn autotuning).
+
+    Returns:
+        dict: See ThroughputProbe.result.
+    """
+    cfg = Config.fromfile(config_path)
+    cfg.train_dataloader.update(dataloader_settings(batch_size, num_workers))
+    cfg.train_cfg = dict(type='IterBasedTrainLoop', max_iters=warmup + iterations, val_interval=warmup + iterations + 1)
+    for split in ('val', 'test'):
+        cfg[f'{split}_dataloader'] = cfg[f'{split}_cfg'] = cfg[f'{split}_evaluator'] = None
+    cfg.param_scheduler = None
+    cfg.load_from, cfg.resume = None, False
+    cfg.default_hooks.checkpoint = None
+    cfg.default_hooks.pop('early_stopping', None)
+    cfg.default_hooks.logger = dict(type='LoggerHook', interval=warmup + iterations)
+    cfg.log_level = 'WARNING'
+
+    with tempfile.TemporaryDirectory(prefix='autotune_') as work_dir:
+        cfg.work_dir = work_dir
+        if 'runner_type' not in cfg:
+            runner = Runner.from_cfg(cfg)
+        else:
+            runner = RUNNERS.build(cfg)
+        probe = ThroughputProbe(warmup)
+        runner.register_hook(probe)
+        runner.train()
+    return probe.result()
+
+
+def _run_trial(config_path: str, batch_size: int, num_workers: int, iterations: int, warmup: int,
+               device: Optional[str], timeout: float) -> dict:
+    # A process per trial: an out-of-memory error can leave CUDA unusable, and peak memory is per process.
+    trial = {'batch_size': batch_size, 'num_workers': num_workers, 'stable': False}
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+    if device == 'cpu':
+        env['CUDA_VISIBLE_DEVICES'] = ''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, 'result.json')
+        command = [sys.executable, '-m', 'auto_od.train.autotune', config_path, '--batch-size', str(batch_size),
+                   '--workers', str(num_workers), '--iterations', str(iterations), '--warmup', str(warmup),
+                   '--output', output]
+        try:
+            process = subprocess.run(command, env=env, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return dict(trial, error=f"timed out after {timeout:.0f} s")
+        if process.returncode != 0 or not os.path.exists(output):
+            return dict(trial, error=process.stderr.strip().splitlines()[-1] if process.stderr.strip()
+                        else f"exit code {process.returncode}")
+        with open(output, 'r') as f:
+            trial.update(json.load(f))
+
+    if trial['peak_cuda_mb'] is not None and device != 'cpu':
+        total_mb = torch.cuda.get_device_properties(0).total_memory / 2 ** 20
+        if trial['peak_cuda_mb'] > MEMORY_HEADROOM * total_mb:
+            return dict(trial, error=f"peak memory {trial['peak_cuda_mb']:.0f} of {total_mb:.0f} MiB")
+    trial['stable'] = trial['iterations'] > 0
+    return trial
+
+
+def tune_dataloader(config_path: str, batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+                    worker_counts: Sequence[int] = None, iterations: int = 20, warmup: int = 5,
+                    device: Optional[str] = None, timeout: float = 900) -> dict:
+    """
+    Find the fastest stable train dataloader setting of a config on the machine at hand.
+
+    Batch sizes are probed in ascending order with a middle worker count until one fails (out of memory,
+    too close to the memory limit, or any error); the worker counts are then probed with the fastest
+    batch size. Every probe trains for a few iterations in its own process.
+
+    Args:
+        config_path (str): Training config with the actual dataset.
+        batch_sizes (Sequence[int]): Candidate batch sizes.
+        worker_counts (Sequence[int], optional): Candidate dataloader worker counts.
+            Defaults to 0, 2, 4, 8 and the number of CPUs, as far as there are CPUs.
+        iterations (int): Timed iterations per probe.
+        warmup (int): Untimed iterations before them.
+        device (str, optional): 'cpu' to probe without GPUs. Defaults to the GPU when there is one.
+        timeout (float): Seconds after which a probe counts as failed.
+
+    Returns:
+        dict: 'best' (dataloader fields of the fastest stable setting, None if none ran), its 'samples_per_s',
+            and 'trials' (batch_size, num_workers, samples_per_s, iter_time, data_time, peak memory, stable, error).
+    """
+    worker_counts = sorted(set(worker_counts)) if worker_counts is not None else default_worker_counts()
+    trials = []
+
+    def run(batch_size: int, num_workers: int) -> dict:
+        trial = _run_trial(config_path, batch_size, num_workers, iterations, warmup, device, timeout)
+        trials.append(trial)
+        return trial
+
+    def fastest(candidates: list) -> Optional[dict]:
+        stable = [trial for trial in candidates if trial['stable']]
+        return max(stable, key=lambda trial: trial['samples_per_s']) if stable else None
+
+    probe_workers = worker_counts[len(worker_counts) // 2]
+    for batch_size in sorted(batch_sizes):
+        if not run(batch_size, probe_workers)['stable']:
+            break
+    best = fastest(trials)
+    if best is not None:
+        for num_workers in worker_counts:
+            if num_workers != probe_workers:
+                run(best['batch_size'], num_workers)
+        best = fastest(trials)
+
+    return {'best': dataloader_settings(best['batch_size'], best['num_workers'], device) if best else None,
+            'samples_per_s': best['samples_per_s'] if best else None,
+            'trials': trials}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure training throughput of one dataloader setting.")
+    parser.add_argument('config')
+    parser.add_argument('--batch-size', type=int, required=True)
+    parser.add_argument('--workers', type=int, required=True)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--output', help="JSON file for the result (default: stdout)")
+    args = parser.parse_args()
+
+    result = probe_config(args.config, args.batch_size, args.workers, args.iterations, args.warmup)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
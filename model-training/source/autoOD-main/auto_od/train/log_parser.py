@@ -0,0 +1,449 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+from array import array
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+# 'Epoch(train)  [1][ 50/114]  base_lr: 4.0000e-03 ... time: 1.9802  data_time: 0.2060  memory: 7622  loss: 1.7397'
+# 'Iter(val) [41/41]    coco/bbox_mAP: 0.1170 ...'
+LOG_LINE = re.compile(r'^(?P<stamp>\d\d/\d\d \d\d:\d\d:\d\d) - mmengine - \w+ - (?P<loop>Epoch|Iter)\((?P<mode>\w+)\)\s*'
+                      r'(?P<progress>(?:\[\s*\d+(?:/\d+)?\s*\])+)\s*(?P<values>.*)$')
+STAMP = re.compile(r'\d\d/\d\d \d\d:\d\d:\d\d - ')
+PROGRESS = re.compile(r'\[\s*(\d+)(?:/(\d+))?\s*\]')
+VALUE = re.compile(r'([\w/.\-]+): (-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)(?=\s|$)')
+# Values that are not metrics: 'eta: 1 day, 2:03:04' would otherwise parse as 1.
+SKIPPED_KEYS = {'eta', 'epoch', 'iter', 'step'}
+TEXT_LOG_SUFFIXES = ('.log', 'log.txt')
+DEFAULT_METRIC = 'coco/bbox_mAP'
+CURVE_POINTS = 64
+
+
+class LogParser:
+    """
+    Turns the lines of mmengine text or JSON logs into records, one line at a time.
+
+    Train records carry 'mode' ('train'), 'epoch', 'step' (global iteration), 'elapsed' (seconds since the
+    start of the run) and their metrics (time, data_time, memory, lr, losses). Validation records carry the
+    evaluation metrics, e.g. 'coco/bbox_mAP', at the step they were computed. Text logs give wall-clock
+    'elapsed'; JSON logs have no timestamps, there it is the summed iteration time, without validation.
+    Several logs of one run (resumed training) are fed one after the other with start_file in between.
+    """
+
+    def __init__(self):
+        self.step = 0
+        self.elapsed = 0.0
+        self._offset = 0.0
+        self._first = None
+        self._previous = None
+        self._stamp = None
+        self._stamp_elapsed = 0.0
+        self._epoch_based = False
+
+    def start_file(self):
+        """
+        Continue the clock of the next log file from where the previous one stopped.
+        """
+        self._offset = self.elapsed
+        self._first = None
+        self._previous = None
+        self._stamp = None
+
+    def _clock(self, stamp: str) -> float:
+        if stamp == self._stamp:
+            return self._stamp_elapsed
+        # Text logs have no year; a date going backwards is the turn of a year.
+        moment = datetime(2000, int(stamp[:2]), int(stamp[3:5]), int(stamp[6:8]), int(stamp[9:11]), int(stamp[12:14]))
+        while self._previous is not None and moment < self._previous:
+            moment += timedelta(days=365)
+        self._previous = moment
+        if self._first is None:
+            self._first = moment
+        self._stamp, self._stamp_elapsed = stamp, self._offset + (moment - self._first).total_seconds()
+        return self._stamp_elapsed
+
+    def _train_step(self, record: dict, step: int) -> dict:
+        if self._first is None and 'time' in record and step > self.step:
+            # No wall clock: count the mean iteration time of every iteration since the last record.
+            self.elapsed += record['time'] * (step - self.step)
+        self.step = max(step, self.step)
+        return dict(record, mode='train', step=self.step, elapsed=self.elapsed)
+
+    def parse_text(self, line: str) -> Optional[dict]:
+        if self._first is None and STAMP.match(line):
+            # The clock starts with the first line of the file, not with the first logged iteration.
+            self.elapsed = self._clock(line[:14])
+        if '(train)' not in line and '(val)' not in line and '(test)' not in line:
+            return None
+        match = LOG_LINE.match(line)
+        if match is None:
+            return None
+        values = {key: float(value) for key, value in VALUE.findall(match.group('values')) if key not in SKIPPED_KEYS}
+        self.elapsed = self._clock(match.group('stamp'))
+        progress = [(int(current), int(total) if total else None)
+                    for current, total in PROGRESS.findall(match.group('progress'))]
+
+        if match.group('mode') != 'train':
+            if not any('/' in key for key in values):
+                return None  # progress line within a validation run
+            epoch = progress[0][0] if match.group('loop') == 'Epoch' else None
+            return dict(values, mode=match.group('mode'), epoch=epoch, step=self.step, elapsed=self.elapsed)
+
+        if match.group('loop') == 'Epoch':
+            (epoch, _), (current, total) = progress[0], progress[-1]
+            step = (epoch - 1) * total + current if total else self.step + 1
+        else:
+            epoch, step = None, progress[0][0]
+        return self._train_step(dict(values, epoch=epoch), step)
+
+    def parse_json(self, line: str) -> Optional[dict]:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        values = {key: float(value) for key, value in data.items()
+                  if key not in SKIPPED_KEYS and isinstance(value, (int, float))}
+        if any('/' in key for key in values):
+            # Validation 'step' is the epoch for epoch-based loops, the iteration otherwise.
+            epoch = data.get('step') if self._epoch_based else None
+            return dict(values, mode='val', epoch=epoch, step=self.step, elapsed=self.elapsed)
+        if 'step' not in data and 'iter' not in data:
+            return None
+        self._epoch_based = self._epoch_based or 'epoch' in data
+        return self._train_step(dict(values, epoch=data.get('epoch')), int(data.get('step', data.get('iter'))))
+
+    def parse(self, line: str) -> Optional[dict]:
+        return self.parse_json(line) if line.startswith('{') else self.parse_text(line)
+
+
+def find_logs(path: str) -> list:
+    """
+    Log files of a run: the file itself, or the mmengine logs below a directory (e.g. runs_archive/train5).
+
+    Text logs are preferred; without them the JSON logs in vis_data are used (scalars.json only when
+    there is no timestamped JSON log). Files are sorted by path, which is chronological for mmengine's
+    timestamped run directories.
+
+    Args:
+        path (str): Log file or run directory.
+
+    Returns:
+        list: Log files, oldest first.
+    """
+    if os.path.isfile(path):
+        return [path]
+    text_logs, json_logs, scalar_logs = [], [], []
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if name.endswith(TEXT_LOG_SUFFIXES):
+                text_logs.append(file_path)
+            elif os.path.basename(root) == 'vis_data' and name.endswith('.json'):
+                (scalar_logs if name == 'scalars.json' else json_logs).append(file_path)
+    return sorted(text_logs or json_logs or scalar_logs)
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """
+    Stream the records of a run, see LogParser; memory does not grow with the length of the logs.
+
+    Args:
+        path (str): Log file or run directory, see find_logs.
+
+    Yields:
+        dict: Train and validation records in log order.
+    """
+    parser = LogParser()
+    for log_path in find_logs(path):
+        parser.start_file()
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                record = parser.parse(line)
+                if record is not None:
+                    yield record
+
+
+def load_columns(path: str, keys: Sequence[str] = None, mode: str = 'train') -> dict:
+    """
+    Read the records of a run as columns.
+
+    Args:
+        path (str): Log file or run directory.
+        keys (Sequence[str], optional): Columns to keep, e.g. ('step', 'loss'). Defaults to all of them.
+        mode (str): 'train' or 'val' records.
+
+    Returns:
+        dict: Column name -> float64 array; values missing from a record are NaN.
+    """
+    columns = {}
+    rows = 0
+    for record in iter_records(path):
+        if record['mode'] != mode:
+            continue
+        for key, value in record.items():
+            if key == 'mode' or (keys is not None and key not in keys):
+                continue
+            if key not in columns:
+                columns[key] = array('d', [np.nan]) * rows
+            columns[key].append(np.nan if value is None else value)
+        rows += 1
+        for column in columns.values():
+            if len(column) < rows:
+                column.append(np.nan)
+    return {key: np.frombuffer(column, dtype=np.float64) for key, column in columns.items()}
+
+
+class Curve:
+    """
+    Downsampled curve of a stream of (step, value) points in bounded memory.
+
+    Points are averaged into buckets of equal step width; when there are more than twice `points`
+    buckets, neighbours are merged and the width doubles.
+    """
+
+    def __init__(self, points: int = CURVE_POINTS):
+        self.points = points
+        self.width = 1
+        self.buckets = {}
+
+    def add(self, step: float, value: float):
+        bucket = self.buckets.setdefault(int(step) // self.width, [0.0, 0.0, 0])
+        bucket[0] += step
+        bucket[1] += value
+        bucket[2] += 1
+        if len(self.buckets) > 2 * self.points:
+            self.width *= 2
+            merged = {}
+            for key, (steps, values, count) in self.buckets.items():
+                target = merged.setdefault(key // 2, [0.0, 0.0, 0])
+                target[0] += steps
+                target[1] += values
+                target[2] += count
+            self.buckets = merged
+
+    def values(self) -> list:
+        return [[steps / count, values / count] for _, (steps, values, count) in sorted(self.buckets.items())]
+
+
+class RunSummary:
+    """
+    Throughput, memory, evaluations and loss curve of one run, accumulated from its record stream.
+
+    Attributes:
+        name (str): Run name.
+        evaluations (list): (epoch, step, elapsed seconds, metric value) of every validation.
+    """
+
+    def __init__(self, name: str, metric: str = DEFAULT_METRIC, points: int = CURVE_POINTS):
+        """
+        Args:
+            name (str): Run name.
+            metric (str): Validation metric to follow.
+            points (int): Resolution of the loss and memory curves.
+        """
+        self.name = name
+        self.metric = metric
+        self.steps = 0
+        self.elapsed = 0.0
+        self.weighted = {'time': 0.0, 'data_time': 0.0}
+        self.weight = 0
+        self.peak_memory = None
+        self.evaluations = []
+        self.loss = Curve(points)
+        self.memory = Curve(points)
+
+    def add(self, record: dict):
+        self.elapsed = max(self.elapsed, record['elapsed'])
+        if record['mode'] != 'train':
+            if self.metric in record:
+                self.evaluations.append((record['epoch'], record['step'], record['elapsed'], record[self.metric]))
+            return
+        # Logged times are means over the logging interval: weight them by the iterations they cover.
+        iterations = record['step'] - self.steps
+        self.steps = record['step']
+        if 'time' in record and iterations > 0:
+            self.weight += iterations
+            for key in self.weighted:
+                self.weighted[key] += record.get(key, 0.0) * iterations
+        if 'loss' in record:
+            self.loss.add(record['step'], record['loss'])
+        if 'memory' in record:
+            self.memory.add(record['step'], record['memory'])
+            self.peak_memory = max(self.peak_memory or 0.0, record['memory'])
+
+    @classmethod
+    def from_path(cls, path: str, metric: str = DEFAULT_METRIC, points: int = CURVE_POINTS) -> RunSummary:
+        """
+        Args:
+            path (str): Log file or run directory.
+            metric (str): Validation metric to follow.
+            points (int): Resolution of the curves.
+
+        Returns:
+            RunSummary: Summary named after the run directory, or the log file without its suffix.
+        """
+        name = os.path.basename(os.path.normpath(path))
+        summary = cls(os.path.splitext(name)[0] if os.path.isfile(path) else name, metric, points)
+        for record in iter_records(path):
+            summary.add(record)
+        return summary
+
+    def time_to_target(self, target: float) -> Optional[dict]:
+        for epoch, step, elapsed, value in self.evaluations:
+            if value >= target:
+                return {'epoch': epoch, 'step': step, 'elapsed': elapsed}
+        return None
+
+    def to_dict(self, target: float = None) -> dict:
+        """
+        Args:
+            target (float, optional): Metric value for time_to_target.
+
+        Returns:
+            dict: JSON-ready summary.
+        """
+        time = self.weighted['time'] / self.weight if self.weight else None
+        data_time = self.weighted['data_time'] / self.weight if self.weight else None
+        best = max(self.evaluations, key=lambda evaluation: evaluation[3], default=None)
+        return {'name': self.name,
+                'iterations': self.steps,
+                'elapsed': self.elapsed,
+                'time': time,
+                'data_time': data_time,
+                'data_share': data_time / time if time else None,
+                'iters_per_s': 1 / time if time else None,
+                'peak_memory': self.peak_memory,
+                'metric': self.metric,
+                'best': {'epoch': best[0], 'step': best[1], 'elapsed': best[2], 'value': best[3]} if best else None,
+                'final': self.evaluations[-1][3] if self.evaluations else None,
+                'target': target,
+                'time_to_target': self.time_to_target(target) if target is not None else None,
+                'evaluations': [list(evaluation) for evaluation in self.evaluations],
+                'loss_curve': self.loss.values(),
+                'memory_curve': self.memory.values()}
+
+
+def compare_runs(paths: Sequence[str], metric: str = DEFAULT_METRIC, target: float = None,
+                 points: int = CURVE_POINTS) -> list:
+    """
+    Line up several training runs.
+
+    Args:
+        paths (Sequence[str]): Log files or run directories, e.g. runs_archive/train*.
+        metric (str): Validation metric to compare.
+        target (float, optional): Metric value for time-to-target. Defaults to the lowest best value
+            among the runs, which every run reaches.
+        points (int): Resolution of the loss and memory curves.
+
+    Returns:
+        list: RunSummary.to_dict of every run, in the order of paths.
+    """
+    summaries = [RunSummary.from_path(path, metric, points) for path in paths]
+    if target is None:
+        bests = [max(evaluation[3] for evaluation in summary.evaluations) for summary in summaries if summary.evaluations]
+        target = min(bests) if bests else None
+    return [summary.to_dict(target) for summary in summaries]
+
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def _number(value: Optional[float], spec: str) -> str:
+    return '-' if value is None else format(value, spec)
+
+
+def format_table(runs: list) -> str:
+    """
+    Args:
+        runs (list): Output of compare_runs.
+
+    Returns:
+        str: Plain-text table, one run per row.
+    """
+    header = ('run', 'iters', 's/iter', 'data_time', 'data %', 'iters/s', 'memory MB', 'best', 'best epoch', 'final',
+              'to target', 'elapsed')
+    rows = [header]
+    for run in runs:
+        best = run['best'] or {}
+        reached = run['time_to_target']
+        rows.append((run['name'], str(run['iterations']), _number(run['time'], '.4f'), _number(run['data_time'], '.4f'),
+                     _number(run['data_share'] and run['data_share'] * 100, '.1f'), _number(run['iters_per_s'], '.2f'),
+                     _number(run['peak_memory'], '.0f'), _number(best.get('value'), '.4f'),
+                     str(best.get('epoch', '-')), _number(run['final'], '.4f'),
+                     _duration(reached['elapsed']) if reached else '-', _duration(run['elapsed'])))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) if column == 0 else cell.rjust(width)
+                       for column, (cell, width) in enumerate(zip(row, widths))) for row in rows]
+    if runs and runs[0]['target'] is not None:
+        lines.append(f"to target: wall-clock time until {runs[0]['metric']} >= {runs[0]['target']:.4f}")
+    return '\n'.join(lines)
+
+
+def plot_runs(runs: list, output_path: str):
+    """
+    Plot the loss curves, the validation metric over time and the memory of several runs.
+
+    Args:
+        runs (list): Output of compare_runs.
+        output_path (str): Image file.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (loss_ax, metric_ax, memory_ax) = plt.subplots(1, 3, figsize=(18, 5))
+    for run in runs:
+        if run['loss_curve']:
+            loss_ax.plot(*zip(*run['loss_curve']), label=run['name'])
+        if run['evaluations']:
+            metric_ax.plot([evaluation[2] / 3600 for evaluation in run['evaluations']],
+                           [evaluation[3] for evaluation in run['evaluations']], marker='.', label=run['name'])
+        if run['memory_curve']:
+            memory_ax.plot(*zip(*run['memory_curve']), label=run['name'])
+    loss_ax.set(title='loss', xlabel='iteration')
+    metric_ax.set(title=runs[0]['metric'] if runs else '', xlabel='hours')
+    memory_ax.set(title='memory (MB)', xlabel='iteration')
+    for ax in (loss_ax, metric_ax, memory_ax):
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare mmengine training runs from their logs.")
+    parser.add_argument('runs', nargs='+', help="log files or run directories, e.g. runs_archive/train*")
+    parser.add_argument('--metric', default=DEFAULT_METRIC)
+    parser.add_argument('--target', type=float, help="metric value for time-to-target (default: lowest best value)")
+    parser.add_argument('--report', help="JSON file with the full comparison, including the curves")
+    parser.add_argument('--plot', help="image with loss, metric and memory curves")
+    parser.add_argument('--columns', help="directory for the train records of every run as <run>.npz")
+    args = parser.parse_args()
+
+    runs = compare_runs(args.runs, args.metric, args.target)
+    print(format_table(runs))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(runs, f, indent=2)
+    if args.plot:
+        plot_runs(runs, args.plot)
+    if args.columns:
+        os.makedirs(args.columns, exist_ok=True)
+        for path, run in zip(args.runs, runs):
+            np.savez(os.path.join(args.columns, run['name'] + '.npz'), **load_columns(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import math
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from mmdet.evaluation import CocoMetric
+from mmdet.registry import DATA_SAMPLERS, METRICS
+from mmengine.dist import get_dist_info, sync_random_seed
+from mmengine.evaluator import BaseMetric
+from torch.utils.data import Sampler
+
+
+def source_counts(ratios: Sequence[float], total: int) -> np.ndarray:
+    """
+    Split a number of samples between sources by ratio, rounding by largest remainder.
+
+    Args:
+        ratios (Sequence[float]): Mixing ratio of every source, any positive scale.
+        total (int): Number of samples.
+
+    Returns:
+        np.ndarray: Samples per source, summing to total.
+    """
+    shares = np.asarray(ratios, dtype=np.float64)
+    shares = shares / shares.sum() * total
+    counts = np.floor(shares).astype(np.int64)
+    counts[np.argsort(counts - shares)[:total - counts.sum()]] += 1
+    return counts
+
+
+@DATA_SAMPLERS.register_module()
+class MixedSourceSampler(Sampler):
+    """
+    Samples a ConcatDataset of several sources in fixed ratios.
+
+    Every epoch draws ratio-proportional numbers of samples from each source: a source is walked
+    in a fresh random order and started over when its share is larger than the source itself, so
+    small sources are repeated and large ones subsampled without copying any file.
+
+    Attributes:
+        sizes (np.ndarray): Number of samples of every source.
+        counts (np.ndarray): Samples drawn from every source per epoch.
+    """
+
+    def __init__(self, dataset, ratios: Sequence[float], epoch_length: Optional[int] = None,
+                 shuffle: bool = True, seed: Optional[int] = None):
+        """
+        Args:
+            dataset: ConcatDataset with one dataset per source.
+            ratios (Sequence[float]): Mixing ratio of every source.
+            epoch_length (int, optional): Samples per epoch over all ranks. Defaults to the size of the dataset.
+            shuffle (bool): Interleave the sources randomly; otherwise they follow each other.
+            seed (int, optional): Random seed, shared by all ranks. Defaults to a synchronized random seed.
+        """
+        cumulative_sizes = list(dataset.cumulative_sizes)
+        if len(ratios) != len(cumulative_sizes):
+            raise ValueError(f"{len(ratios)} ratios for {len(cumulative_sizes)} sources")
+        self.rank, self.world_size = get_dist_info()
+        self.sizes = np.diff([0] + cumulative_sizes)
+        if np.any((self.sizes == 0) & (np.asarray(ratios) > 0)):
+            raise ValueError(f"Empty source with a positive ratio: sizes {self.sizes.tolist()}, ratios {list(ratios)}")
+        self.offsets = np.array([0] + cumulative_sizes[:-1])
+        self.counts = source_counts(ratios, epoch_length or int(self.sizes.sum()))
+        self.shuffle = shuffle
+        self.seed = sync_random_seed() if seed is None else seed
+        self.epoch = 0
+        self.num_samples = math.ceil(int(self.counts.sum()) / self.world_size)
+        self.total_size = self.num_samples * self.world_size
+
+    def __iter__(self) -> Iterator[int]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = []
+        for offset, size, count in zip(self.offsets, self.sizes, self.counts):
+            passes = [rng.permutation(size) if self.shuffle else np.arange(size) for _ in range(-(-count // size))]
+            indices.append(np.concatenate(passes)[:count] + offset if passes else np.empty(0, dtype=np.int64))
+        indices = np.concatenate(indices)
+        if self.shuffle:
+            rng.shuffle(indices)
+        indices = np.resize(indices, self.total_size)
+        return iter(indices[self.rank:self.total_size:self.world_size].tolist())
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+
+@METRICS.register_module()
+class MixedSourceCocoMetric(BaseMetric):
+    """
+    COCO metrics of every source of a ConcatDataset validation set.
+
+    The results come back in dataset order, so the sources are cut by their image counts and
+    evaluated with their own annotation files. Per-source values are reported as
+    '<source>_<metric>'; the metrics themselves are the ratio-weighted mean over the sources,
+    so 'coco/bbox_mAP' still drives checkpointing and early stopping.
+    """
+    default_prefix: Optional[str] = 'coco'
+
+    def __init__(self, sources: Sequence[dict], weights: Sequence[float] = None, collect_device: str = 'cpu',
+                 prefix: Optional[str] = None, **kwargs):
+        """
+        Args:
+            sources (Sequence[dict]): 'name' and 'ann_file' of every source, in ConcatDataset order.
+            weights (Sequence[float], optional): Weight of every source in the mean. Defaults to equal weights.
+            collect_device (str): Device used to collect results across ranks.
+            prefix (str, optional): Metric name prefix. Defaults to 'coco'.
+            **kwargs: Passed to CocoMetric, e.g. metric='bbox'.
+        """
+        super().__init__(collect_device=collect_device, prefix=prefix)
+        self.names = [source['name'] for source in sources]
+        self.metrics = [CocoMetric(ann_file=source['ann_file'], **kwargs) for source in sources]
+        self.sizes = [len(metric._coco_api.get_img_ids()) for metric in self.metrics]
+        self.weights = list(weights) if weights is not None else [1.0] * len(sources)
+
+    @property
+    def dataset_meta(self) -> Optional[dict]:
+        return self._dataset_meta
+
+    @dataset_meta.setter
+    def dataset_meta(self, dataset_meta: dict):
+        self._dataset_meta = dataset_meta
+        for metric in self.metrics:
+            metric.dataset_meta = dataset_meta
+
+    def process(self, data_batch: dict, data_samples: Sequence[dict]):
+        # CocoMetric.process only converts samples; the results are kept here so they are collected across ranks.
+        converter = self.metrics[0]
+        start = len(converter.results)
+        converter.process(data_batch, data_samples)
+        self.results.extend(converter.results[start:])
+        del converter.results[start:]
+
+    def compute_metrics(self, results: list) -> dict:
+        metrics = {}
+        per_source = []
+        start = 0
+        for name, metric, size in zip(self.names, self.metrics, self.sizes):
+            values = metric.compute_metrics(results[start:start + size])
+            start += size
+            per_source.append(values)
+            metrics.update({f'{name}_{key}': value for key, value in values.items()})
+
+        total_weight = sum(self.weights)
+        for key in set.intersection(*(set(values) for values in per_source)):
+            if all(isinstance(values[key], (int, float)) for values in per_source):
+                metrics[key] = sum(weight * values[key] for weight, values in zip(self.weights, per_source)) / total_weight
+        return metrics
@@ -0,0 +1,209 @@
+import json
+import os
+import resource
+import time
+from collections import defaultdict
+from typing import Optional
+
+import torch
+from mmdet.registry import HOOKS
+from mmengine.dist import is_main_process
+from mmengine.hooks import Hook
+
+PHASES = ('data_time', 'forward_time', 'backward_time', 'optimizer_time', 'hook_time')
+
+
+def queue_depth(iterator) -> tuple:
+    """
+    Batches a multi-process DataLoader iterator has ready and still in flight.
+
+    Args:
+        iterator: Iterator of a torch DataLoader, None before the first epoch.
+
+    Returns:
+        tuple: (ready, in flight), None for single-process loading or when the queue cannot be inspected.
+    """
+    task_info = getattr(iterator, '_task_info', None)
+    if task_info is None:
+        return None, None
+    # Batches that arrived out of order are parked in _task_info as (worker_id, data).
+    ready = sum(len(info) == 2 for info in list(task_info.values()))
+    try:
+        ready += iterator._data_queue.qsize()
+    except (AttributeError, NotImplementedError):
+        pass
+    return ready, getattr(iterator, '_tasks_outstanding', None)
+
+
+def verdict(totals: dict, input_bound_share: float) -> dict:
+    """
+    Attribute the training time to data loading or computation.
+
+    Args:
+        totals (dict): Summed seconds per phase (PHASES).
+        input_bound_share (float): Share of data_time from which the run counts as input-bound.
+
+    Returns:
+        dict: 'verdict' ('input-bound' or 'compute-bound'), the share of every phase and a 'hint'.
+    """
+    total = sum(totals.get(phase, 0.0) for phase in PHASES)
+    shares = {phase.replace('_time', '_share'): totals.get(phase, 0.0) / total if total else 0.0 for phase in PHASES}
+    if shares['data_share'] >= input_bound_share:
+        return dict(verdict='input-bound', **shares,
+                    hint="more dataloader workers, or pre-decoded images (ModelConfig image_cache)")
+    return dict(verdict='compute-bound', **shares, hint="larger batches or mixed precision (amp)")
+
+
+@HOOKS.register_module()
+class ThroughputProfilerHook(Hook):
+    """
+    Records where training time goes, as JSON lines.
+
+    Per iteration: the wait for the dataloader, forward (with the loss), backward, optimizer and other
+    hooks' time, samples/s, batches ready in the dataloader queue and peak memory. Per epoch and at the
+    end of the run: the summed phases and a verdict whether data loading or computation limits throughput.
+    The phases are measured by wrapping model.train_step and the optimizer wrapper; with synchronize the
+    GPU is waited for around every phase, which costs a little throughput but keeps the attribution honest.
+    """
+    priority = 'VERY_LOW'
+
+    def __init__(self, output_path: Optional[str] = None, interval: int = 1, synchronize: bool = True,
+                 input_bound_share: float = 0.2):
+        """
+        Args:
+            output_path (str, optional): JSONL file. Defaults to throughput_<timestamp>.jsonl in the work_dir.
+            interval (int): Write every interval-th iteration; summaries cover all of them.
+            synchronize (bool): Wait for CUDA kernels before taking a time.
+            input_bound_share (float): Share of data_time from which the verdict is input-bound.
+        """
+        self.output_path = output_path
+        self.interval = interval
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.input_bound_share = input_bound_share
+        self._file = None
+        self._iterator = None
+        self._last = None
+        self._start = None
+        self._val_start = None
+        self._current = defaultdict(float)
+        self._epoch = defaultdict(float)
+        self._run = defaultdict(float)
+
+    def _time(self) -> float:
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _timed(self, function, phase: str):
+        def wrapper(*args, **kwargs):
+            start = self._time()
+            result = function(*args, **kwargs)
+            self._current[phase] += self._time() - start
+            return result
+        return wrapper
+
+    def _write(self, record: dict):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+
+    @staticmethod
+    def _memory() -> dict:
+        return {'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                'peak_cuda_mb': torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else None}
+
+    def _summary(self, totals: dict) -> dict:
+        iterations = totals['iterations']
+        summary = {phase: totals[phase] / iterations if iterations else None for phase in PHASES}
+        elapsed = sum(totals[phase] for phase in PHASES)
+        summary.update(iterations=int(iterations),
+                       samples=int(totals['samples']),
+                       samples_per_s=totals['samples'] / elapsed if elapsed else None,
+                       queue_ready=totals['queue_ready'] / totals['queue_samples'] if totals['queue_samples'] else None,
+                       **verdict(totals, self.input_bound_share),
+                       **self._memory())
+        return summary
+
+    def before_train(self, runner):
+        if is_main_process():
+            output_path = self.output_path or os.path.join(runner.work_dir, f'throughput_{runner.timestamp}.jsonl')
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            self.output_path = output_path
+            self._file = open(output_path, 'w', buffering=1)
+
+        runner.model.train_step = self._timed(runner.model.train_step, 'step_time')
+        optim_wrapper = runner.optim_wrapper
+        optim_wrapper.backward = self._timed(optim_wrapper.backward, 'backward_time')
+        optim_wrapper.step = self._timed(optim_wrapper.step, 'optimizer_time')
+        optim_wrapper.zero_grad = self._timed(optim_wrapper.zero_grad, 'optimizer_time')
+
+        # DataLoader.__iter__ goes through _get_iterator; keep the iterator to look into its queue.
+        dataloader = runner.train_loop.dataloader
+        get_iterator = dataloader._get_iterator
+
+        def remember_iterator():
+            self._iterator = get_iterator()
+            return self._iterator
+        dataloader._get_iterator = remember_iterator
+
+    def before_train_epoch(self, runner):
+        self._epoch = defaultdict(float)
+        self._last = self._time()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def before_train_iter(self, runner, batch_idx: int, data_batch=None):
+        self._start = self._time()
+        self._current = defaultdict(float)
+        self._current['data_time'] = self._start - (self._last if self._last is not None else self._start)
+
+    def after_train_iter(self, runner, batch_idx: int, data_batch=None, outputs=None):
+        self._last = self._time()
+        current = self._current
+        compute = self._last - self._start
+        step_time = current.pop('step_time', compute)
+        current['forward_time'] = max(step_time - current['backward_time'] - current['optimizer_time'], 0.0)
+        current['hook_time'] = max(compute - step_time, 0.0)
+        current['samples'] = len(data_batch['inputs']) if data_batch is not None else 0
+        current['iterations'] = 1
+        ready, in_flight = queue_depth(self._iterator)
+        if ready is not None:
+            current['queue_ready'] = ready
+            current['queue_samples'] = 1
+        for totals in (self._epoch, self._run):
+            for key, value in current.items():
+                totals[key] += value
+
+        if self.every_n_train_iters(runner, self.interval):
+            iteration_time = current['data_time'] + compute
+            self._write(dict(type='iter', epoch=runner.epoch + 1, iter=runner.iter + 1,
+                             **{phase: current[phase] for phase in PHASES},
+                             samples=int(current['samples']),
+                             samples_per_s=current['samples'] / iteration_time if iteration_time else None,
+                             queue_ready=ready, queue_in_flight=in_flight,
+                             **self._memory()))
+
+    def after_train_epoch(self, runner):
+        if self._epoch['iterations']:
+            self._write(dict(type='epoch', epoch=runner.epoch + 1, **self._summary(self._epoch)))
+
+    def before_val_epoch(self, runner):
+        self._val_start = time.perf_counter()
+
+    def after_val_epoch(self, runner, metrics: Optional[dict] = None):
+        # Validation between training iterations is not a wait for training data.
+        if self._last is not None:
+            self._last += time.perf_counter() - self._val_start
+
+    def after_train(self, runner):
+        if not self._run['iterations']:
+            return
+        summary = self._summary(self._run)
+        self._write(dict(type='run', **summary))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            runner.logger.info(
+                f"Throughput: {summary['samples_per_s']:.1f} samples/s, {summary['verdict']} "
+                f"(data {summary['data_share']:.0%}, forward {summary['forward_share']:.0%}, "
+                f"backward {summary['backward_share']:.0%}, optimizer {summary['optimizer_share']:.0%}, "
+                f"hooks {summary['hook_share']:.0%}); {summary['hint']}. Details in {self.output_path}")
@@ -6,6 +6,8 @@ from mmengine.config import Config
 from mmengine.registry import RUNNERS
 from mmengine.runner import Runner
 
+# Registers ThroughputProfilerHook; Runner.from_cfg does not import custom_imports.
+import auto_od.train.profiler  # noqa: F401
 from auto_od.core.settings import load_settings_from_yaml
 
 DEVICE = 'cuda:0' if torch.cuda.is_available() else 'cpu'
@@ -21,7 +23,8 @@ class DetectorTrainer:
                  cfg_options=None,
                  launcher='none',
                  local_rank=0,
-                 set_random_seed=None):
+                 set_random_seed=None,
+                 profile=False):  # record data/forward/backward/optimizer time, see ThroughputProfilerHook
         self.config = load_settings_from_yaml(settings_path)
         self.config_path = config_path
         self.amp = amp
@@ -31,6 +34,7 @@ class DetectorTrainer:
         self.launcher = launcher
         self.local_rank = local_rank
         self.set_random_seed = set_random_seed
+        self.profile = profile
 
     def folder_saved_model(self):
         if not os.path.exists(self.config.models_dir):
@@ -51,6 +55,12 @@ class DetectorTrainer:
 
         cfg.work_dir = self.config.models_dir
 
+        if self.profile:
+            profiler = dict(type='ThroughputProfilerHook')
+            if isinstance(self.profile, dict):
+                profiler.update(self.profile)
+            cfg.custom_hooks = list(cfg.get('custom_hooks', [])) + [profiler]
+
         if self.amp:
             optim_wrapper = cfg.optim_wrapper.type
             if optim_wrapper != 'AmpOptimWrapper':
@@ -0,0 +1,81 @@
+from typing import Optional
+
+import numpy as np
+from mmcv.transforms import LoadImageFromFile
+from mmdet.registry import TRANSFORMS
+
+from auto_od.helper.image_cache import ImageCache
+
+
+def scale_instances(instances: list, scale_x: float, scale_y: float) -> Optional[list]:
+    """
+    Scale the boxes and polygons of mmdet data info instances.
+
+    Args:
+        instances (list): Instance dicts with 'bbox' as xyxy and optionally 'mask' as polygons.
+        scale_x (float): Horizontal factor.
+        scale_y (float): Vertical factor.
+
+    Returns:
+        list | None: Scaled copies, or None when an instance has an RLE mask that cannot be scaled.
+    """
+    factors = np.array([scale_x, scale_y])
+    scaled = []
+    for instance in instances:
+        instance = dict(instance)
+        instance['bbox'] = (np.asarray(instance['bbox'], dtype=np.float64) * np.tile(factors, 2)).tolist()
+        mask = instance.get('mask')
+        if isinstance(mask, dict):
+            return None
+        if mask is not None:
+            instance['mask'] = [(np.asarray(polygon, dtype=np.float64).reshape(-1, 2) * factors).ravel().tolist()
+                                for polygon in mask]
+        scaled.append(instance)
+    return scaled
+
+
+@TRANSFORMS.register_module()
+class LoadImageFromCache(LoadImageFromFile):
+    """
+    Drop-in replacement of LoadImageFromFile that reads pre-decoded images from an ImageCache.
+
+    Images come out of the cache already reduced to the training scale, so the instances are scaled
+    into the cached image before LoadAnnotations picks them up, and ori_shape is the cached shape.
+    Only for training pipelines: predictions would be rescaled to the cached size, not to the
+    annotated one. Images missing from the cache are read from file as usual.
+    """
+
+    def __init__(self, cache_dir: str, **kwargs):
+        """
+        Args:
+            cache_dir (str): Cache directory written by auto_od.helper.image_cache.build_image_cache.
+            **kwargs: LoadImageFromFile arguments, used for images that are not cached.
+        """
+        super().__init__(**kwargs)
+        if self.color_type != 'color':
+            raise ValueError(f"The image cache holds color images, got color_type='{self.color_type}'")
+        self.cache_dir = cache_dir
+        # Opened on first use, so every dataloader worker maps the store itself.
+        self._cache = None
+
+    def transform(self, results: dict) -> Optional[dict]:
+        if self._cache is None:
+            self._cache = ImageCache(self.cache_dir)
+        entry = self._cache.get(results['img_path'])
+        if entry is None:
+            return super().transform(results)
+
+        img, (ori_height, ori_width) = entry
+        height, width = img.shape[:2]
+        if (height, width) != (ori_height, ori_width) and results.get('instances'):
+            instances = scale_instances(results['instances'], width / ori_width, height / ori_height)
+            if instances is None:
+                return super().transform(results)
+            results['instances'] = instances
+        if self.to_float32:
+            img = img.astype(np.float32)
+
+        results['img'] = img
+        results['img_shape'] = img.shape[:2]
+        results['ori_shape'] = img.shape[:2]
+        return results
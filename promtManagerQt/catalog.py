@@ -0,0 +1,161 @@
+import json
+import re
+from functools import lru_cache
+
+
+# Kept free of Qt so that prompt_service can share it without a GUI.
+MODEL_TYPES = ("Midjourney", "DreamStudio", "Stable Diffusion")
+CATALOG_PATH = "resource/{0}.json"
+
+WEIGHT_SEPARATOR = '::'
+
+MIDJOURNEY_FLAG_PREFIX = '--'
+MIDJOURNEY_FLAGS_WITH_VALUE = {'--ar', '--aspect', '--no', '--seed', '--sameseed', '--stop', '--chaos',
+                               '--s', '--stylize', '--q', '--quality', '--v', '--version', '--iw'}
+# Flags that have a plain-text counterpart in the other models; every other flag is dropped.
+MIDJOURNEY_FLAG_TERMS = {
+    '--tile': 'seamless tileable texture',
+    '--testp': 'photorealistic',
+}
+
+
+@lru_cache(maxsize=None)
+def load_catalog_file(filename_: str) -> dict:
+    """Parse a catalog JSON once per process; every consumer shares the result."""
+    with open(filename_) as file:
+        return json.load(file)
+
+
+def load_catalog(model_type_: str) -> dict:
+    return load_catalog_file(CATALOG_PATH.format(model_type_))
+
+
+def iter_parameters(node_: dict):
+    stack = [node_]
+    while stack:
+        node = stack.pop()
+        if node.get('type') == 'parameter':
+            yield node
+        stack.extend(reversed(node.get('params', [])))
+
+
+def normalize_term(term_: str) -> str:
+    return ' '.join(re.sub(r'[_\-]+', ' ', term_.lower()).split())
+
+
+def split_weight(token_: str) -> tuple[str, str]:
+    i = token_.find(WEIGHT_SEPARATOR)
+    if i == -1:
+        return token_, ''
+    return token_[:i], token_[i:]
+
+
+def is_flag(token_: str) -> bool:
+    return token_.startswith(MIDJOURNEY_FLAG_PREFIX)
+
+
+def add_terms(prompt_: str, terms_: list[str]) -> str:
+    if not terms_:
+        return prompt_
+    return ' '.join([prompt_] + terms_) if len(prompt_) > 0 else ' '.join(terms_)
+
+
+def remove_terms(prompt_: str, terms_: list[str]) -> str:
+    """
+    Remove every occurrence of the given terms, together with a trailing weight such as "::2",
+    in a single pass over the prompt.
+    """
+    if not terms_:
+        return prompt_
+    alternatives = '|'.join(re.escape(term) for term in sorted(set(terms_), key=len, reverse=True))
+    return re.sub(r'(?<![^ ])(?:' + alternatives + r')[\d:]*(?: +|$)', '', prompt_).rstrip(' ')
+
+
+def tokenize_prompt(prompt_: str) -> list[str]:
+    """Split a prompt into terms, keeping a Midjourney flag and its value in one token."""
+    words = prompt_.split()
+    tokens = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        i += 1
+        if is_flag(word) and split_weight(word)[0] in MIDJOURNEY_FLAGS_WITH_VALUE \
+                and i < len(words) and not is_flag(words[i]):
+            word = word + ' ' + words[i]
+            i += 1
+        tokens.append(word)
+    return tokens
+
+
+class TermIndex:
+    """Normalized term -> {model type -> catalog name}, built once from all catalogs."""
+    def __init__(self, catalogs_: dict[str, dict]):
+        self.model_types = tuple(catalogs_.keys())
+        self.terms = dict()
+        for model_type, catalog in catalogs_.items():
+            for item in iter_parameters(catalog):
+                for key in (item['name'], item.get('prompt', '')):
+                    if key:
+                        self.terms.setdefault(normalize_term(key), dict()).setdefault(model_type, item['name'])
+
+    def resolve(self, term_: str, model_type_: str) -> str | None:
+        entries = self.terms.get(normalize_term(term_))
+        if entries is None:
+            return None
+        return entries.get(model_type_)
+
+    def convert_prompt(self, prompt_: str, model_type_: str) -> tuple[str, list[str]]:
+        """
+        Re-resolve every token of a prompt against the catalog of model_type_.
+
+        Returns the converted prompt and the catalog names it selects in the target model.
+        Free text is carried over unchanged.
+        """
+        keep_flags = model_type_ == 'Midjourney'
+        result = []
+        names = []
+        for token in tokenize_prompt(prompt_):
+            if is_flag(token):
+                if keep_flags:
+                    result.append(token)
+                elif token in MIDJOURNEY_FLAG_TERMS:
+                    result.append(MIDJOURNEY_FLAG_TERMS[token])
+                continue
+            term, weight = split_weight(token)
+            name = self.resolve(term, model_type_)
+            if name is None:
+                result.append(token)
+                continue
+            names.append(name)
+            result.append(name + weight)
+        return ' '.join(result), names
+
+    def compose_prompt(self, model_type_: str, terms_: list, text_: str = '', flags_: dict = None) -> tuple[str, list[str]]:
+        """
+        Render a prompt the way the model widgets build it.
+
+        terms_ holds catalog terms, either plain strings or {"name": ..., "weight": ...};
+        flags_ maps Midjourney flag names (with or without "--") to a value, True for bare flags.
+        Returns the prompt and the terms that are not in the catalog of model_type_.
+        """
+        result = [text_.strip()] if text_ and text_.strip() else []
+        unresolved = []
+        for term in terms_:
+            weight = 1
+            if isinstance(term, dict):
+                weight = term.get('weight', 1)
+                term = term['name']
+            name = self.resolve(term, model_type_)
+            if name is None:
+                unresolved.append(term)
+                name = term
+            result.append(name if weight == 1 else name + WEIGHT_SEPARATOR + str(weight))
+        for flag, value in (flags_ or dict()).items():
+            if value is False or value is None:
+                continue
+            flag = flag if is_flag(flag) else MIDJOURNEY_FLAG_PREFIX + flag
+            if model_type_ == 'Midjourney':
+                result.append(flag if value is True else f"{flag} {value}")
+            elif flag in MIDJOURNEY_FLAG_TERMS:
+                result.append(MIDJOURNEY_FLAG_TERMS[flag])
+        return ' '.join(result), unresolved
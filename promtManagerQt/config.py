@@ -6,6 +6,15 @@ WINDOW_TITLE = "Prompt Manager"
 DEFAULT_IMG_PATH = "resource/illustration.png"
 
 DEFAULT_MAXIMUM_IMG_SIZE = QSize(150, 240)
+# Previews are shown at full resolution, bounded by the screen; this bound applies without a screen.
+DEFAULT_PREVIEW_IMG_SIZE = QSize(1920, 1080)
+
+# Full-resolution previews take 4-8 MB each (1024x1024 to 1920x1080, 32-bit),
+# enough for the visible and prefetched items.
+DEFAULT_IMAGE_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_PREFETCH_COUNT = 15
+DEFAULT_PREFETCH_THREADS = 2
+DEFAULT_PREFETCH_DELAY_MS = 60
 
 DEFAULT_HINT = "Maybe it will help you"
 
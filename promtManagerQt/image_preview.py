@@ -0,0 +1,239 @@
+from collections import OrderedDict
+
+from PySide6.QtWidgets import QWidget, QLabel, QScrollArea
+from PySide6.QtGui import QGuiApplication, QPixmap, QImage, QImageReader
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, QSize, QPoint, Signal
+import config as cf
+
+
+HOVER_PRIORITY = 2
+VISIBLE_PRIORITY = 1
+PREFETCH_PRIORITY = 0
+
+
+class PixmapCache:
+    """LRU cache of decoded previews, bounded by the pixel memory it holds."""
+    def __init__(self, max_bytes_: int = cf.DEFAULT_IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes_
+        self.size_bytes = 0
+        self.__items = OrderedDict()
+
+    @staticmethod
+    def pixmap_bytes(pixmap_: QPixmap) -> int:
+        return pixmap_.width() * pixmap_.height() * max(pixmap_.depth(), 8) // 8
+
+    def __contains__(self, key_: str) -> bool:
+        return key_ in self.__items
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def get(self, key_: str) -> QPixmap | None:
+        pixmap = self.__items.get(key_)
+        if pixmap is not None:
+            self.__items.move_to_end(key_)
+        return pixmap
+
+    def put(self, key_: str, pixmap_: QPixmap) -> None:
+        size = self.pixmap_bytes(pixmap_)
+        if size > self.max_bytes:
+            return
+        if key_ in self.__items:
+            self.size_bytes -= self.pixmap_bytes(self.__items.pop(key_))
+        self.__items[key_] = pixmap_
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            _, pixmap = self.__items.popitem(last=False)
+            self.size_bytes -= self.pixmap_bytes(pixmap)
+
+
+class ImageLoadTask(QRunnable):
+    def __init__(self, img_path_: str, max_size_: QSize, priority_: int, loader_):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.img_path = img_path_
+        self.max_size = max_size_
+        self.priority = priority_
+        self.loader = loader_
+        self.is_cancelled = False
+
+    def cancel(self) -> None:
+        self.is_cancelled = True
+
+    def fits(self, size_: QSize) -> bool:
+        return size_.width() <= self.max_size.width() and size_.height() <= self.max_size.height()
+
+    def run(self) -> None:
+        # Always report back, even when cancelled: the loader keeps running tasks alive until then.
+        if self.is_cancelled:
+            self.loader.image_loaded.emit(self, QImage())
+            return
+        # QImage is safe to use off the GUI thread, QPixmap is not:
+        # decode and scale here, convert on the GUI thread.
+        # Full resolution, only images larger than the screen are scaled down.
+        reader = QImageReader(self.img_path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid() and not self.fits(size):
+            reader.setScaledSize(size.scaled(self.max_size, Qt.KeepAspectRatio))
+        image = reader.read()
+        if self.is_cancelled:
+            image = QImage()
+        elif not image.isNull() and not size.isValid() and not self.fits(image.size()):
+            image = image.scaled(self.max_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.loader.image_loaded.emit(self, image)
+
+
+class ImageLoader(QObject):
+    image_loaded = Signal(object, QImage)
+    pixmap_ready = Signal(str, QPixmap)
+
+    def __init__(self, parent_: QObject = None):
+        super().__init__(parent_)
+        self.cache = PixmapCache()
+        screen = QGuiApplication.primaryScreen()
+        self.max_size = screen.availableGeometry().size() if screen is not None else cf.DEFAULT_PREVIEW_IMG_SIZE
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(cf.DEFAULT_PREFETCH_THREADS)
+        self.__pending = dict()
+        self.__running = set()
+        self.image_loaded.connect(self.__loaded_action)
+
+    def request(self, img_path_: str, priority_: int = HOVER_PRIORITY) -> QPixmap | None:
+        pixmap = self.cache.get(img_path_)
+        if pixmap is not None:
+            return pixmap
+        task = self.__pending.get(img_path_)
+        if task is not None:
+            if task.priority >= priority_:
+                return None
+            self.__cancel(task)
+        task = ImageLoadTask(img_path_, self.max_size, priority_, self)
+        self.__pending[img_path_] = task
+        self.pool.start(task, priority_)
+        return None
+
+    def prefetch(self, img_paths_: list[tuple[str, int]]) -> None:
+        wanted = {path for path, _ in img_paths_}
+        for path, task in list(self.__pending.items()):
+            if task.priority < HOVER_PRIORITY and path not in wanted:
+                self.__cancel(task)
+        for path, priority in img_paths_:
+            if path not in self.cache:
+                self.request(path, priority)
+
+    def cancel_all(self) -> None:
+        for task in list(self.__pending.values()):
+            self.__cancel(task)
+
+    def __cancel(self, task_: ImageLoadTask) -> None:
+        task_.cancel()
+        if not self.pool.tryTake(task_):
+            # Already on a pool thread: keep a reference until it reports back.
+            self.__running.add(task_)
+        if self.__pending.get(task_.img_path) is task_:
+            self.__pending.pop(task_.img_path)
+
+    def __loaded_action(self, task_: ImageLoadTask, image_: QImage) -> None:
+        self.__running.discard(task_)
+        if self.__pending.get(task_.img_path) is task_:
+            self.__pending.pop(task_.img_path)
+        if image_.isNull():
+            return
+        pixmap = QPixmap.fromImage(image_)
+        self.cache.put(task_.img_path, pixmap)
+        self.pixmap_ready.emit(task_.img_path, pixmap)
+
+
+class ImagePreview(QLabel):
+    def __init__(self):
+        super().__init__(None, Qt.ToolTip | Qt.FramelessWindowHint)
+        self.setAttribute(Qt.WA_ShowWithoutActivating)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet(cf.DEFAULT_APP_STYLE_SHEET)
+
+    def show_pixmap(self, pixmap_: QPixmap, anchor_: QWidget) -> None:
+        self.setPixmap(pixmap_)
+        self.adjustSize()
+        screen = anchor_.screen().availableGeometry()
+        pos = anchor_.mapToGlobal(QPoint(anchor_.width(), 0))
+        if pos.x() + self.width() > screen.right():
+            pos.setX(anchor_.mapToGlobal(QPoint(0, 0)).x() - self.width())
+        pos.setY(max(screen.top(), min(pos.y(), screen.bottom() - self.height())))
+        self.move(pos)
+        self.show()
+
+
+class ImagePreviewManager(QObject):
+    def __init__(self, scroll_area_: QScrollArea, parent_: QObject = None):
+        super().__init__(parent_)
+        self.scroll_area = scroll_area_
+        self.loader = ImageLoader(self)
+        self.loader.pixmap_ready.connect(self.pixmap_ready_action)
+        self.preview = ImagePreview()
+        self.items = []
+        self.hovered = None
+        self.last_scroll_value = 0
+        self.scroll_direction = 1
+
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(cf.DEFAULT_PREFETCH_DELAY_MS)
+        self.prefetch_timer.timeout.connect(self.prefetch_action)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.scroll_action)
+
+    def add_item(self, item_: QWidget) -> None:
+        self.items.append(item_)
+
+    def show_preview(self, item_: QWidget) -> None:
+        self.hovered = item_
+        pixmap = self.loader.request(item_.img_path, HOVER_PRIORITY)
+        if pixmap is not None:
+            self.preview.show_pixmap(pixmap, item_)
+
+    def hide_preview(self, item_: QWidget = None) -> None:
+        if item_ is not None and item_ is not self.hovered:
+            return
+        self.hovered = None
+        self.preview.hide()
+
+    def pixmap_ready_action(self, img_path_: str, pixmap_: QPixmap) -> None:
+        if self.hovered is not None and self.hovered.img_path == img_path_ and self.hovered.underMouse():
+            self.preview.show_pixmap(pixmap_, self.hovered)
+
+    def scroll_action(self, value_: int) -> None:
+        if value_ != self.last_scroll_value:
+            self.scroll_direction = 1 if value_ > self.last_scroll_value else -1
+        self.last_scroll_value = value_
+        self.hide_preview()
+        self.schedule_prefetch()
+
+    def schedule_prefetch(self) -> None:
+        self.prefetch_timer.start()
+
+    def prefetch_action(self) -> None:
+        content = self.scroll_area.widget()
+        top = self.scroll_area.verticalScrollBar().value()
+        bottom = top + self.scroll_area.viewport().height()
+        shown = [item for item in self.items if item.isVisible()]
+        visible = []
+        for i, item in enumerate(shown):
+            y = item.mapTo(content, QPoint(0, 0)).y()
+            if y + item.height() >= top and y <= bottom:
+                visible.append(i)
+        if not visible:
+            self.loader.prefetch([])
+            return
+
+        if self.scroll_direction > 0:
+            ahead = shown[visible[-1] + 1:visible[-1] + 1 + cf.DEFAULT_PREFETCH_COUNT]
+        else:
+            ahead = shown[max(0, visible[0] - cf.DEFAULT_PREFETCH_COUNT):visible[0]][::-1]
+        paths = [(shown[i].img_path, VISIBLE_PRIORITY) for i in visible]
+        paths += [(item.img_path, PREFETCH_PRIORITY) for item in ahead]
+        self.loader.prefetch(paths)
+
+    def stop(self) -> None:
+        self.prefetch_timer.stop()
+        self.loader.cancel_all()
+        self.hide_preview()
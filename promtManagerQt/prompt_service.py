@@ -0,0 +1,245 @@
+"""
+Local JSON service over the prompt catalog for automation clients.
+
+Run from this directory, like main.py:
+    python prompt_service.py --port 8765
+
+GET  /models
+GET  /catalog/<model>[?path=Face/Add Some Details&depth=2]
+GET  /search?q=<text>[&model=<model>&limit=50]
+GET  /convert?prompt=<prompt>&model=<model>
+POST /compose {"model": ..., "text": ..., "terms": [...], "flags": {...}}
+"""
+import argparse
+import json
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from catalog import MODEL_TYPES, TermIndex, load_catalog, normalize_term
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_SEARCH_LIMIT = 50
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class ServiceError(Exception):
+    def __init__(self, status_: HTTPStatus, message_: str):
+        super().__init__(message_)
+        self.status = status_
+
+
+def prune_tree(node_: dict, depth_: int | None) -> dict:
+    if 'params' not in node_:
+        return node_
+    if depth_ is not None and depth_ <= 0:
+        return {key: value for key, value in node_.items() if key != 'params'}
+    pruned = dict(node_)
+    pruned['params'] = [prune_tree(child, None if depth_ is None else depth_ - 1) for child in node_['params']]
+    return pruned
+
+
+class PromptService:
+    """
+    Request handling without any HTTP or Qt code.
+
+    The catalogs are parsed once (catalog.load_catalog is shared with the GUI) and every
+    response is memoized, so repeated requests cost a dictionary lookup.
+    """
+    def __init__(self, cache_size_: int = DEFAULT_CACHE_SIZE):
+        self.catalogs = {model_type: load_catalog(model_type) for model_type in MODEL_TYPES}
+        self.term_index = TermIndex(self.catalogs)
+        self.search_entries = self.__build_search_entries()
+        self.handle = lru_cache(maxsize=cache_size_)(self._handle)
+
+    def __build_search_entries(self) -> dict[str, list[tuple[str, dict]]]:
+        entries = dict()
+        for model_type, catalog in self.catalogs.items():
+            seen = dict()
+            stack = [(catalog, [])]
+            while stack:
+                node, path = stack.pop()
+                for child in reversed(node.get('params', [])):
+                    if child.get('type') == 'parameter':
+                        entry = seen.setdefault(child['name'], {
+                            'name': child['name'],
+                            'prompt': child.get('prompt', child['name']),
+                            'paths': [],
+                        })
+                        entry['paths'].append('/'.join(path))
+                    else:
+                        stack.append((child, path + [child['name']]))
+            entries[model_type] = [(normalize_term(name), entry) for name, entry in seen.items()]
+        return entries
+
+    def __check_model(self, model_type_: str) -> str:
+        if model_type_ not in self.catalogs:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown model '{model_type_}', expected one of {list(MODEL_TYPES)}")
+        return model_type_
+
+    def models(self) -> list[str]:
+        return list(MODEL_TYPES)
+
+    def catalog_tree(self, model_type_: str, path_: str = '', depth_: int | None = None) -> dict:
+        node = self.catalogs[self.__check_model(model_type_)]
+        for part in [part for part in path_.split('/') if part]:
+            children = {child['name']: child for child in node.get('params', []) if 'params' in child}
+            if part not in children:
+                raise ServiceError(HTTPStatus.NOT_FOUND, f"No section '{part}' in '{node['name']}'")
+            node = children[part]
+        return prune_tree(node, depth_)
+
+    def search(self, query_: str, model_type_: str | None = None, limit_: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+        query = normalize_term(query_)
+        if not query:
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "Empty search query")
+        model_types = [self.__check_model(model_type_)] if model_type_ else list(MODEL_TYPES)
+        result = []
+        for model_type in model_types:
+            for term, entry in self.search_entries[model_type]:
+                if query in term:
+                    if len(result) >= limit_:
+                        return result
+                    result.append(dict(entry, model=model_type))
+        return result
+
+    def convert(self, prompt_: str, model_type_: str) -> dict:
+        prompt, names = self.term_index.convert_prompt(prompt_, self.__check_model(model_type_))
+        return {'prompt': prompt, 'terms': names}
+
+    def compose(self, request_: dict) -> dict:
+        model_type = self.__check_model(request_.get('model', ''))
+        terms = request_.get('terms', [])
+        if not isinstance(terms, list) or not all(map(self.__is_term, terms)):
+            raise ServiceError(HTTPStatus.BAD_REQUEST,
+                               "'terms' must be a list of names or {\"name\": string, \"weight\": number} objects")
+        text = request_.get('text', '')
+        if not isinstance(text, str):
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "'text' must be a string")
+        flags = request_.get('flags', dict())
+        if not isinstance(flags, dict) or not all(map(self.__is_flag_value, flags.values())):
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "'flags' must be an object of strings, numbers or true")
+        prompt, unresolved = self.term_index.compose_prompt(model_type, terms, text, flags)
+        return {'prompt': prompt, 'unresolved': unresolved}
+
+    @staticmethod
+    def __is_term(term_) -> bool:
+        if isinstance(term_, str):
+            return True
+        if not isinstance(term_, dict) or not isinstance(term_.get('name'), str):
+            return False
+        weight = term_.get('weight', 1)
+        return isinstance(weight, (int, float)) and not isinstance(weight, bool)
+
+    @staticmethod
+    def __is_flag_value(value_) -> bool:
+        return value_ is True or isinstance(value_, (str, int, float)) and not isinstance(value_, bool)
+
+    def _handle(self, method_: str, url_: str, body_: bytes = b'') -> tuple[int, bytes]:
+        try:
+            payload = self.__route(method_, url_, body_)
+            status = HTTPStatus.OK
+        except ServiceError as e:
+            payload = {'error': str(e)}
+            status = e.status
+        return int(status), json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    def __route(self, method_: str, url_: str, body_: bytes):
+        url = urlsplit(url_)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if method_ == 'GET' and parts == ['models']:
+            return self.models()
+        if method_ == 'GET' and len(parts) == 2 and parts[0] == 'catalog':
+            depth = query.get('depth')
+            if depth is not None and not depth.isdigit():
+                raise ServiceError(HTTPStatus.BAD_REQUEST, "'depth' must be a non-negative integer")
+            return self.catalog_tree(parts[1], query.get('path', ''), None if depth is None else int(depth))
+        if method_ == 'GET' and parts == ['search']:
+            limit = query.get('limit', str(DEFAULT_SEARCH_LIMIT))
+            if not limit.isdigit():
+                raise ServiceError(HTTPStatus.BAD_REQUEST, "'limit' must be a non-negative integer")
+            return self.search(query.get('q', ''), query.get('model'), int(limit))
+        if method_ == 'GET' and parts == ['convert']:
+            return self.convert(query.get('prompt', ''), query.get('model', ''))
+        if method_ == 'POST' and parts == ['compose']:
+            try:
+                request = json.loads(body_ or b'{}')
+            except ValueError as e:
+                raise ServiceError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}")
+            if not isinstance(request, dict):
+                raise ServiceError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+            return self.compose(request)
+        raise ServiceError(HTTPStatus.NOT_FOUND, f"No endpoint {method_} {url.path}")
+
+
+class PromptRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this keep-alive clients stall on delayed ACKs.
+    disable_nagle_algorithm = True
+    service: PromptService = None
+    verbose = False
+
+    def __send(self, status_: int, payload_: bytes) -> None:
+        self.send_response(status_)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload_)))
+        self.end_headers()
+        self.wfile.write(payload_)
+
+    def do_GET(self) -> None:
+        self.__send(*self.service.handle('GET', self.path))
+
+    def __reject(self, status_: HTTPStatus, message_: str) -> None:
+        # The body is left unread, so the connection cannot be reused.
+        self.close_connection = True
+        self.__send(status_, json.dumps({'error': message_}, ensure_ascii=False).encode('utf-8'))
+
+    def do_POST(self) -> None:
+        length = self.headers.get('Content-Length', '0').strip()
+        if not length.isdigit():
+            self.__reject(HTTPStatus.BAD_REQUEST, f"Invalid Content-Length '{length}'")
+            return
+        if int(length) > MAX_BODY_BYTES:
+            self.__reject(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Request body over {MAX_BODY_BYTES} bytes")
+            return
+        self.__send(*self.service.handle('POST', self.path, self.rfile.read(int(length))))
+
+    def log_message(self, format_, *args) -> None:
+        if self.verbose:
+            super().log_message(format_, *args)
+
+
+def make_server(host_: str = DEFAULT_HOST, port_: int = DEFAULT_PORT, cache_size_: int = DEFAULT_CACHE_SIZE,
+                verbose_: bool = False) -> ThreadingHTTPServer:
+    handler = type('BoundPromptRequestHandler', (PromptRequestHandler,),
+                   {'service': PromptService(cache_size_), 'verbose': verbose_})
+    server = ThreadingHTTPServer((host_, port_), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the prompt catalog as JSON on localhost.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.cache_size, args.verbose)
+    print(f"Prompt service on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Load test for prompt_service against localhost.
+
+    python prompt_service.py &
+    python prompt_service_load_test.py --clients 16 --duration 10 --min-rps 2000
+
+Exits with a non-zero status when the measured throughput is below --min-rps
+or when any request fails.
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from prompt_service import DEFAULT_HOST, DEFAULT_PORT
+
+
+SEARCH_QUERIES = ["by", "light", "watercolor", "cinematic", "van", "portrait", "neon", "oil", "carving", "4k"]
+CONVERT_PROMPTS = ["by_Andy_Warhol::2 Illustration --ar 16:9", "cat in a hat Watercolor --tile", "Linocut by_Claude_Monet"]
+MODELS = ["Midjourney", "DreamStudio", "Stable Diffusion"]
+
+
+def make_requests(seed_: int) -> list[tuple[str, str, bytes]]:
+    rnd = random.Random(seed_)
+    requests = [("GET", "/models", b"")]
+    for model in MODELS:
+        requests.append(("GET", f"/catalog/{quote(model)}?depth=2", b""))
+        requests.append(("GET", f"/catalog/{quote(model)}?path=Face/Add%20Some%20Details&depth=1", b""))
+    for query in SEARCH_QUERIES:
+        requests.append(("GET", f"/search?q={quote(query)}&model={quote(rnd.choice(MODELS))}&limit=20", b""))
+    for prompt in CONVERT_PROMPTS:
+        requests.append(("GET", f"/convert?prompt={quote(prompt)}&model={quote(rnd.choice(MODELS))}", b""))
+    for _ in range(20):
+        body = {
+            "model": rnd.choice(MODELS),
+            "text": "a red fox in the snow",
+            "terms": [{"name": "by_Claude_Monet", "weight": rnd.randint(1, 3)}, "Illustration"],
+            "flags": {"ar": rnd.choice(["16:9", "1:1", "4:5"]), "chaos": rnd.randint(0, 100)},
+        }
+        requests.append(("POST", "/compose", json.dumps(body).encode("utf-8")))
+    return requests
+
+
+class Client(threading.Thread):
+    def __init__(self, host_: str, port_: int, requests_: list, deadline_: float, seed_: int):
+        super().__init__(daemon=True)
+        self.host = host_
+        self.port = port_
+        self.requests = requests_
+        self.deadline = deadline_
+        self.rnd = random.Random(seed_)
+        self.latencies = []
+        self.errors = 0
+
+    def run(self) -> None:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        while time.perf_counter() < self.deadline:
+            method, url, body = self.rnd.choice(self.requests)
+            headers = {"Content-Type": "application/json"} if body else {}
+            start = time.perf_counter()
+            try:
+                connection.request(method, url, body=body or None, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    self.errors += 1
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+                continue
+            self.latencies.append(time.perf_counter() - start)
+        connection.close()
+
+
+def percentile(sorted_values_: list[float], q_: float) -> float:
+    if not sorted_values_:
+        return 0.0
+    return sorted_values_[min(len(sorted_values_) - 1, int(q_ * len(sorted_values_)))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure prompt_service throughput and latency.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--min-rps", type=float, default=0.0, help="fail if throughput is below this target")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    requests = make_requests(args.seed)
+    deadline = time.perf_counter() + args.duration
+    clients = [Client(args.host, args.port, requests, deadline, args.seed + i) for i in range(args.clients)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    errors = sum(client.errors for client in clients)
+    rps = len(latencies) / elapsed if elapsed > 0 else 0.0
+    print(f"clients={args.clients} duration={elapsed:.2f}s requests={len(latencies)} errors={errors}")
+    print(f"throughput={rps:.0f} req/s")
+    print("latency ms: p50={0:.2f} p95={1:.2f} p99={2:.2f} max={3:.2f}".format(
+        *(1000 * percentile(latencies, q) for q in (0.5, 0.95, 0.99, 1.0))))
+
+    if errors or rps < args.min_rps:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
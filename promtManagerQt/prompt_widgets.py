@@ -1,11 +1,15 @@
 import pyperclip
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, \
     QVBoxLayout, QPushButton, QLayout, QLineEdit, QLabel, QGridLayout, \
-    QHBoxLayout, QScrollArea, QSizePolicy, QCheckBox, QSlider
+    QHBoxLayout, QScrollArea, QSizePolicy, QCheckBox, QSlider, QMenu
 from PySide6.QtGui import QPixmap, QIntValidator
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
+from contextlib import contextmanager
+from itertools import groupby
+from image_preview import ImagePreviewManager
+from catalog import TermIndex, MODEL_TYPES, CATALOG_PATH, load_catalog, load_catalog_file, tokenize_prompt, split_weight, \
+    add_terms, remove_terms
 import config as cf
-import json
 
 
 def widget_delete(widget_: QWidget | QLayout) -> None:
@@ -39,6 +43,11 @@ class WindowManager(QWidget):
         self.midjourney_widget = MidjourneyModelWidget(self)
         self.dream_studio_widget = DreamStudioModelWidget(self)
         self.stable_diffusion_widget = StableDiffusionModelWidget(self)
+        self.model_widgets = {
+            widget.model_type: widget
+            for widget in (self.midjourney_widget, self.dream_studio_widget, self.stable_diffusion_widget)
+        }
+        self.term_index = TermIndex({model_type: load_catalog(model_type) for model_type in self.model_widgets})
         
         self.active_widget = self.menu_widget
         self._widgets_to_layout()
@@ -72,6 +81,13 @@ class WindowManager(QWidget):
 
     def run_menu(self) -> None:
         self.__run_widget(self.menu_widget)
+
+    def convert_prompt(self, source_widget_, model_type_: str) -> None:
+        target_widget = self.model_widgets[model_type_]
+        source_widget_.prompt_edit.flush()
+        prompt, names = self.term_index.convert_prompt(source_widget_.prompt_edit.prompt, model_type_)
+        target_widget.apply_prompt(prompt, names)
+        self.__run_widget(target_widget)
     
     def exit(self) -> None:
         self.main_window.exit()
@@ -127,37 +143,58 @@ class ICentralWidget(QWidget):
 
 
 class PromptEdit(QLineEdit):
+    # Changes are queued and rendered with a single setText per event-loop tick (or at the end of
+    # a batch()), so bulk selection costs one textChanged instead of one per term.
     def __init__(self, parent_: QWidget):
         super().__init__(parent_)
         self.prompt = ""
+        self.__changes = []
+        self.__batch_depth = 0
+        self.__flush_scheduled = False
         self.setText(self.prompt)
         self.textChanged.connect(self.changed_prompt_action)
-    
+
+    @contextmanager
+    def batch(self):
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            self.flush()
+
+    def __queue(self, kind_: str, str_: str) -> None:
+        self.__changes.append((kind_, str_))
+        if self.__batch_depth == 0 and not self.__flush_scheduled:
+            self.__flush_scheduled = True
+            QTimer.singleShot(0, self.flush)
+
+    def flush(self) -> None:
+        if self.__batch_depth > 0:
+            return
+        self.__flush_scheduled = False
+        if not self.__changes:
+            return
+        prompt = self.prompt
+        for kind, changes in groupby(self.__changes, key=lambda change: change[0]):
+            values = [value for _, value in changes]
+            if kind == 'set':
+                prompt = values[-1]
+            elif kind == 'add':
+                prompt = add_terms(prompt, values)
+            else:
+                prompt = remove_terms(prompt, values)
+        self.__changes.clear()
+        self.setText(prompt)
+
     def add_prompt(self, str_: str) -> None:
-        if len(self.prompt) > 0:
-            self.setText(self.prompt + " " + str_)
-        else:
-            self.setText(str_)
+        self.__queue('add', str_)
     
     def set_prompt(self, new_prompt_: str) -> None:
-        self.setText(new_prompt_)
+        self.__queue('set', new_prompt_)
 
     def remove_prompt(self, str_: str) -> None:
-        i = self.prompt.find(str_)
-        while i != -1:
-            if i != 0 and self.prompt[i - 1] != ' ':
-                i = self.prompt[i + len(str_):].find(str_)
-                continue
-            j = i + len(str_)
-            if j >= len(self.prompt):
-                self.set_prompt(self.prompt[:i])
-                return
-            while j < len(self.prompt) and (self.prompt[j].isdigit() or self.prompt[j] == ':'):
-                j += 1
-            self.prompt = self.prompt[:i] + self.prompt[j:]
-            i = self.prompt.find(str_)
-        self.set_prompt(self.prompt)
-        # self.set_prompt(self.prompt.replace(str_, ''))
+        self.__queue('remove', str_)
     
     def changed_prompt_action(self, text_: str) -> None:
         self.prompt = text_
@@ -175,11 +212,15 @@ class SectionList(WidgetList):
 
 
 class SectionItem(QWidget):
-    def __init__(self, name_: str, prompt_edit_, img_path_: str = cf.DEFAULT_IMG_PATH, hint_: str = cf.DEFAULT_HINT, parent_: QWidget = None):
+    def __init__(self, name_: str, prompt_edit_, img_path_: str = cf.DEFAULT_IMG_PATH, hint_: str = cf.DEFAULT_HINT, parent_: QWidget = None,
+                 preview_manager_: ImagePreviewManager = None):
         super().__init__(parent_)
         self.name = name_
         self.weight = 1
         self.prompt_edit = prompt_edit_
+        self.img_path = img_path_
+        self.preview_manager = preview_manager_
+        self.is_selected = False
         self.hint = hint_
         self.setToolTip(self.hint)
         self.setStyleSheet('QToolTip {color: black;}')
@@ -199,6 +240,8 @@ class SectionItem(QWidget):
 
         self.setFixedSize(cf.DEFAULT_MAXIMUM_IMG_SIZE)
         self._widgets_to_layout()
+        if self.preview_manager is not None:
+            self.preview_manager.add_item(self)
 
     def __init_buttons(self) -> None:
         self.remove_prompt_btn.clicked.connect(self.remove_prompt_action)
@@ -222,9 +265,18 @@ class SectionItem(QWidget):
     def mousePressEvent(self, event_) -> None:
         self.add_to_prompt_action()
 
+    def enterEvent(self, event_) -> None:
+        if self.preview_manager is not None:
+            self.preview_manager.show_preview(self)
+        super().enterEvent(event_)
+
+    def leaveEvent(self, event_) -> None:
+        if self.preview_manager is not None:
+            self.preview_manager.hide_preview(self)
+        super().leaveEvent(event_)
+
     def remove_prompt_action(self) -> None:
-        self.add_to_prompt_btn.setVisible(True)
-        self.remove_prompt_btn.setVisible(False)
+        self.set_selected(False)
         self.prompt_edit.remove_prompt(self.name)
 
     def weight_edit_action(self, text_: str) -> None:
@@ -232,9 +284,13 @@ class SectionItem(QWidget):
         if self.weight < 0:
             self.weight = 0
 
+    def set_selected(self, is_selected_: bool = True) -> None:
+        self.is_selected = is_selected_
+        self.add_to_prompt_btn.setVisible(not is_selected_)
+        self.remove_prompt_btn.setVisible(is_selected_)
+
     def add_to_prompt_action(self) -> None:
-        self.add_to_prompt_btn.setVisible(False)
-        self.remove_prompt_btn.setVisible(True)
+        self.set_selected(True)
         prompt = self.name
         if self.weight != 1:
             prompt = prompt + '::' + str(self.weight)
@@ -242,15 +298,19 @@ class SectionItem(QWidget):
 
 
 class SettingsSectionWidget(QWidget):
-    def __init__(self, name_: str, prompt_edit_, parent_: QWidget = None):
+    def __init__(self, name_: str, prompt_edit_, parent_: QWidget = None, preview_manager_: ImagePreviewManager = None):
         super().__init__(parent_)
         self.prompt_edit = prompt_edit_
+        self.preview_manager = preview_manager_
         self.is_active = True
         self.button = QPushButton(name_, self)
         self.button.setFixedHeight(40)
         self.button.setMaximumWidth(300)
         self.button.setStyleSheet(cf.DEFAULT_BUTTON_STYLE_SHEET)
         self.button.clicked.connect(self.open_section_action)
+        self.select_all_btn = QPushButton("Выбрать все", self)
+        self.clear_btn = QPushButton("Очистить", self)
+        self.__init_buttons()
         self.section_list = SectionList(self)
         self.max_items_in_row = 5
         self.max_sections_in_row = 1
@@ -258,6 +318,14 @@ class SettingsSectionWidget(QWidget):
         self.open_section_action()
         self._widgets_to_layout()
 
+    def __init_buttons(self) -> None:
+        for button in (self.select_all_btn, self.clear_btn):
+            button.setFixedHeight(40)
+            button.setMaximumWidth(150)
+            button.setStyleSheet(cf.DEFAULT_BUTTON_STYLE_SHEET)
+        self.select_all_btn.clicked.connect(self.select_all_action)
+        self.clear_btn.clicked.connect(self.clear_action)
+
     def __get_minimum_height(self) -> int:
         max_height = 0
         for widget in self.section_list.widget_list:
@@ -270,20 +338,47 @@ class SettingsSectionWidget(QWidget):
         column = len(self.section_list.widget_list) % self.max_sections_in_row + 1
         self.section_list.add_widget(widget_, row, column, 1, 1)
 
-    def add_item(self, name_: str, img_path_: str = cf.DEFAULT_IMG_PATH, hint_: str = cf.DEFAULT_HINT) -> None:
+    def add_item(self, name_: str, img_path_: str = cf.DEFAULT_IMG_PATH, hint_: str = cf.DEFAULT_HINT) -> SectionItem:
         row = len(self.section_list.widget_list) // self.max_items_in_row
         column = len(self.section_list.widget_list) % self.max_items_in_row + 1
-        self.section_list.add_widget(SectionItem(name_, self.prompt_edit, img_path_, hint_, self), row, column, 1, 1)
+        item = SectionItem(name_, self.prompt_edit, img_path_, hint_, self, self.preview_manager)
+        self.section_list.add_widget(item, row, column, 1, 1)
+        return item
 
     def _widgets_to_layout(self) -> None:
         layout = QVBoxLayout()
-        layout.addWidget(self.button)
+        tmp_layout = QHBoxLayout()
+        tmp_layout.addWidget(self.button)
+        tmp_layout.addWidget(self.select_all_btn)
+        tmp_layout.addWidget(self.clear_btn)
+        tmp_layout.addStretch()
+        layout.addLayout(tmp_layout)
         layout.addWidget(self.section_list)
         self.setLayout(layout)
 
+    def select_all_action(self) -> None:
+        with self.prompt_edit.batch():
+            for widget in self.section_list.widget_list:
+                if isinstance(widget, SectionItem) and not widget.is_selected:
+                    widget.add_to_prompt_action()
+                elif isinstance(widget, SettingsSectionWidget):
+                    widget.select_all_action()
+
+    def clear_action(self) -> None:
+        with self.prompt_edit.batch():
+            for widget in self.section_list.widget_list:
+                if isinstance(widget, SectionItem) and widget.is_selected:
+                    widget.remove_prompt_action()
+                elif isinstance(widget, SettingsSectionWidget):
+                    widget.clear_action()
+                elif isinstance(widget, IParameterCheckBox):
+                    widget.checkbox.setChecked(False)
+
     def open_section_action(self) -> None:
         self.is_active = not self.is_active
         self.section_list.set_active(self.is_active)
+        if self.preview_manager is not None:
+            self.preview_manager.schedule_prefetch()
 
 
 class BaseImage(QWidget):
@@ -369,8 +464,10 @@ class IModelWidget(ICentralWidget):
         super().__init__(window_manager_)
         self.model_type = model_type_
         self.prompt_edit = PromptEdit(self)
+        self.section_items = dict()
 
         self.copy_btn = QPushButton("Копировать", self)
+        self.convert_btn = QPushButton("Перенести в", self)
         self.back_btn = QPushButton("Назад", self)
         self.__init_buttons()
 
@@ -379,12 +476,19 @@ class IModelWidget(ICentralWidget):
         self.scroll_area = QScrollArea(self)
         self.scroll_area.setWidget(self.base_image_selector)
         self.__scroll_init()
+        self.preview_manager = ImagePreviewManager(self.scroll_area, self)
 
         self._init_settings()
 
     def __init_buttons(self) -> None:
         self.copy_btn.clicked.connect(self.copy_action)
         self.copy_btn.setStyleSheet(cf.DEFAULT_BUTTON_STYLE_SHEET)
+        convert_menu = QMenu(self.convert_btn)
+        for model_type in MODEL_TYPES:
+            if model_type != self.model_type:
+                convert_menu.addAction(model_type, lambda model_type_=model_type: self.convert_action(model_type_))
+        self.convert_btn.setMenu(convert_menu)
+        self.convert_btn.setStyleSheet(cf.DEFAULT_BUTTON_STYLE_SHEET)
         self.back_btn.clicked.connect(self._to_menu)
         self.back_btn.setStyleSheet(cf.DEFAULT_BUTTON_STYLE_SHEET)
 
@@ -398,37 +502,57 @@ class IModelWidget(ICentralWidget):
         tmp_layout = QHBoxLayout()
         tmp_layout.addWidget(self.prompt_edit)
         tmp_layout.addWidget(self.copy_btn)
+        tmp_layout.addWidget(self.convert_btn)
         tmp_layout.addWidget(self.back_btn)
         layout.addLayout(tmp_layout)
         layout.addWidget(self.scroll_area)
         self.setLayout(layout)
 
     def _init_settings(self) -> None:
-        settings_builder = SettingsBuilder(f"resource/{self.model_type}.json", self)
+        settings_builder = SettingsBuilder(CATALOG_PATH.format(self.model_type), self)
         settings_builder.build()
 
+    def add_section_item(self, item_: SectionItem) -> None:
+        self.section_items.setdefault(item_.name, []).append(item_)
+
+    def apply_prompt(self, prompt_: str, names_: list[str]) -> None:
+        self.prompt_edit.flush()
+        with self.prompt_edit.batch():
+            for token in tokenize_prompt(self.prompt_edit.prompt):
+                for item in self.section_items.get(split_weight(token)[0], []):
+                    item.set_selected(False)
+            for checkbox in self.findChildren(IParameterCheckBox):
+                checkbox.set_checked_silently(False)
+            self.prompt_edit.set_prompt(prompt_)
+            for name in names_:
+                for item in self.section_items.get(name, []):
+                    item.set_selected(True)
+
     def copy_action(self) -> None:
+        self.prompt_edit.flush()
         pyperclip.copy(self.prompt_edit.prompt)
         # pyperclip.paste()
 
+    def convert_action(self, model_type_: str) -> None:
+        self.window_manager.convert_prompt(self, model_type_)
+
     def _to_menu(self) -> None:
+        self.preview_manager.stop()
         self.window_manager.run_menu()
 
 
 class SettingsBuilder:
     def __init__(self, filename_: str, model_widget_: IModelWidget):
-        self.data_dict = dict()
         self.model = model_widget_
-        with open(filename_) as file:
-            self.data_dict = json.load(file)
+        self.data_dict = load_catalog_file(filename_)
 
     def __configure_to_section(self, name_: str, data_: list) -> SettingsSectionWidget:
-        section = SettingsSectionWidget(name_, self.model.prompt_edit, self.model.base_image_selector)
+        section = SettingsSectionWidget(name_, self.model.prompt_edit, self.model.base_image_selector, self.model.preview_manager)
         for item in data_:
             if item['type'] == "section":
                 section.add_widget(self.__configure_to_section(item['name'], item['params']))
             elif item['type'] == "parameter":
-                section.add_item(item['name'], item['imgPath'], item['hint'] if 'hint' in item else cf.DEFAULT_HINT)
+                self.model.add_section_item(section.add_item(item['name'], item['imgPath'], item['hint'] if 'hint' in item else cf.DEFAULT_HINT))
         return section
 
     def build(self) -> None:
@@ -461,6 +585,11 @@ class IParameterCheckBox(QWidget):
     def set_active(self, is_active_: bool = True) -> None:
         self.setVisible(is_active_)
 
+    def set_checked_silently(self, is_checked_: bool) -> None:
+        self.checkbox.blockSignals(True)
+        self.checkbox.setChecked(is_checked_)
+        self.checkbox.blockSignals(False)
+
     def _widgets_to_layout(self) -> None:
         layout = QHBoxLayout()
         layout.addWidget(self.checkbox)
@@ -491,6 +620,7 @@ class ParameterCheckBoxSlider(IParameterCheckBox):
     def __init__(self, name_: str, prompt_: str, prompt_edit_, help_info_: str, minmaxdef_: list, parent_: QWidget = None):
         super().__init__(name_, prompt_, prompt_edit_, help_info_, parent_)
         self.minmaxdef = minmaxdef_
+        self.applied_value = None
 
         self.slider = QSlider(Qt.Horizontal, self)
         self.__init_slider()
@@ -530,13 +660,19 @@ class ParameterCheckBoxSlider(IParameterCheckBox):
         self.setLayout(layout)
 
     def remove_prompt_action(self) -> None:
-        self.prompt_edit.remove_prompt(self.prompt + '::' + str(self.slider.value()))
+        if self.applied_value is not None:
+            self.prompt_edit.remove_prompt(self.prompt + '::' + str(self.applied_value))
+            self.applied_value = None
 
     def add_to_prompt_action(self) -> None:
-        self.prompt_edit.add_prompt(self.prompt + '::' + str(self.slider.value()))
+        self.applied_value = self.slider.value()
+        self.prompt_edit.add_prompt(self.prompt + '::' + str(self.applied_value))
 
     def slider_changed_action(self) -> None:
         self.value_editor.setText(str(self.slider.value()))
+        if self.checkbox.isChecked() and self.applied_value != self.slider.value():
+            self.remove_prompt_action()
+            self.add_to_prompt_action()
 
     def value_edit_action(self, text_: str) -> None:
         iminus = text_.find('-')
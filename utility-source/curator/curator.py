@@ -0,0 +1,446 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+# Очистка папки с датасетом в формате "картинка + VOC XML" вместо renamer.py, annotater.py
+# и ячеек с поиском пар из union-clear-data.ipynb. Папка читается одним проходом os.scandir,
+# дальше этапы работают со списком в памяти:
+#   pairs     - отчет о файлах без пары и о нескольких картинках на одно имя;
+#   orphans   - перенос файлов без пары в .curator-orphans/<время> с записью в журнал (только явно, через --stages);
+#   rename    - переименование полных пар по шаблону через временные имена, с журналом для отката;
+#   normalize - приведение XML к единому виду VOC (в пуле процессов, с атомарной записью).
+# Для rename без normalize в XML все равно обновляются <filename> и <path>.
+#
+#   python curator.py ../../images/unprocessed/temp --stages pairs,orphans,rename,normalize --dry-run
+
+STAGES = ('pairs', 'orphans', 'rename', 'normalize')
+# orphans убирает файлы из папки, поэтому включается только явно.
+DEFAULT_STAGES = ('pairs', 'rename', 'normalize')
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
+ANNOTATION_EXTENSION = '.xml'
+JOURNAL_NAME = '.curator-journal.jsonl'
+TMP_PREFIX = '.curator-tmp-'
+QUARANTINE_DIR = '.curator-orphans'
+
+# Порядок дочерних элементов <object> в VOC.
+OBJECT_ORDER = ('name', 'pose', 'truncated', 'difficult', 'bndbox')
+OBJECT_DEFAULTS = {'pose': 'Unspecified', 'truncated': '0', 'difficult': '0'}
+
+FILENAME_RE = re.compile(rb'(<filename>)[^<]*(</filename>)')
+DIGITS_RE = re.compile(r'(\d+)')
+PATH_RE = re.compile(rb'(<path>[^<]*?)[^/\\<]*(</path>)')
+
+
+def scan(directory: str) -> dict:
+    """Один проход os.scandir: имя без расширения -> {расширение в нижнем регистре: имя файла}."""
+    groups = dict()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext in IMAGE_EXTENSIONS or ext == ANNOTATION_EXTENSION:
+                groups.setdefault(stem, dict())[ext] = entry.name
+    return groups
+
+
+def split_group(group: dict) -> tuple:
+    images = sorted(name for ext, name in group.items() if ext in IMAGE_EXTENSIONS)
+    return images, group.get(ANNOTATION_EXTENSION)
+
+
+def check_pairs(groups: dict) -> dict:
+    report = {'pairs': 0, 'images_without_xml': [], 'xml_without_image': [], 'multiple_images': []}
+    for stem in sorted(groups):
+        images, xml = split_group(groups[stem])
+        if not images:
+            report['xml_without_image'].append(xml)
+        elif xml is None:
+            report['images_without_xml'].extend(images)
+        else:
+            report['pairs'] += 1
+            if len(images) > 1:
+                report['multiple_images'].append(images)
+    return report
+
+
+def quarantine_orphans(directory: str, groups: dict, journal_path: str, dry_run: bool) -> list:
+    """
+    Переносит файлы без пары в QUARANTINE_DIR/<время запуска> внутри папки, ничего не удаляя.
+    Переносы пишутся в тот же журнал, что и переименования, так что --undo возвращает их на место.
+    """
+    moved = []
+    for stem in sorted(groups):
+        images, xml = split_group(groups[stem])
+        if images and xml is not None:
+            continue
+        moved.extend(sorted(groups.pop(stem).values()))
+
+    if not dry_run and moved:
+        quarantine = os.path.join(QUARANTINE_DIR, time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(os.path.join(directory, quarantine), exist_ok=True)
+        _apply_renames(directory, [{'old': name, 'tmp': f'{TMP_PREFIX}orphan-{i}-{name}',
+                                    'new': os.path.join(quarantine, name)}
+                                   for i, name in enumerate(moved)], journal_path)
+    return moved
+
+
+def natural_key(name: str) -> list:
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in DIGITS_RE.split(name) if part]
+
+
+def plan_renames(groups: dict, pattern: str, start: int) -> list:
+    """
+    Новые имена для пар в порядке имен, как в renamer.py, только числа сравниваются как числа:
+    так уже переименованная папка при повторном запуске остается как есть.
+
+    Переименовываются только полные пары картинка + XML: файлы без пары сохраняют свои имена,
+    чтобы несоответствие из отчета pairs можно было исправить вручную.
+
+    pattern - строка format с полем {index}, например "{index}-1" (расширение сохраняется).
+    """
+    plan = []
+    paired = [stem for stem in groups if all(split_group(groups[stem]))]
+    for index, stem in enumerate(sorted(paired, key=natural_key), start=start):
+        new_stem = pattern.format(index=index)
+        if new_stem == stem:
+            continue
+        for ext, name in sorted(groups[stem].items()):
+            plan.append((name, new_stem + os.path.splitext(name)[1]))
+    return plan
+
+
+def _apply_renames(directory: str, entries: list, journal_path: str):
+    """
+    Двухфазное переименование: сначала во временные имена, потом в новые, так что цепочки и циклы не мешают.
+    Записи одного вызова помечаются общим batch, чтобы откатывать их тоже вместе.
+    """
+    batch = time.time_ns()
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        for entry in entries:
+            journal.write(json.dumps(dict(entry, batch=batch), ensure_ascii=False) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+    for entry in entries:
+        os.rename(os.path.join(directory, entry['old']), os.path.join(directory, entry['tmp']))
+    for entry in entries:
+        os.rename(os.path.join(directory, entry['tmp']), os.path.join(directory, entry['new']))
+
+
+def rename_pairs(directory: str, groups: dict, pattern: str, start: int, journal_path: str, dry_run: bool) -> list:
+    plan = plan_renames(groups, pattern, start)
+    sources = {old for old, _ in plan}
+    targets = dict()
+    existing = {name for group in groups.values() for name in group.values()}
+    for old, new in plan:
+        if new in targets:
+            raise ValueError(f"Шаблон '{pattern}' дает одно имя {new} для {targets[new]} и {old}")
+        if new in existing and new not in sources:
+            raise ValueError(f'{new} уже есть в папке и не переименовывается, {old} некуда переименовать')
+        if os.path.exists(os.path.join(directory, new)) and new not in existing:
+            raise ValueError(f'{new} уже есть в папке')
+        targets[new] = old
+
+    if not dry_run and plan:
+        _apply_renames(directory, [{'old': old, 'tmp': f'{TMP_PREFIX}{i}-{old}', 'new': new}
+                                   for i, (old, new) in enumerate(plan)], journal_path)
+
+    renamed = dict(plan)
+    new_groups = dict()
+    for stem, group in groups.items():
+        for ext, name in group.items():
+            name = renamed.get(name, name)
+            new_groups.setdefault(os.path.splitext(name)[0], dict())[ext] = name
+    groups.clear()
+    groups.update(new_groups)
+    return plan
+
+
+def undo_renames(directory: str, journal_path: str) -> int:
+    """Откатывает журнал с конца по batch, в том числе прерванное на середине переименование."""
+    with open(journal_path, 'r', encoding='utf-8') as fin:
+        entries = [json.loads(line) for line in fin if line.strip()]
+    restored = 0
+    # Журналы без batch откатываются одной группой.
+    for _, batch in groupby(reversed(entries), key=lambda entry: entry.get('batch')):
+        batch = [{'old': entry['new'], 'tmp': entry['tmp'], 'new': entry['old']} for entry in batch]
+        for entry in batch:
+            current = os.path.join(directory, entry['old'])
+            tmp = os.path.join(directory, entry['tmp'])
+            if os.path.exists(current) and not os.path.exists(tmp):
+                os.rename(current, tmp)
+        for entry in batch:
+            tmp = os.path.join(directory, entry['tmp'])
+            if os.path.exists(tmp):
+                os.rename(tmp, os.path.join(directory, entry['new']))
+                restored += 1
+    os.remove(journal_path)
+    return restored
+
+
+def _set_text(element: ET.Element, text: str) -> bool:
+    if element.text == text:
+        return False
+    element.text = text
+    return True
+
+
+def normalize_annotation(root: ET.Element, folder: str, class_names: dict) -> bool:
+    """
+    То же, что делал annotater.modify_xml_files, но для всех объектов и без повторных вставок.
+
+    Returns:
+        bool: Было ли что-то изменено, чтобы не сериализовать XML зря.
+    """
+    changed = False
+    for segmented in root.findall('segmented'):
+        root.remove(segmented)
+        changed = True
+    for database in root.iter('database'):
+        if database.text == 'roboflow.ai':
+            changed |= _set_text(database, 'Unspecified')
+
+    for obj in root.iter('object'):
+        for polygon in obj.findall('polygon'):
+            obj.remove(polygon)
+            changed = True
+        name = obj.find('name')
+        if name is not None and name.text:
+            changed |= _set_text(name, class_names.get(name.text.strip().lower(), name.text.strip()))
+        for tag, value in OBJECT_DEFAULTS.items():
+            if obj.find(tag) is None:
+                ET.SubElement(obj, tag).text = value
+                changed = True
+        children = list(obj)
+        ordered = [child for tag in OBJECT_ORDER for child in children if child.tag == tag]
+        ordered += [child for child in children if child.tag not in OBJECT_ORDER]
+        if ordered != children:
+            obj[:] = ordered
+            changed = True
+
+    if folder:
+        folder_element = root.find('folder')
+        if folder_element is None:
+            folder_element = ET.Element('folder')
+            root.insert(0, folder_element)
+        changed |= _set_text(folder_element, folder)
+    return changed
+
+
+def set_filename(root: ET.Element, image_name: str, folder: str) -> bool:
+    changed = False
+    filename = root.find('filename')
+    if filename is None:
+        filename = ET.Element('filename')
+        root.insert(1, filename)
+    changed |= _set_text(filename, image_name)
+    if folder:
+        path = root.find('path')
+        if path is None:
+            path = ET.Element('path')
+            root.insert(list(root).index(filename) + 1, path)
+        changed |= _set_text(path, f'/{folder}/{image_name}')
+    return changed
+
+
+def replace_filename(data: bytes, image_name: str) -> bytes:
+    """Только переименование: меняет <filename> и последний компонент <path> без разбора XML."""
+    name = escape(image_name).encode('utf-8')
+    data = FILENAME_RE.sub(lambda m: m[1] + name + m[2], data, count=1)
+    return PATH_RE.sub(lambda m: m[1] + name + m[2], data, count=1)
+
+
+def process_xml(task: tuple) -> tuple:
+    """
+    Задача для пула процессов: поправить XML и записать через временный файл и os.replace.
+
+    Returns:
+        tuple: (имя файла, 'changed' | 'unchanged' | 'error', текст ошибки или None)
+    """
+    path, image_name, normalize, folder, class_names, dry_run = task
+    try:
+        with open(path, 'rb') as fin:
+            original = fin.read()
+        if normalize:
+            root = ET.fromstring(original)
+            changed = normalize_annotation(root, folder, class_names)
+            if image_name is not None:
+                changed |= set_filename(root, image_name, folder)
+            if not changed:
+                return path, 'unchanged', None
+            ET.indent(root)
+            data = ET.tostring(root, encoding='unicode').encode('utf-8')
+        else:
+            data = replace_filename(original, image_name) if image_name is not None else original
+        if data == original:
+            return path, 'unchanged', None
+        if not dry_run:
+            tmp_path = os.path.join(os.path.dirname(path), TMP_PREFIX + os.path.basename(path))
+            with open(tmp_path, 'wb') as fout:
+                fout.write(data)
+            os.replace(tmp_path, path)
+        return path, 'changed', None
+    except (OSError, ET.ParseError) as e:
+        return path, 'error', str(e)
+
+
+def rewrite_annotations(directory: str, groups: dict, normalize: bool, folder: str, class_names: dict,
+                        dry_run: bool, workers: int, on_disk: dict = None) -> dict:
+    """on_disk - новое имя -> имя на диске, для dry-run после rename, когда файлы не переименованы."""
+    on_disk = on_disk or dict()
+    tasks = []
+    for stem in sorted(groups):
+        images, xml = split_group(groups[stem])
+        if xml is None:
+            continue
+        tasks.append((os.path.join(directory, on_disk.get(xml, xml)), images[0] if images else None,
+                      normalize, folder, class_names, dry_run))
+
+    report = {'changed': 0, 'unchanged': 0, 'errors': []}
+    if workers <= 1 or len(tasks) < 2 * workers:
+        results = map(process_xml, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(process_xml, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+    try:
+        for path, status, error in results:
+            if status == 'error':
+                report['errors'].append({'file': os.path.basename(path), 'error': error})
+            else:
+                report[status] += 1
+    finally:
+        if workers > 1 and len(tasks) >= 2 * workers:
+            executor.shutdown()
+    return report
+
+
+def parse_class_names(values: list) -> dict:
+    class_names = dict()
+    for value in values:
+        old, sep, new = value.partition('=')
+        if not sep or not old or not new:
+            raise ValueError(f"Ожидается старое=новое, получено '{value}'")
+        class_names[old.strip().lower()] = new.strip()
+    return class_names
+
+
+def curate(directory: str, stages=DEFAULT_STAGES, dry_run: bool = False, pattern: str = '{index}-1', start: int = 1,
+           folder: str = 'my-project-name', class_names: dict = None, journal_path: str = None,
+           workers: int = None) -> dict:
+    """
+    Прогоняет выбранные этапы по папке и возвращает сводный отчет.
+
+    Args:
+        directory (str): Папка с картинками и XML.
+        stages (iterable): Этапы из STAGES, выполняются в порядке STAGES.
+        dry_run (bool): Только посчитать, ничего не менять на диске.
+        pattern (str): Шаблон нового имени пары для rename.
+        start (int): Первый номер для rename.
+        folder (str): Значение <folder> и префикс <path> в XML.
+        class_names (dict): Замена имен классов, ключи в нижнем регистре.
+        journal_path (str, optional): Журнал переименований и переносов, по умолчанию в самой папке.
+        workers (int, optional): Число процессов для XML, по умолчанию все ядра.
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f'Неизвестные этапы: {sorted(unknown)}, доступны {STAGES}')
+    workers = workers or os.cpu_count() or 1
+    class_names = {'person': 'Person'} if class_names is None else class_names
+    journal_path = journal_path or os.path.join(directory, JOURNAL_NAME)
+
+    groups = scan(directory)
+    report = {'directory': directory, 'dry_run': dry_run,
+              'files': sum(len(group) for group in groups.values())}
+    if 'pairs' in stages:
+        report['pairs'] = check_pairs(groups)
+    if 'orphans' in stages:
+        report['quarantined'] = quarantine_orphans(directory, groups, journal_path, dry_run)
+        report['journal'] = journal_path if report['quarantined'] and not dry_run else None
+    renamed = []
+    on_disk = dict()
+    if 'rename' in stages:
+        renamed = rename_pairs(directory, groups, pattern, start, journal_path, dry_run)
+        report['renamed'] = len(renamed)
+        report['journal'] = report.get('journal') or (journal_path if renamed and not dry_run else None)
+        if dry_run:
+            on_disk = {new: old for old, new in renamed}
+    if 'normalize' in stages or renamed:
+        report['annotations'] = rewrite_annotations(directory, groups, 'normalize' in stages, folder,
+                                                    class_names, dry_run, workers, on_disk)
+    return report
+
+
+def print_summary(report: dict) -> None:
+    prefix = '[dry-run] ' if report['dry_run'] else ''
+    print(f"{prefix}Файлов: {report['files']}")
+    if 'pairs' in report:
+        pairs = report['pairs']
+        print(f"Пар: {pairs['pairs']}, картинок без XML: {len(pairs['images_without_xml'])}, "
+              f"XML без картинки: {len(pairs['xml_without_image'])}, "
+              f"имен с несколькими картинками: {len(pairs['multiple_images'])}")
+    if 'quarantined' in report:
+        print(f"{prefix}Перенесено в {QUARANTINE_DIR} файлов без пары: {len(report['quarantined'])}"
+              + (f", журнал: {report['journal']}" if report['journal'] else ''))
+    if 'renamed' in report:
+        print(f"{prefix}Переименовано файлов: {report['renamed']}"
+              + (f", журнал: {report['journal']}" if report['journal'] else ''))
+    if 'annotations' in report:
+        annotations = report['annotations']
+        print(f"{prefix}XML изменено: {annotations['changed']}, без изменений: {annotations['unchanged']}, "
+              f"ошибок: {len(annotations['errors'])}")
+        for error in annotations['errors'][:10]:
+            print(f"  {error['file']}: {error['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Очистка датасета из картинок и VOC XML.')
+    parser.add_argument('directory')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help=f"этапы через запятую из {', '.join(STAGES)}, по умолчанию {','.join(DEFAULT_STAGES)}")
+    parser.add_argument('--dry-run', action='store_true', help='только показать, что будет сделано')
+    parser.add_argument('--pattern', default='{index}-1', help='шаблон нового имени пары, поле {index}')
+    parser.add_argument('--start', type=int, default=1)
+    parser.add_argument('--folder', default='my-project-name', help='значение <folder> в XML')
+    parser.add_argument('--class-name', action='append', default=None, metavar='OLD=NEW',
+                        help='замена имени класса (по умолчанию person=Person)')
+    parser.add_argument('--journal', help='журнал переименований и переносов')
+    parser.add_argument('--undo', action='store_true', help='откатить переименования и переносы по журналу')
+    parser.add_argument('--report', help='сохранить полный отчет в JSON')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.undo:
+        journal_path = args.journal or os.path.join(args.directory, JOURNAL_NAME)
+        print(f'Восстановлено файлов: {undo_renames(args.directory, journal_path)}')
+        # <filename> в XML должен снова указывать на старое имя картинки.
+        report = rewrite_annotations(args.directory, scan(args.directory), False, None, dict(), False,
+                                     args.workers or os.cpu_count() or 1)
+        print(f"XML изменено: {report['changed']}, ошибок: {len(report['errors'])}")
+        return 0
+
+    try:
+        class_names = None if args.class_name is None else parse_class_names(args.class_name)
+        stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+        report = curate(args.directory, stages, args.dry_run, args.pattern, args.start, args.folder,
+                        class_names, args.journal, args.workers)
+    except ValueError as e:
+        print(f'Ошибка: {e}')
+        return 1
+
+    print_summary(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as fout:
+            json.dump(report, fout, ensure_ascii=False, indent=2)
+    return 1 if report.get('annotations', {}).get('errors') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
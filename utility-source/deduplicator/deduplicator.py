@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Поиск почти одинаковых промтов: MinHash по шинглам из токенов + LSH по полосам сигнатуры.
+# Файл читается потоково за один проход, сигнатуры считаются в пуле процессов,
+# в памяти держится только компактный индекс уникальных промтов (без их текста).
+
+MAX_HASH = 0xFFFFFFFF
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_num_perm = None
+_seed = None
+_shingle_size = None
+
+
+def shingles(text: str, size: int) -> set:
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) <= size:
+        return {" ".join(tokens).encode("utf-8")} if tokens else set()
+    return {" ".join(tokens[i:i + size]).encode("utf-8") for i in range(len(tokens) - size + 1)}
+
+
+def minhash(shingle_set: set, num_perm: int, seed: bytes) -> list:
+    # Один вызов shake_128 дает num_perm независимых 32-битных хешей шингла,
+    # это быстрее, чем num_perm перестановок вида (a * h + b) mod p на Python.
+    if not shingle_set:
+        return [MAX_HASH] * num_perm
+    unpack = struct.Struct(f"<{num_perm}I").unpack
+    rows = [unpack(hashlib.shake_128(seed + shingle).digest(4 * num_perm)) for shingle in shingle_set]
+    return [min(column) for column in zip(*rows)]
+
+
+def _init_worker(num_perm: int, seed: bytes, shingle_size: int):
+    global _num_perm, _seed, _shingle_size
+    _num_perm = num_perm
+    _seed = seed
+    _shingle_size = shingle_size
+
+
+def _signatures(lines: list) -> list:
+    return [minhash(shingles(line, _shingle_size), _num_perm, _seed) for line in lines]
+
+
+def read_chunks(path: str, chunk_size: int):
+    chunk = []
+    with open(path, "r", encoding="utf-8") as fin:
+        for line in fin:
+            chunk.append(line.rstrip("\n"))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def signed_chunks(path: str, chunk_size: int, workers: int, num_perm: int, seed: bytes, shingle_size: int):
+    """Считает сигнатуры в пуле процессов, сохраняя порядок строк и ограничивая число чанков в работе."""
+    if workers <= 1:
+        _init_worker(num_perm, seed, shingle_size)
+        for chunk in read_chunks(path, chunk_size):
+            yield chunk, _signatures(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(num_perm, seed, shingle_size)) as executor:
+        in_flight = deque()
+        for chunk in read_chunks(path, chunk_size):
+            in_flight.append((chunk, executor.submit(_signatures, chunk)))
+            if len(in_flight) >= 2 * workers:
+                chunk, future = in_flight.popleft()
+                yield chunk, future.result()
+        while in_flight:
+            chunk, future = in_flight.popleft()
+            yield chunk, future.result()
+
+
+class LSHIndex:
+    """
+    Индекс уникальных промтов: полосы сигнатуры -> номера всех представителей с этой полосой
+    (одно число, пока представитель один, чтобы не заводить список на каждый ключ).
+
+    Сигнатуры представителей хранятся в одном array('I'), чтобы проверять
+    оценку сходства Жаккара у кандидатов без хранения текста.
+    """
+
+    def __init__(self, num_perm: int, bands: int):
+        if num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} must be divisible by bands={bands}")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [dict() for _ in range(bands)]
+        self.signatures = array("I")
+        self.lines = array("q")
+
+    def __len__(self):
+        return len(self.lines)
+
+    def _band_keys(self, signature: list) -> list:
+        return [hash(tuple(signature[i * self.rows:(i + 1) * self.rows])) for i in range(self.bands)]
+
+    def similarity(self, signature: list, index: int) -> float:
+        stored = self.signatures[index * self.num_perm:(index + 1) * self.num_perm]
+        return sum(1 for a, b in zip(signature, stored) if a == b) / self.num_perm
+
+    def query(self, signature: list, threshold: float):
+        """Возвращает (номер представителя, сходство) или None, если похожих нет."""
+        keys = self._band_keys(signature)
+        best, best_similarity = None, threshold
+        seen = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates = bucket.get(key)
+            if candidates is None:
+                continue
+            for index in (candidates,) if isinstance(candidates, int) else candidates:
+                if index in seen:
+                    continue
+                seen.add(index)
+                similarity = self.similarity(signature, index)
+                if similarity >= best_similarity:
+                    best, best_similarity = index, similarity
+        return (best, best_similarity) if best is not None else None
+
+    def add(self, signature: list, line_number: int) -> int:
+        index = len(self.lines)
+        self.signatures.extend(signature)
+        self.lines.append(line_number)
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates = bucket.get(key)
+            if candidates is None:
+                bucket[key] = index
+            elif isinstance(candidates, int):
+                bucket[key] = [candidates, index]
+            else:
+                candidates.append(index)
+        return index
+
+
+def deduplicate(input_path: str, output_path: str, clusters_path: str = None, duplicates_path: str = None,
+                threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle_size: int = 3,
+                workers: int = None, chunk_size: int = 2000, seed: int = 1) -> dict:
+    """
+    Оставляет первое вхождение каждой группы почти одинаковых промтов.
+
+    Args:
+        input_path (str): Файл с промтами, по одному на строку.
+        output_path (str): Куда записать промты без дубликатов.
+        clusters_path (str, optional): JSONL с группами: по записи на дубликат,
+            {"line": номер строки, "representative": номер строки представителя, "similarity": оценка}.
+        duplicates_path (str, optional): TSV "строка дубликата, строка представителя, сходство, текст".
+        threshold (float): Минимальная оценка сходства Жаккара для дубликата.
+        num_perm (int): Длина MinHash сигнатуры.
+        bands (int): Число полос LSH (num_perm должно делиться на bands).
+        shingle_size (int): Число токенов в шингле.
+        workers (int, optional): Число процессов, по умолчанию все ядра.
+        chunk_size (int): Число строк в задаче для процесса.
+        seed (int): Зерно для хеш-функций MinHash.
+
+    Returns:
+        dict: Итоговая статистика.
+    """
+    workers = workers or os.cpu_count() or 1
+    seed_prefix = seed.to_bytes(8, "little")
+    index = LSHIndex(num_perm, bands)
+    # По байту на представителя: есть ли у него дубликаты; сами группы пишутся потоково.
+    has_duplicates = bytearray()
+    total, skipped_empty, clusters = 0, 0, 0
+
+    dup_file = open(duplicates_path, "w", encoding="utf-8") if duplicates_path else None
+    clusters_file = open(clusters_path, "w", encoding="utf-8") if clusters_path else None
+    try:
+        with open(output_path, "w", encoding="utf-8") as fout:
+            for chunk, signatures in signed_chunks(input_path, chunk_size, workers, num_perm, seed_prefix, shingle_size):
+                for line, signature in zip(chunk, signatures):
+                    total += 1
+                    if not line.strip():
+                        skipped_empty += 1
+                        continue
+                    match = index.query(signature, threshold)
+                    if match is None:
+                        index.add(signature, total)
+                        has_duplicates.append(0)
+                        fout.write(line + "\n")
+                        continue
+                    representative, similarity = match
+                    if not has_duplicates[representative]:
+                        has_duplicates[representative] = 1
+                        clusters += 1
+                    if clusters_file is not None:
+                        clusters_file.write(json.dumps({"line": total, "representative": index.lines[representative],
+                                                        "similarity": round(similarity, 3)}) + "\n")
+                    if dup_file is not None:
+                        dup_file.write(f"{total}\t{index.lines[representative]}\t{similarity:.3f}\t{line}\n")
+    finally:
+        for file in (dup_file, clusters_file):
+            if file is not None:
+                file.close()
+
+    return {
+        "total": total,
+        "empty": skipped_empty,
+        "unique": len(index),
+        "duplicates": total - skipped_empty - len(index),
+        "clusters": clusters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Удаление почти одинаковых промтов (MinHash + LSH).")
+    parser.add_argument("input", help="файл с промтами, по одному на строку")
+    parser.add_argument("-o", "--output", help="файл без дубликатов (по умолчанию <input>.dedup.txt)")
+    parser.add_argument("--clusters", help="JSONL с группами дубликатов")
+    parser.add_argument("--duplicates", help="TSV со всеми найденными дубликатами")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--shingle-size", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.input)[0] + ".dedup.txt"
+    stats = deduplicate(args.input, output, args.clusters, args.duplicates, args.threshold, args.num_perm,
+                        args.bands, args.shingle_size, args.workers, args.chunk_size, args.seed)
+    print(f"Всего строк: {stats['total']}, уникальных: {stats['unique']}, дубликатов: {stats['duplicates']}, "
+          f"групп: {stats['clusters']}, пустых: {stats['empty']}")
+    print(f"Результат сохранен в {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+# Асинхронный клиент FusionBrain (Kandinsky): задачи отправляются окном ограниченного размера,
+# запросы проходят через token bucket, ошибки сети/429/5xx повторяются с экспоненциальной задержкой,
+# статусы всех задач опрашиваются параллельно. Манифест (JSONL, только дозапись) хранит
+# хеш промта -> uuid -> файл, поэтому повторный запуск пропускает готовое и дожидается начатого.
+
+DEFAULT_URL = 'https://api-key.fusionbrain.ai/'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GenerationError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Не больше rate запросов в секунду в среднем, с всплесками до capacity."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class JobManifest:
+    """
+    Журнал задач в формате JSONL, в который только дописываются строки.
+
+    Для каждого ключа (хеш запроса) действует последняя запись, поэтому
+    оборванный запуск восстанавливается простым перечитыванием файла.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = dict()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fin:
+                for line in fin:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # недописанная строка после падения
+                    self.records[record['key']] = record
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.file.tell() and not line.endswith('\n'):
+            self.file.write('\n')  # новые записи не должны приклеиться к обрывку
+
+    def get(self, key: str) -> dict | None:
+        return self.records.get(key)
+
+    def append(self, **record):
+        record['time'] = time.time()
+        self.records[record['key']] = record
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def job_key(query: str, model: int, width: int, height: int) -> str:
+    return hashlib.sha256(json.dumps([query, model, width, height], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class FusionBrainImageGenerator:
+    def __init__(self, url, api_key, secret_key, concurrency=4, rate=1.0, burst=2, max_retries=6,
+                 backoff=1.0, max_backoff=60.0, poll_interval=5.0, poll_attempts=120, request_timeout=60.0):
+        """
+        Args:
+            url (str): Адрес API, None - боевой адрес FusionBrain.
+            api_key (str): X-Key.
+            secret_key (str): X-Secret.
+            concurrency (int): Сколько задач одновременно может стоять в очереди сервиса.
+            rate (float): Средний предел запросов в секунду (все запросы, включая опрос статуса).
+            burst (int): Размер всплеска для token bucket.
+            max_retries (int): Повторы запроса при ошибках сети, 429 и 5xx.
+            backoff (float): Начальная задержка перед повтором, удваивается с каждой попыткой.
+            max_backoff (float): Верхняя граница задержки.
+            poll_interval (float): Пауза между опросами статуса одной задачи.
+            poll_attempts (int): Сколько раз опрашивать статус, прежде чем сдаться.
+            request_timeout (float): Таймаут одного HTTP запроса.
+        """
+        self.URL = DEFAULT_URL if url is None else url
+        self.AUTH_HEADERS = {
+            'X-Key': f'Key {api_key}',
+            'X-Secret': f'Secret {secret_key}',
+        }
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.bucket = None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.poll_attempts = poll_attempts
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout)
+
+    def session(self) -> aiohttp.ClientSession:
+        # Лимит запросов привязан к сессии: asyncio.Lock нельзя переносить между циклами событий.
+        self.bucket = TokenBucket(self.rate, self.burst)
+        return aiohttp.ClientSession(base_url=self.URL, headers=self.AUTH_HEADERS, timeout=self.timeout)
+
+    async def _request(self, session, method, path, data_factory=None):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            delay = None
+            try:
+                async with session.request(method, path, data=data_factory() if data_factory else None) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = response.headers.get('Retry-After')
+                        delay = float(retry_after) if retry_after and retry_after.isdigit() else None
+                        raise GenerationError(f'{method} {path}: HTTP {response.status}')
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, GenerationError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                    raise
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise GenerationError(f'{method} {path}: giving up after {self.max_retries} retries') from e
+                if delay is None:
+                    delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                    delay *= random.uniform(0.5, 1.0)
+                await asyncio.sleep(delay)
+
+    async def get_model(self, session):
+        data = await self._request(session, 'GET', 'key/api/v1/models')
+        return data[0]['id']
+
+    async def generate(self, session, prompt, model, images=1, width=1024, height=1024):
+        prompt = prompt if len(prompt) <= 1000 else prompt[:1000]
+        params = {
+          "type": "GENERATE",
+          "numImages": images,
+          "width": width,
+          "height": height,
+          "generateParams": {
+            "query": f"{prompt}"
+          }
+        }
+
+        def form():
+            data = aiohttp.FormData()
+            data.add_field('model_id', str(model))
+            data.add_field('params', json.dumps(params), content_type='application/json')
+            return data
+
+        data = await self._request(session, 'POST', 'key/api/v1/text2image/run', form)
+        return data['uuid']
+
+    async def check_generation(self, session, request_id):
+        for _ in range(self.poll_attempts):
+            data = await self._request(session, 'GET', 'key/api/v1/text2image/status/' + request_id)
+            if data['status'] == 'DONE':
+                return data['images']
+            if data['status'] == 'FAIL':
+                raise GenerationError(f"{request_id}: {data.get('errorDescription', 'generation failed')}")
+            await asyncio.sleep(self.poll_interval)
+        raise GenerationError(f'{request_id}: not ready after {self.poll_attempts} status checks')
+
+    async def _run_job(self, session, window, manifest, job, model, width, height):
+        key, query, file_name = job['key'], job['query'], job['file']
+        async with window:
+            record = manifest.get(key)
+            uuid = record['uuid'] if record and record['status'] == 'SUBMITTED' else None
+            if uuid is None:
+                uuid = await self.generate(session, query, model, width=width, height=height)
+                manifest.append(key=key, query=query, uuid=uuid, status='SUBMITTED', file=file_name)
+            try:
+                images = await self.check_generation(session, uuid)
+            except GenerationError as e:
+                manifest.append(key=key, query=query, uuid=uuid, status='FAILED', file=file_name, error=str(e))
+                return False
+
+        tmp_name = file_name + '.part'
+        with open(tmp_name, 'wb') as fout:
+            fout.write(base64.b64decode(images[0]))
+        os.replace(tmp_name, file_name)
+        manifest.append(key=key, query=query, uuid=uuid, status='DONE', file=file_name)
+        return True
+
+    async def run(self, prompts, output_dir, manifest_path=None, model=None, variants=2, width=1024, height=1024):
+        """
+        Генерирует variants картинок на каждый промт и сохраняет их как '<номер промта>-<вариант>.png'.
+
+        Одинаковые запросы отправляются один раз, уже готовые файлы из манифеста пропускаются,
+        а отправленные, но не дождавшиеся результата задачи дожидаются по сохраненному uuid.
+
+        Returns:
+            dict: Сколько задач выполнено, пропущено (готовы по манифесту), отброшено как дубликаты и провалено.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        manifest = JobManifest(manifest_path or os.path.join(output_dir, 'manifest.jsonl'))
+        stats = {'done': 0, 'skipped': 0, 'duplicates': 0, 'failed': 0}
+        try:
+            async with self.session() as session:
+                model = model if model is not None else await self.get_model(session)
+                jobs, keys = [], set()
+                for i, prompt in enumerate(prompts):
+                    for variant in range(variants):
+                        query = f'{variant}. {prompt.strip()}'
+                        key = job_key(query, model, width, height)
+                        if key in keys:
+                            stats['duplicates'] += 1
+                            continue
+                        keys.add(key)
+                        record = manifest.get(key)
+                        if record and record['status'] == 'DONE' and os.path.exists(record['file']):
+                            stats['skipped'] += 1
+                            continue
+                        file_name = os.path.join(output_dir, f'{i + 1}-{variant + 1}.png')
+                        jobs.append({'key': key, 'query': query, 'file': file_name})
+
+                window = asyncio.Semaphore(self.concurrency)
+                results = await asyncio.gather(
+                    *(self._run_job(session, window, manifest, job, model, width, height) for job in jobs),
+                    return_exceptions=True)
+                for result in results:
+                    if result is True:
+                        stats['done'] += 1
+                    else:
+                        stats['failed'] += 1
+                        if isinstance(result, BaseException):
+                            print(f'Ошибка: {result}')
+        finally:
+            manifest.close()
+        return stats
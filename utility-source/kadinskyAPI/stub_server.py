@@ -0,0 +1,182 @@
+import argparse
+import base64
+import email
+import email.policy
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка FusionBrain API для проверки fusion_brain.py без ключей и лимитов.
+# Имитирует очередь генерации: workers задач выполняются одновременно по generation_time секунд,
+# остальные ждут. Может отвечать 429 при превышении rps и случайными 503 для проверки повторов.
+#
+#   python stub_server.py --port 8090 --workers 2 --generation-time 3
+#   FusionBrainImageGenerator('http://127.0.0.1:8090/', 'key', 'secret', ...)
+
+# Прозрачная картинка 1x1 в PNG.
+STUB_IMAGE = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+    '0000000d49444154789c6360000002000001e221bc330000000049454e44ae426082')).decode('ascii')
+
+
+class StubQueue:
+    def __init__(self, workers, generation_time, rps, fail_rate, api_key, secret_key):
+        self.lock = threading.Lock()
+        self.slots = [0.0] * workers
+        self.generation_time = generation_time
+        self.rps = rps
+        self.fail_rate = fail_rate
+        self.auth = (f'Key {api_key}', f'Secret {secret_key}')
+        self.jobs = dict()
+        self.window = []
+        self.stats = {'submitted': 0, 'status': 0, 'throttled': 0, 'failed': 0}
+
+    def throttled(self) -> bool:
+        if not self.rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.rps:
+                self.stats['throttled'] += 1
+                return True
+            self.window.append(now)
+            return False
+
+    def submit(self, params) -> str:
+        with self.lock:
+            # Задача встает на освободившийся раньше всех исполнитель.
+            now = time.monotonic()
+            i = min(range(len(self.slots)), key=self.slots.__getitem__)
+            start = max(now, self.slots[i])
+            self.slots[i] = start + self.generation_time
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = {'start': start, 'ready': self.slots[i], 'params': params}
+            self.stats['submitted'] += 1
+            return job_id
+
+    def status(self, job_id) -> dict | None:
+        with self.lock:
+            self.stats['status'] += 1
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        now = time.monotonic()
+        if now >= job['ready']:
+            return {'uuid': job_id, 'status': 'DONE', 'images': [STUB_IMAGE] * job['params'].get('numImages', 1),
+                    'errorDescription': None, 'censored': False}
+        return {'uuid': job_id, 'status': 'PROCESSING' if now >= job['start'] else 'INITIAL'}
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    queue: StubQueue = None
+    verbose = False
+
+    def __send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __check(self) -> bool:
+        if (self.headers.get('X-Key'), self.headers.get('X-Secret')) != self.queue.auth:
+            self.__send(401, {'error': 'Unauthorized'})
+            return False
+        if self.queue.throttled():
+            self.__send(429, {'error': 'Too Many Requests'}, {'Retry-After': '1'})
+            return False
+        if self.queue.fail_rate and random.random() < self.queue.fail_rate:
+            self.queue.stats['failed'] += 1
+            self.__send(503, {'error': 'Service Unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.__check():
+            return
+        if self.path.rstrip('/') == '/key/api/v1/models':
+            self.__send(200, [{'id': 4, 'name': 'Kandinsky', 'version': 3.0, 'type': 'TEXT2IMAGE'}])
+            return
+        prefix = '/key/api/v1/text2image/status/'
+        if self.path.startswith(prefix):
+            status = self.queue.status(self.path[len(prefix):])
+            if status is None:
+                self.__send(404, {'error': 'Unknown uuid'})
+            else:
+                self.__send(200, status)
+            return
+        self.__send(404, {'error': f'No endpoint GET {self.path}'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.__check():
+            return
+        if self.path.rstrip('/') != '/key/api/v1/text2image/run':
+            self.__send(404, {'error': f'No endpoint POST {self.path}'})
+            return
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode('latin-1')
+        message = email.message_from_bytes(header + body, policy=email.policy.HTTP)
+        fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                  for part in message.iter_parts()} if message.is_multipart() else dict()
+        try:
+            params = json.loads(fields['params'])
+            int(fields['model_id'])
+            if not params['generateParams']['query']:
+                raise ValueError('empty query')
+        except (KeyError, TypeError, ValueError) as e:
+            self.__send(400, {'error': f'Bad request: {e}'})
+            return
+        self.__send(201, {'uuid': self.queue.submit(params), 'status': 'INITIAL'})
+
+    def log_message(self, format_, *args):
+        if self.verbose:
+            super().log_message(format_, *args)
+
+
+def make_server(host='127.0.0.1', port=8090, workers=2, generation_time=3.0, rps=0, fail_rate=0.0,
+                api_key='key', secret_key='secret', verbose=False) -> ThreadingHTTPServer:
+    queue = StubQueue(workers, generation_time, rps, fail_rate, api_key, secret_key)
+    handler = type('BoundStubRequestHandler', (StubRequestHandler,), {'queue': queue, 'verbose': verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.queue = queue
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка FusionBrain API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=2, help='сколько задач генерируется одновременно')
+    parser.add_argument('--generation-time', type=float, default=3.0, help='секунд на одну картинку')
+    parser.add_argument('--rps', type=int, default=0, help='лимит запросов в секунду, 0 - без лимита')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля случайных ответов 503')
+    parser.add_argument('--api-key', default='key')
+    parser.add_argument('--secret-key', default='secret')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.workers, args.generation_time, args.rps, args.fail_rate,
+                         args.api_key, args.secret_key, args.verbose)
+    print(f'Заглушка FusionBrain на http://{args.host}:{server.server_port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'Статистика: {server.queue.stats}')
+
+
+if __name__ == '__main__':
+    main()